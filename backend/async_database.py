@@ -0,0 +1,425 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple, TypeVar
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from database import (
+    DatabaseManager, ChangesExpiredError, HEAVY_FIELDS, MONGO_URI, DATABASE_NAME, MONGO_RETRIES,
+    SEARCH_MAX_CANDIDATES, VERSION_COUNTER, backoff_delay, collection_version, is_transient, merge_changes,
+    mongo_client_options, mongo_document, reservation, settled_version, stamp, tombstone
+)
+from search_index import SEARCH_FIELDS, TERMS_FIELD, query_groups, rank, search_filter, search_terms
+from image_similarity import BANDS_FIELD, IMAGE_DUPLICATE_MAX_DISTANCE, hamming, hash_bands
+from metrics import traced
+from models import Flashcard, trusted_flashcard
+
+T = TypeVar("T")
+
+# Documents read from local storage per worker-thread call when iterating
+LOCAL_PAGE_SIZE = 500
+
+
+class AsyncDatabaseManager:
+    """
+    Non-blocking database operations backed by Motor
+
+    Shares the storage mode, local fallback and write-behind queue of a
+    DatabaseManager, so a MongoDB failure seen here or there switches both to
+    local storage, and its health checker switches both back.
+    """
+
+    def __init__(self, database: DatabaseManager):
+        self.database = database
+        self.client = None
+        self._db = None
+
+    @property
+    def use_mongodb(self) -> bool:
+        return self.database.use_mongodb
+
+    @property
+    def in_memory_storage(self):
+        return self.database.in_memory_storage
+
+    @property
+    def db(self):
+        """Motor database, created on first use inside the running event loop"""
+        if self._db is None:
+            self.client = AsyncIOMotorClient(MONGO_URI, **mongo_client_options())
+            self._db = self.client[DATABASE_NAME]
+        return self._db
+
+    @property
+    def collection(self):
+        return self.db["flashcards"]
+
+    @property
+    def counters(self):
+        return self.db["counters"]
+
+    @property
+    def tombstones(self):
+        return self.db["flashcard_tombstones"]
+
+    def _fall_back(self, operation: str, error: Exception):
+        """Switch to local storage after a MongoDB failure"""
+        self.database._fall_back(operation, error)
+
+    def _buffer_writes(self, flashcard_ids: Iterable[str]):
+        """Queue flashcards written to local storage for replay to MongoDB"""
+        self.database._buffer_writes(flashcard_ids)
+
+    @asynccontextmanager
+    async def _reserve_versions(self, count: int = 1) -> AsyncIterator[int]:
+        """Reserve `count` consecutive flashcard versions for a write; see DatabaseManager._reserve_versions"""
+        token, update = reservation(count, self.database.known_version)
+        result = await self._retry(lambda: self.counters.find_one_and_update(
+            {"_id": VERSION_COUNTER},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ))
+        self.database._saw_version(result["version"])
+        try:
+            yield result["version"] - count + 1
+        finally:
+            try:
+                await self.counters.update_one({"_id": VERSION_COUNTER}, {"$pull": {"pending": {"token": token}}})
+            except ConnectionFailure:
+                pass  # The reservation expires after VERSION_LEASE_SECONDS
+
+    async def _local(self, operation: Callable[[], T]) -> T:
+        """Run a local storage call in a worker thread; shared mode takes file locks and fsyncs"""
+        return await asyncio.to_thread(operation)
+
+    async def _retry(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Await a MongoDB operation, retrying transient errors with backoff; see DatabaseManager._retry"""
+        for attempt in range(MONGO_RETRIES + 1):
+            try:
+                return await operation()
+            except ConnectionFailure as e:
+                if attempt == MONGO_RETRIES or not is_transient(e):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+
+    @traced("db.create_flashcard")
+    async def create_flashcard(self, flashcard: Flashcard) -> Flashcard:
+        """Create a new flashcard; returns it with its version"""
+        flashcard_dict = flashcard.model_dump()
+
+        if self.use_mongodb:
+            try:
+                async with self._reserve_versions() as version:
+                    stamp(flashcard_dict, version)
+                    await self.collection.insert_one(mongo_document(flashcard_dict))
+                return trusted_flashcard(flashcard_dict)
+            except ConnectionFailure as e:
+                self._fall_back("insert", e)
+
+        # Use in-memory storage
+        stored = await self._local(lambda: self.in_memory_storage.insert(flashcard_dict))
+        await self._local(lambda: self._buffer_writes([flashcard_dict["id"]]))
+        return trusted_flashcard(stored)
+
+    @traced("db.create_flashcards")
+    async def create_flashcards(self, flashcards: List[Flashcard]) -> List[Optional[str]]:
+        """
+        Create many flashcards in one bulk write
+
+        Args:
+            flashcards: Flashcards to create; their version and updated_at are set
+
+        Returns:
+            One entry per flashcard: None if it was saved, otherwise the error message
+        """
+        errors: List[Optional[str]] = [None] * len(flashcards)
+        if not flashcards:
+            return errors
+        documents = [flashcard.model_dump() for flashcard in flashcards]
+
+        if self.use_mongodb:
+            try:
+                async with self._reserve_versions(len(documents)) as first:
+                    for version, (flashcard, document) in enumerate(zip(flashcards, documents), first):
+                        stamp(document, version)
+                        flashcard.version, flashcard.updated_at = version, document["updated_at"]
+                    await self.collection.insert_many([mongo_document(document) for document in documents], ordered=False)
+                return errors
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    errors[write_error["index"]] = write_error.get("errmsg", "Insert failed")
+                return errors
+            except ConnectionFailure as e:
+                self._fall_back("insert", e)
+
+        # Use in-memory storage
+        stored_documents = await self._local(lambda: self.in_memory_storage.insert_many(documents))
+        for flashcard, stored in zip(flashcards, stored_documents):
+            flashcard.version, flashcard.updated_at = stored["version"], stored["updated_at"]
+        await self._local(lambda: self._buffer_writes(document["id"] for document in documents))
+        return errors
+
+    @traced("db.get_flashcard")
+    async def get_flashcard(self, flashcard_id: str) -> Optional[Flashcard]:
+        """Get a flashcard by ID"""
+        if self.use_mongodb:
+            try:
+                result = await self._retry(lambda: self.collection.find_one({"id": flashcard_id}, {"_id": 0}))
+                return trusted_flashcard(result) if result else None
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        flashcard_dict = await self._local(lambda: self.in_memory_storage.get(flashcard_id))
+        if flashcard_dict:
+            return trusted_flashcard(flashcard_dict)
+        return None
+
+    @traced("db.list_flashcards")
+    async def list_flashcards(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        include_image: bool = False
+    ) -> List[Flashcard]:
+        """
+        Get one page of flashcards ordered by ID
+
+        Args:
+            limit: Maximum number of flashcards to return
+            after_id: Return flashcards whose ID sorts after this one
+            include_image: Include the image field (left out by default)
+
+        Returns:
+            List of flashcards
+        """
+        return [
+            trusted_flashcard(data)
+            async for data in self.iter_flashcards(after_id=after_id, include_image=include_image, limit=limit)
+        ]
+
+    async def iter_flashcards(
+        self,
+        after_id: Optional[str] = None,
+        include_image: bool = False,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        Yield flashcard documents in ID order without materializing the whole collection
+
+        Args:
+            after_id: Start after this flashcard ID
+            include_image: Include the image field (left out by default)
+            limit: Maximum number of documents to yield (None for all)
+
+        Yields:
+            Flashcard documents as plain dicts
+        """
+        if self.use_mongodb:
+            try:
+                query = {"id": {"$gt": after_id}} if after_id else {}
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0}
+                if not include_image:
+                    projection.update({field: 0 for field in HEAVY_FIELDS})
+                cursor = self.collection.find(query, projection).sort("id", 1)
+                if limit:
+                    cursor = cursor.limit(limit)
+                # Fetch the first batch eagerly so connection errors fall back below
+                first = await cursor.next()
+            except StopAsyncIteration:
+                return
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+            else:
+                yield first
+                async for document in cursor:
+                    yield document
+                return
+
+        # Use in-memory storage, a page per worker-thread call
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = LOCAL_PAGE_SIZE if remaining is None else min(remaining, LOCAL_PAGE_SIZE)
+            page = await self._local(lambda: list(
+                self.in_memory_storage.iter(after_id=after_id, include_image=include_image, limit=size)
+            ))
+            for document in page:
+                yield document
+            if len(page) < size:
+                return
+            after_id = page[-1]["id"]
+            if remaining is not None:
+                remaining -= len(page)
+
+    @traced("db.update_flashcard")
+    async def update_flashcard(self, flashcard_id: str, update_data: dict) -> Optional[Flashcard]:
+        """Update a flashcard; see DatabaseManager.update_flashcard"""
+        # Remove None values from update_data
+        update_data = {k: v for k, v in update_data.items() if v is not None}
+
+        if self.use_mongodb:
+            try:
+                # A missing card must not use up a version (and change the collection ETag)
+                if not await self._retry(lambda: self.collection.find_one({"id": flashcard_id}, {"_id": 1})):
+                    return None
+                async with self._reserve_versions() as version:
+                    changes = stamp(dict(update_data), version)
+                    if "image_phash" in update_data:
+                        changes[BANDS_FIELD] = hash_bands(update_data["image_phash"]) if update_data["image_phash"] else []
+                    result = await self._retry(lambda: self.collection.find_one_and_update(
+                        {"id": flashcard_id},
+                        {"$set": changes},
+                        projection={"_id": 0},
+                        return_document=True
+                    ))
+                if result and any(field in update_data for field in SEARCH_FIELDS):
+                    await self._retry(lambda: self.collection.update_one(
+                        {"id": flashcard_id},
+                        {"$set": {TERMS_FIELD: search_terms(result)}}
+                    ))
+                return trusted_flashcard(result) if result else None
+            except ConnectionFailure as e:
+                self._fall_back("update", e)
+
+        # Use in-memory storage
+        return await self._local(lambda: self.database._update_locally(flashcard_id, update_data))
+
+    @traced("db.search_flashcards")
+    async def search_flashcards(self, query: str, limit: int = 20, fuzzy: bool = True) -> List[Flashcard]:
+        """Search flashcards; see DatabaseManager.search_flashcards"""
+        groups = query_groups(query, fuzzy)
+        if not groups:
+            return []
+
+        if self.use_mongodb:
+            try:
+                projection = {"_id": 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                candidates = await self._retry(
+                    lambda: self.collection.find(search_filter(groups), projection).to_list(length=SEARCH_MAX_CANDIDATES)
+                )
+                return [trusted_flashcard(data) for data in rank(candidates, groups, limit)]
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        results = await self._local(lambda: self.in_memory_storage.search(query, limit=limit, fuzzy=fuzzy))
+        return [trusted_flashcard(data) for data in results]
+
+    @traced("db.due_flashcards")
+    async def due_flashcards(self, now: float, limit: int) -> List[Flashcard]:
+        """Get flashcards due for review; see DatabaseManager.due_flashcards"""
+        if self.use_mongodb:
+            try:
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                documents = await self._retry(
+                    lambda: self.collection.find({"due": {"$lte": now}}, projection).sort([("due", 1), ("id", 1)]).to_list(length=limit)
+                )
+                return [trusted_flashcard(data) for data in documents]
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        results = await self._local(lambda: self.in_memory_storage.due(now, limit))
+        return [trusted_flashcard(data) for data in results]
+
+    @traced("db.find_similar_image")
+    async def find_similar_image(
+        self,
+        phash: str,
+        max_distance: int = IMAGE_DUPLICATE_MAX_DISTANCE
+    ) -> Optional[Tuple[Flashcard, int]]:
+        """Find the flashcard with the most similar image; see DatabaseManager.find_similar_image"""
+        if self.use_mongodb:
+            try:
+                candidates = await self._retry(lambda: self.collection.find(
+                    {BANDS_FIELD: {"$in": hash_bands(phash)}},
+                    {"_id": 0, "id": 1, "image_phash": 1}
+                ).to_list(length=None))
+                matches = sorted(
+                    (hamming(phash, candidate["image_phash"]), candidate["id"])
+                    for candidate in candidates if candidate.get("image_phash")
+                )
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                for distance, flashcard_id in matches:
+                    if distance > max_distance:
+                        break
+                    result = await self._retry(lambda: self.collection.find_one({"id": flashcard_id}, projection))
+                    if result:
+                        return trusted_flashcard(result), distance
+                return None
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        for distance, data in await self._local(lambda: self.in_memory_storage.similar_images(phash, max_distance)):
+            return trusted_flashcard(data), distance
+        return None
+
+    @traced("db.delete_flashcard")
+    async def delete_flashcard(self, flashcard_id: str) -> bool:
+        """Delete a flashcard, leaving a tombstone for change feeds; see DatabaseManager.delete_flashcard"""
+        if self.use_mongodb:
+            try:
+                # A missing card must not use up a version (and change the collection ETag)
+                if not await self._retry(lambda: self.collection.find_one({"id": flashcard_id}, {"_id": 1})):
+                    return False
+                async with self._reserve_versions() as version:
+                    result = await self._retry(lambda: self.collection.delete_one({"id": flashcard_id}))
+                    if result.deleted_count:
+                        await self._retry(lambda: self.tombstones.replace_one(
+                            {"id": flashcard_id}, tombstone(flashcard_id, version), upsert=True
+                        ))
+                return result.deleted_count > 0
+            except ConnectionFailure as e:
+                self._fall_back("delete", e)
+
+        # Use in-memory storage
+        return await self._local(lambda: self.database._delete_locally(flashcard_id))
+
+    @traced("db.flashcard_changes")
+    async def flashcard_changes(self, since: int, limit: int, include_image: bool = False) -> List[dict]:
+        """Get flashcards written and deleted after a version; see DatabaseManager.flashcard_changes"""
+        if self.use_mongodb:
+            try:
+                counter = await self._retry(lambda: self.counters.find_one({"_id": VERSION_COUNTER})) or {}
+                if since and since < counter.get("pruned", 0):
+                    raise ChangesExpiredError(f"Changes since version {since} are no longer available")
+                self.database._saw_version(counter.get("version", 0))
+                query = {"version": {"$gt": since, "$lte": settled_version(counter)}}
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0}
+                if not include_image:
+                    projection.update({field: 0 for field in HEAVY_FIELDS})
+                documents = await self._retry(
+                    lambda: self.collection.find(query, projection).sort("version", 1).to_list(length=limit)
+                )
+                tombstones = await self._retry(
+                    lambda: self.tombstones.find(query, {"_id": 0}).sort("version", 1).to_list(length=limit)
+                )
+                return merge_changes(documents, tombstones, limit)
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        changes = await self._local(lambda: self.in_memory_storage.changes(since, limit, include_image=include_image))
+        if since and since < self.in_memory_storage.tombstone_floor:
+            raise ChangesExpiredError(f"Changes since version {since} are no longer available")
+        return changes
+
+    @traced("db.flashcards_version")
+    async def flashcards_version(self) -> Optional[int]:
+        """Last version written to the flashcard collection, None while a write is landing; see DatabaseManager.flashcards_version"""
+        if self.use_mongodb:
+            try:
+                counter = await self._retry(lambda: self.counters.find_one({"_id": VERSION_COUNTER}))
+                return collection_version(counter)
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+
+        # Use in-memory storage
+        return await self._local(self.in_memory_storage.current_version)
+
+    def close(self):
+        """Close database connection"""
+        if self.client:
+            self.client.close()
@@ -0,0 +1,115 @@
+"""
+Round-trip benchmark for deck import/export
+
+Imports a generated deck, exports it, and imports the export again for each
+format, reporting throughput and peak RSS so memory stays bounded as decks grow.
+
+Usage:
+    python benchmarks/deck_roundtrip.py --cards 100000
+    python benchmarks/deck_roundtrip.py --store mongomock --formats ndjson,csv
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import configure_environment, install_fakes, peak_rss_mb, serving
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deck import/export round-trip benchmark")
+    parser.add_argument("--store", choices=["memory", "mongomock", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/", help="Used with --store mongo")
+    parser.add_argument("--cards", type=int, default=100000, help="Cards in the generated deck")
+    parser.add_argument("--formats", default="ndjson,csv,zip", help="Comma-separated export formats")
+    # install_fakes() expects these; the round trip never calls Gemini or gTTS
+    parser.set_defaults(gemini_latency=0.0, tts_latency=0.0)
+    return parser.parse_args()
+
+
+async def generate_deck(cards: int):
+    """Yield an NDJSON deck in chunks, never holding it all in memory"""
+    lines = []
+    for index in range(cards):
+        lines.append(json.dumps({
+            "original_text": f"word-{index}",
+            "translated_text": f"คำ-{index}",
+            "image_description": f"Description {index}"
+        }, ensure_ascii=False) + "\n")
+        if len(lines) == 1000:
+            yield "".join(lines).encode("utf-8")
+            lines = []
+    if lines:
+        yield "".join(lines).encode("utf-8")
+
+
+async def timed_import(client, body, format: str) -> dict:
+    response = await client.post("/flashcards/import", params={"format": format}, content=body)
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(args, main) -> list:
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with serving(args, main), httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        seeded = await timed_import(client, generate_deck(args.cards), "ndjson")
+        print(f"   seed import: {seeded['imported']} cards, {seeded['cards_per_second']} cards/s")
+
+        for format in [name.strip() for name in args.formats.split(",") if name.strip()]:
+            with tempfile.TemporaryFile() as export_file:
+                started = time.perf_counter()
+                async with client.stream("GET", "/flashcards/export", params={"format": format}) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        export_file.write(chunk)
+                export_seconds = time.perf_counter() - started
+                size = export_file.tell()
+                export_file.seek(0)
+
+                async def read_export():
+                    while True:
+                        chunk = export_file.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+
+                imported = await timed_import(client, read_export(), format)
+
+            result = {
+                "format": format,
+                "cards": args.cards,
+                "export_bytes": size,
+                "export_seconds": round(export_seconds, 3),
+                "export_cards_per_second": round(args.cards / export_seconds, 1) if export_seconds else 0.0,
+                "import_seconds": imported["seconds"],
+                "import_cards_per_second": imported["cards_per_second"],
+                "import_failed": imported["failed"],
+                "peak_rss_mb": peak_rss_mb()
+            }
+            results.append(result)
+            print(
+                f"{format:>7} export={result['export_cards_per_second']:>10} cards/s "
+                f"import={result['import_cards_per_second']:>10} cards/s "
+                f"size={size / 1024 / 1024:.1f}MB rss={result['peak_rss_mb']}MB"
+            )
+    return results
+
+
+def main_cli():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="flashcard-deck-bench-") as work_dir:
+        configure_environment(args, work_dir)
+        main = install_fakes(args)
+        asyncio.run(run(args, main))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,340 @@
+"""
+Offline load benchmark for the FastAPI backend
+
+Gemini and gTTS are replaced by local fakes with configurable latency, and the
+app is driven in-process through httpx's ASGI transport, so results reflect the
+backend itself rather than the network or third-party services.
+
+Usage:
+    python benchmarks/load_test.py --store memory
+    python benchmarks/load_test.py --store mongomock --concurrency 1,8,32 --requests 500
+    python benchmarks/load_test.py --store mongo --mongo-uri mongodb://localhost:27017/
+
+Results (p50/p95/p99 latency, RPS, peak RSS) are written as JSON so runs can be
+compared across commits.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+ENDPOINTS = ["list", "search", "due", "get", "create", "update", "delete", "generate", "image", "tts", "tts_cached"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the flashcards API")
+    parser.add_argument("--store", choices=["memory", "mongomock", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/", help="Used with --store mongo")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--seed", type=int, default=1000, help="Flashcards created before measuring")
+    parser.add_argument("--gemini-latency", type=float, default=300.0, help="Fake Gemini latency in ms")
+    parser.add_argument("--tts-latency", type=float, default=200.0, help="Fake gTTS latency in ms")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/load-<commit>.json)")
+    return parser.parse_args()
+
+
+def configure_environment(args, work_dir: str):
+    """Point every on-disk cache at a scratch directory before the app is imported"""
+    os.environ["TTS_CACHE_DIR"] = os.path.join(work_dir, "tts_cache")
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(work_dir, "image_store")
+    os.environ["MEMORY_STORE_DIR"] = os.path.join(work_dir, "data")
+    os.environ["JOB_UPLOAD_DIR"] = os.path.join(work_dir, "job_uploads")
+    os.environ["UPLOAD_DIR"] = os.path.join(work_dir, "uploads")
+    os.environ["DATABASE_NAME"] = f"flashcard_bench_{uuid.uuid4().hex[:8]}"
+    os.environ["MONGO_URI"] = args.mongo_uri
+    # Every simulated request comes from one client; measure the app, not the per-client limits
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+    import pymongo
+    from pymongo.errors import ServerSelectionTimeoutError
+
+    if args.store == "memory":
+        class UnreachableMongoClient:
+            """Fails the startup ping immediately instead of waiting for a timeout"""
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __getitem__(self, name):
+                return self
+
+            @property
+            def admin(self):
+                return self
+
+            def command(self, *args, **kwargs):
+                raise ServerSelectionTimeoutError("benchmark: in-memory store requested")
+
+            def close(self):
+                pass
+
+        pymongo.MongoClient = UnreachableMongoClient
+    elif args.store == "mongomock":
+        import mongomock
+        import mongomock.gridfs
+        mongomock.gridfs.enable_gridfs_integration()
+        pymongo.MongoClient = mongomock.MongoClient
+
+
+def install_fakes(args):
+    """Swap Gemini and gTTS for local fakes before the app starts; return the app module"""
+    import main
+    import tts_prefetch
+
+    gemini_delay = args.gemini_latency / 1000
+    tts_delay = args.tts_latency / 1000
+
+    class FakeGeminiService:
+        """Answers like GeminiService after a fixed delay"""
+
+        def __init__(self, *services):
+            pass
+
+        async def generate_translation_async(self, text, source_lang="en", target_lang="th"):
+            await asyncio.sleep(gemini_delay)
+            return {
+                "original_text": text,
+                "translated_text": f"{text} ({target_lang})",
+                "image_description": f"Visual representation of {text}",
+                "tier": "gemini"
+            }
+
+        async def generate_translations_batch_async(self, texts, source_lang="en", target_lang="th"):
+            await asyncio.sleep(gemini_delay)
+            return [await self.generate_translation_async(text, source_lang, target_lang) for text in texts]
+
+        async def analyze_image_async(self, image_data, target_lang="th", mime_type=None):
+            await asyncio.sleep(gemini_delay)
+            return {
+                "original_text": "Apple",
+                "translated_text": "แอปเปิล",
+                "image_description": "A red apple on a table"
+            }
+
+    class FakeTTS:
+        """Produces placeholder MP3 bytes after a fixed delay"""
+
+        def __init__(self, text, lang="en", slow=False):
+            self.text = text
+
+        def stream(self):
+            time.sleep(tts_delay)
+            yield b"\xff\xfb\x90\x00" * (256 + len(self.text) * 32)
+
+        def save(self, path):
+            with open(path, "wb") as audio_file:
+                for segment in self.stream():
+                    audio_file.write(segment)
+
+    # The lifespan builds the routes' and the job workers' Gemini client from this
+    main.GeminiService = FakeGeminiService
+    main.gTTS = tts_prefetch.gTTS = FakeTTS
+    return main
+
+
+@asynccontextmanager
+async def serving(args, main):
+    """Run the app lifespan, which httpx's ASGITransport does not, with storage connected"""
+    async with main.lifespan(main.app):
+        state = main.app.state
+        state.db_manager.connect()
+        if args.store == "mongomock":
+            from mongomock_motor import AsyncMongoMockClient
+            # Share the synchronous mock's data so both managers see one database
+            client = AsyncMongoMockClient(mock_mongo_client=state.db_manager.client)
+            state.async_db_manager._db = client[state.db_manager.db.name]
+        try:
+            yield
+        finally:
+            if args.store == "mongo" and state.db_manager.client is not None:
+                state.db_manager.client.drop_database(os.environ["DATABASE_NAME"])
+
+
+def make_test_image() -> bytes:
+    """Build a camera-sized JPEG"""
+    from PIL import Image
+    image = Image.linear_gradient("L").resize((3024, 4032)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size in MB of this process and its finished children"""
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / divisor, 1)
+
+
+async def seed(client, count: int) -> list:
+    """Create flashcards to read, update and delete"""
+    ids = []
+    for index in range(count):
+        response = await client.post("/flashcards/", json={
+            "original_text": f"word-{index}",
+            "translated_text": f"คำ-{index}",
+            "image_description": f"Description {index}"
+        })
+        response.raise_for_status()
+        ids.append(response.json()["id"])
+    return ids
+
+
+def build_request(scenario: str, number: int, ids: list, deletable: list, image_data: bytes):
+    """Return (method, url, kwargs) for one request of a scenario"""
+    if scenario == "list":
+        return "GET", "/flashcards/", {"params": {"limit": 100}}
+    if scenario == "search":
+        return "GET", "/flashcards/search", {"params": {"q": f"word-{number % len(ids)}"}}
+    if scenario == "due":
+        return "GET", "/review/next", {"params": {"limit": 20}}
+    if scenario == "get":
+        return "GET", f"/flashcards/{ids[number % len(ids)]}", {}
+    if scenario == "create":
+        return "POST", "/flashcards/", {"json": {"original_text": f"new-{number}", "translated_text": f"ใหม่-{number}"}}
+    if scenario == "update":
+        return "PUT", f"/flashcards/{ids[number % len(ids)]}", {"json": {"image_description": f"Updated {number}"}}
+    if scenario == "delete":
+        return "DELETE", f"/flashcards/{deletable.pop()}", {}
+    if scenario == "generate":
+        return "POST", "/generate-flashcard/", {"json": {"text": f"word {uuid.uuid4().hex}"}}
+    if scenario == "image":
+        files = {"file": ("capture.jpg", image_data, "image/jpeg")}
+        return "POST", "/generate-flashcard-from-image/", {"files": files}
+    if scenario == "tts":
+        return "GET", "/tts/", {"params": {"text": f"hello {uuid.uuid4().hex}"}}
+    if scenario == "tts_cached":
+        return "GET", "/tts/", {"params": {"text": "hello"}}
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run_level(client, scenario: str, concurrency: int, total: int, ids: list, image_data: bytes) -> dict:
+    """Issue `total` requests with `concurrency` workers and summarize latencies"""
+    deletable = await seed(client, total) if scenario == "delete" else []
+    latencies = []
+    errors = 0
+    issued = 0
+
+    async def worker():
+        nonlocal errors, issued
+        while issued < total:
+            number = issued
+            issued += 1
+            method, url, kwargs = build_request(scenario, number, ids, deletable, image_data)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+async def run(args, main) -> list:
+    import httpx
+
+    scenarios = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    image_data = make_test_image() if "image" in scenarios else b""
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with serving(args, main), httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        ids = await seed(client, args.seed)
+        # Warm the cached TTS entry so tts_cached measures hits only
+        await client.get("/tts/", params={"text": "hello"})
+
+        for scenario in scenarios:
+            for concurrency in levels:
+                result = await run_level(client, scenario, concurrency, args.requests, ids, image_data)
+                results.append(result)
+                print(
+                    f"{scenario:>11} c={concurrency:<4} rps={result['rps']:>8} "
+                    f"p50={result['p50_ms']:>8}ms p95={result['p95_ms']:>8}ms "
+                    f"p99={result['p99_ms']:>8}ms errors={result['errors']}"
+                )
+    return results
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def main_cli():
+    args = parse_args()
+    commit = current_commit()
+
+    with tempfile.TemporaryDirectory(prefix="flashcard-bench-") as work_dir:
+        configure_environment(args, work_dir)
+        main = install_fakes(args)
+        results = asyncio.run(run(args, main))
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "store": args.store,
+        "gemini_latency_ms": args.gemini_latency,
+        "tts_latency_ms": args.tts_latency,
+        "seed": args.seed,
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results
+    }
+
+    output = args.output or os.path.join(BACKEND_DIR, "benchmarks", "results", f"load-{commit}-{args.store}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"✓ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
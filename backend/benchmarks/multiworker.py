@@ -0,0 +1,273 @@
+"""
+Multi-process throughput benchmark
+
+Runs the API under uvicorn with an increasing number of worker processes that
+share one local store (or one MongoDB), with Gemini and gTTS faked as in
+load_test.py. Several client processes drive it for a fixed time, and RPS is
+reported per worker count next to the speedup over a single worker.
+
+Afterwards every worker count gets a consistency check: cards created through
+one worker are read back over fresh connections, which the kernel spreads
+across workers, and any read that misses a card is counted.
+
+Usage:
+    python benchmarks/multiworker.py
+    python benchmarks/multiworker.py --workers 1,2,4,8 --clients 8 --duration 10
+    python benchmarks/multiworker.py --store mongo --mongo-uri mongodb://localhost:27017/
+
+Scaling is bounded by the CPU cores available to the server and clients.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import BACKEND_DIR, configure_environment, current_commit, install_fakes
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["get", "list", "search", "due", "create"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-process throughput benchmark for the flashcards API")
+    parser.add_argument("--store", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/", help="Used with --store mongo")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated uvicorn worker counts")
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 2, help="Load-generating client processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests per client process")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per worker count")
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS), help="Comma-separated request mix")
+    parser.add_argument("--seed", type=int, default=1000, help="Flashcards created before measuring")
+    parser.add_argument("--check-cards", type=int, default=50, help="Cards created and read back for the consistency check")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/multiworker-<commit>-<store>.json)")
+    return parser.parse_args()
+
+
+def create_app():
+    """uvicorn app factory, run in every worker: the load_test fakes, configured from the environment"""
+    args = argparse.Namespace(
+        store=os.environ["BENCH_STORE"],
+        mongo_uri=os.environ["BENCH_MONGO_URI"],
+        gemini_latency=0.0,
+        tts_latency=0.0
+    )
+    configure_environment(args, os.environ["BENCH_WORK_DIR"])
+    # Every worker must use the same database
+    os.environ["DATABASE_NAME"] = os.environ["BENCH_DATABASE_NAME"]
+    return install_fakes(args).app
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(args, workers: int, work_dir: str, database_name: str) -> tuple:
+    """Start uvicorn with `workers` processes; return (process, base URL) once it answers"""
+    port = free_port()
+    env = {
+        **os.environ,
+        "BENCH_STORE": args.store,
+        "BENCH_MONGO_URI": args.mongo_uri,
+        "BENCH_WORK_DIR": work_dir,
+        "BENCH_DATABASE_NAME": database_name,
+        "PYTHONPATH": os.pathsep.join([BENCHMARKS_DIR, BACKEND_DIR])
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "multiworker:create_app", "--factory",
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"
+        ],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    import httpx
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                # Give the remaining workers a moment to finish importing
+                time.sleep(1 + workers * 0.5)
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 60s")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def seed(base_url: str, count: int) -> list:
+    import httpx
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        ids = []
+        for index in range(count):
+            response = client.post("/flashcards/", json={
+                "original_text": f"word-{index}",
+                "translated_text": f"คำ-{index}",
+                "image_description": f"Description {index}"
+            })
+            response.raise_for_status()
+            ids.append(response.json()["id"])
+    return ids
+
+
+def client_process(base_url: str, scenarios: list, ids: list, concurrency: int, duration: float, results):
+    """One load-generating process: `concurrency` request loops for `duration` seconds"""
+    import httpx
+
+    async def run():
+        completed = errors = 0
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+            stop_at = time.monotonic() + duration
+
+            async def loop():
+                nonlocal completed, errors
+                while time.monotonic() < stop_at:
+                    scenario = random.choice(scenarios)
+                    try:
+                        if scenario == "get":
+                            response = await client.get(f"/flashcards/{random.choice(ids)}")
+                        elif scenario == "list":
+                            response = await client.get("/flashcards/", params={"limit": 100})
+                        elif scenario == "search":
+                            response = await client.get("/flashcards/search", params={"q": f"word-{random.randrange(len(ids))}"})
+                        elif scenario == "due":
+                            response = await client.get("/review/next", params={"limit": 20})
+                        else:
+                            response = await client.post("/flashcards/", json={
+                                "original_text": f"new-{uuid.uuid4().hex[:8]}",
+                                "translated_text": "ใหม่"
+                            })
+                        completed += 1
+                        if response.status_code >= 400:
+                            errors += 1
+                    except httpx.HTTPError:
+                        errors += 1
+
+            await asyncio.gather(*(loop() for _ in range(concurrency)))
+        return completed, errors
+
+    results.put(asyncio.run(run()))
+
+
+def drive(args, base_url: str, ids: list) -> dict:
+    """Run the client processes and total their results"""
+    scenarios = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    clients = [
+        context.Process(target=client_process, args=(base_url, scenarios, ids, args.concurrency, args.duration, results))
+        for _ in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    totals = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    completed = sum(done for done, _ in totals)
+    return {
+        "requests": completed,
+        "errors": sum(failed for _, failed in totals),
+        # Client start-up is included in elapsed, so use the fixed load window
+        "rps": round(completed / args.duration, 1),
+        "elapsed_s": round(elapsed, 2)
+    }
+
+
+def check_consistency(base_url: str, count: int) -> int:
+    """Create cards, then read each back over fresh connections; return the number of missed reads"""
+    import httpx
+    missing = 0
+    created = []
+    for index in range(count):
+        with httpx.Client(base_url=base_url, timeout=30) as client:
+            response = client.post("/flashcards/", json={"original_text": f"check-{index}", "translated_text": "ตรวจ"})
+            response.raise_for_status()
+            created.append(response.json()["id"])
+    for flashcard_id in created:
+        for _ in range(3):
+            # A new connection each time, so reads land on different workers
+            with httpx.Client(base_url=base_url, timeout=30) as client:
+                if client.get(f"/flashcards/{flashcard_id}").status_code != 200:
+                    missing += 1
+    return missing
+
+
+def main_cli():
+    args = parse_args()
+    commit = current_commit()
+    results = []
+    baseline = None
+
+    for workers in [int(value) for value in args.workers.split(",") if value.strip()]:
+        with tempfile.TemporaryDirectory(prefix="flashcard-multiworker-bench-") as work_dir:
+            database_name = f"flashcard_bench_{uuid.uuid4().hex[:8]}"
+            server, base_url = start_server(args, workers, work_dir, database_name)
+            try:
+                ids = seed(base_url, args.seed)
+                result = {"workers": workers, **drive(args, base_url, ids)}
+                result["missing_reads"] = check_consistency(base_url, args.check_cards)
+            finally:
+                stop_server(server)
+                if args.store == "mongo":
+                    import pymongo
+                    pymongo.MongoClient(args.mongo_uri).drop_database(database_name)
+
+        baseline = baseline or result["rps"]
+        result["speedup"] = round(result["rps"] / baseline, 2) if baseline else 0.0
+        results.append(result)
+        print(
+            f"workers={workers:<3} rps={result['rps']:>9} speedup={result['speedup']:>5}x "
+            f"errors={result['errors']} missing_reads={result['missing_reads']}"
+        )
+
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "store": args.store,
+        "clients": args.clients,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "endpoints": args.endpoints,
+        "seed": args.seed,
+        "results": results
+    }
+    output = args.output or os.path.join(BACKEND_DIR, "benchmarks", "results", f"multiworker-{commit}-{args.store}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"✓ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,124 @@
+"""
+Microbenchmark for flashcard list serialization
+
+Compares, for increasingly large lists:
+  validated  - the old read path: Flashcard(**doc) per card, then FastAPI's
+               response_model validation and the stdlib JSON encoder
+  trusted    - trusted_flashcard per card, then flashcards_response (orjson);
+               used by search and the review queue
+  documents  - flashcard_document per card straight to orjson; used by
+               GET /flashcards/
+
+Usage:
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --sizes 1000,10000 --image-kb 64
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import configure_environment, install_fakes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Flashcard list serialization microbenchmark")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated list sizes")
+    parser.add_argument("--image-kb", type=int, default=0, help="Inline base64 image per card, as with include_image")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the fastest is reported")
+    # configure_environment() and install_fakes() expect these
+    parser.set_defaults(store="memory", mongo_uri="mongodb://localhost:27017/", gemini_latency=0.0, tts_latency=0.0)
+    return parser.parse_args()
+
+
+def make_documents(count: int, image_kb: int) -> List[dict]:
+    """Stored flashcard documents, as the database read paths see them"""
+    image = base64.b64encode(os.urandom(image_kb * 1024)).decode("ascii") if image_kb else ""
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "original_text": f"word-{index}",
+            "translated_text": f"คำ-{index}",
+            "image_description": f"A picture of word {index}",
+            "image": image,
+            "image_hash": "",
+            "image_url": "",
+            "thumbnail_hash": "",
+            "thumbnail_url": "",
+            "image_phash": "",
+            "ease": 2.5,
+            "interval": 0.0,
+            "repetitions": 0,
+            "lapses": 0,
+            "due": time.time(),
+            "last_reviewed": None
+        }
+        for index in range(count)
+    ]
+
+
+async def best_of(repeat: int, run) -> float:
+    """Fastest of `repeat` runs, in ms"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await run()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+async def measure(args, main):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from fastapi.responses import ORJSONResponse
+    from models import Flashcard, flashcard_document, trusted_flashcard
+
+    field = create_response_field(name="Response_flashcards", type_=List[Flashcard])
+
+    for size in [int(value) for value in args.sizes.split(",") if value.strip()]:
+        documents = make_documents(size, args.image_kb)
+
+        async def validated():
+            flashcards = [Flashcard(**document) for document in documents]
+            content = await serialize_response(field=field, response_content=flashcards, is_coroutine=True)
+            return JSONResponse(content).body
+
+        async def trusted():
+            return main.flashcards_response([trusted_flashcard(document) for document in documents]).body
+
+        async def plain():
+            return ORJSONResponse([flashcard_document(document) for document in documents]).body
+
+        # Every path must produce the same JSON document
+        expected = json.loads(await validated())
+        assert json.loads(await trusted()) == expected and json.loads(await plain()) == expected
+
+        validated_ms = await best_of(args.repeat, validated)
+        trusted_ms = await best_of(args.repeat, trusted)
+        plain_ms = await best_of(args.repeat, plain)
+        print(
+            f"{size:>7} cards  validated={validated_ms:>9.1f}ms  "
+            f"trusted={trusted_ms:>9.1f}ms ({validated_ms / trusted_ms:>4.1f}x)  "
+            f"documents={plain_ms:>9.1f}ms ({validated_ms / plain_ms:>4.1f}x)"
+        )
+
+
+def main_cli():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="flashcard-serialization-bench-") as work_dir:
+        configure_environment(args, work_dir)
+        main = install_fakes(args)
+        asyncio.run(measure(args, main))
+
+
+if __name__ == "__main__":
+    main_cli()
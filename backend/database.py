@@ -1,9 +1,19 @@
+import heapq
 import os
-from typing import Dict, List, Optional
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from pymongo import MongoClient, DeleteOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ServerSelectionTimeoutError
 from dotenv import load_dotenv
-from models import Flashcard
+from models import Flashcard, trusted_flashcard
+from storage_engine import MemoryStore, HEAVY_FIELDS
+from metrics import MONGODB_UP, WRITE_BEHIND_DEPTH, record_fallback, traced
+from search_index import SEARCH_FIELDS, TERMS_FIELD, query_groups, rank, search_filter, search_terms, with_search_terms
+from image_similarity import BANDS_FIELD, IMAGE_DUPLICATE_MAX_DISTANCE, hamming, hash_bands, with_hash_bands
 
 # Load environment variables
 load_dotenv()
@@ -12,139 +22,1119 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "flashcard_db")
 
+# Connection pool tuning
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))  # server selection and connect
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+
+# Failover and recovery
+MONGO_RETRIES = int(os.getenv("MONGO_RETRIES", "2"))  # extra attempts after a transient error
+MONGO_RETRY_BACKOFF = float(os.getenv("MONGO_RETRY_BACKOFF", "0.1"))  # seconds, doubled per attempt
+MONGO_HEALTH_INTERVAL = float(os.getenv("MONGO_HEALTH_INTERVAL", "5"))  # seconds between pings
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+# Prefix of the changed fields a write-behind entry holds for an update
+WRITE_BEHIND_SET_PREFIX = "set."
+
+# Most candidate documents scored per search query
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+# Change feeds (GET /flashcards/changes)
+TOMBSTONE_TTL = float(os.getenv("TOMBSTONE_TTL", str(30 * 24 * 60 * 60)))  # seconds deleted cards are reported
+# Seconds a reserved version holds change feeds back if its writer never reports the write done
+VERSION_LEASE_SECONDS = float(os.getenv("VERSION_LEASE_SECONDS", "60"))
+TOMBSTONE_PRUNE_INTERVAL = 3600  # seconds between tombstone clean-ups
+
+# Document of the "counters" collection holding the last flashcard version handed out
+# and the reservations whose writes have not landed yet
+VERSION_COUNTER = "flashcards"
+
+
+class ChangesExpiredError(ValueError):
+    """Raised when changes since a version can no longer be listed because their tombstones were pruned"""
+
+
+class WriteQueuedError(Exception):
+    """Raised when an update to a flashcard that only MongoDB holds is queued until MongoDB is back"""
+
+
+def mongo_client_options() -> dict:
+    """Pool and timeout settings shared by the PyMongo and Motor clients"""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "retryWrites": True,
+        "retryReads": True
+    }
+
+
+def mongo_document(document: dict) -> dict:
+    """Copy of a flashcard document with the search terms and image hash bands MongoDB indexes"""
+    return with_hash_bands(with_search_terms(document))
+
+
+def stamp(document: dict, version: int) -> dict:
+    """Set the version and update time of a document about to be written to MongoDB"""
+    document["version"] = version
+    document["updated_at"] = time.time()
+    return document
+
+
+def tombstone(flashcard_id: str, version: int) -> dict:
+    """Record left in MongoDB for a deleted flashcard"""
+    return {"id": flashcard_id, "version": version, "deleted_at": time.time()}
+
+
+def reservation(count: int, floor: int) -> Tuple[str, dict]:
+    """
+    Counter update reserving `count` versions and registering them as in flight
+
+    Args:
+        count: Number of consecutive versions
+        floor: A counter value seen before this update; every reserved version is above it
+
+    Returns:
+        (token to release the reservation with, update for the counter document)
+    """
+    token = uuid.uuid4().hex
+    return token, {
+        "$inc": {"version": count},
+        "$push": {"pending": {"token": token, "floor": floor, "expires_at": time.time() + VERSION_LEASE_SECONDS}}
+    }
+
+
+def settled_version(counter: Optional[dict]) -> int:
+    """
+    Highest version up to which every reserved version has been written
+
+    A MongoDB version is reserved before its write lands, so two writers can
+    land v6 before v5. Reservations stay on the counter document, with a
+    floor below their versions, until the write is done, so a change feed
+    that stops here never skips one. A reservation whose writer died stops
+    holding feeds back after VERSION_LEASE_SECONDS.
+    """
+    if not counter:
+        return 0
+    now = time.time()
+    floors = [entry["floor"] for entry in counter.get("pending", []) if entry["expires_at"] > now]
+    return min([counter.get("version", 0)] + floors)
+
+
+def collection_version(counter: Optional[dict]) -> Optional[int]:
+    """The counter's last version, or None while a write is still landing"""
+    version = counter.get("version", 0) if counter else 0
+    return version if settled_version(counter) == version else None
+
+
+def merge_changes(documents: Iterable[dict], tombstones: Iterable[dict], limit: int) -> List[dict]:
+    """Merge version-ordered MongoDB documents and tombstones into one change list"""
+    entries = heapq.merge(
+        documents,
+        ({**entry, "deleted": True} for entry in tombstones),
+        key=lambda entry: entry["version"]
+    )
+    return [entry for _, entry in zip(range(limit), entries)]
+
+
+def buffered_fields(entry: dict) -> dict:
+    """Fields changed by the updates a write-behind entry holds"""
+    return {
+        key[len(WRITE_BEHIND_SET_PREFIX):]: value
+        for key, value in entry.items()
+        if key.startswith(WRITE_BEHIND_SET_PREFIX)
+    }
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether an error is worth retrying right away
+
+    Dropped connections and network timeouts usually clear up within
+    milliseconds. An unreachable server (server selection timeout) does not;
+    it is left to the health checker instead of retried in the request.
+    """
+    return isinstance(error, ConnectionFailure) and not isinstance(error, ServerSelectionTimeoutError)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for retry number `attempt` (from 0)"""
+    return MONGO_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0)
+
 
 class DatabaseManager:
-    """Manages database operations with MongoDB primary and in-memory fallback"""
+    """
+    Manages database operations with MongoDB primary and local fallback
+    
+    Nothing connects at import time: start() creates the pooled client and
+    returns at once, and the first request waits for MongoDB only as long as
+    the driver's server selection does. A background thread pings MongoDB
+    every MONGO_HEALTH_INTERVAL seconds, starting right away. Connection
+    errors are retried with backoff; when MongoDB is still unreachable, reads
+    and writes switch to local storage and every write made there is queued
+    (write-behind): created cards whole, updates as their changed fields and
+    deletes by ID, including writes to cards only MongoDB holds. Once MongoDB
+    answers again the queue is replayed to it and MongoDB becomes primary
+    again.
+    
+    Every flashcard write is stamped with the next collection version (a
+    counter document in MongoDB, the store's own counter locally) and every
+    delete leaves a tombstone, so clients can fetch just the changes since
+    the version they last saw.
+    """
     
     def __init__(self):
         self.use_mongodb = False
         self.client = None
         self.db = None
         self.collection = None
-        self.in_memory_storage: Dict[str, dict] = {}
+        self.in_memory_storage = MemoryStore(versioned=True)
+        # Flashcards written locally while MongoDB was unavailable, one entry per card; persisted like the cards
+        self.write_behind = MemoryStore(name="write_behind")
+        self.in_memory_translations: Dict[str, dict] = {}
+        self.translations = None
+        # Background job state (see jobs.py); persisted so queued jobs survive restarts
+        self.in_memory_jobs = MemoryStore(name="jobs")
+        self.jobs = None
+        self.counters = None
+        self.tombstones = None
+        # Highest MongoDB version counter value seen; floor of this process's reservations
+        self.known_version = 0
+        self._next_prune = 0.0
+        self.last_error: Optional[str] = None
+        # Set once MongoDB answered; until then a card missing locally is not assumed to be in MongoDB
+        self.mongo_reached = False
+        self._recovery_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._health_checker: Optional[threading.Thread] = None
+        self._indexed = False
+        # Set once the first health check has answered, either way
+        self._checked = threading.Event()
+        self._closed = threading.Event()
         
-        # Try to connect to MongoDB
-        self._connect_mongodb()
+        MONGODB_UP.set_function(lambda: 1 if self.use_mongodb else 0)
+        WRITE_BEHIND_DEPTH.set_function(lambda: len(self.write_behind))
     
-    def _connect_mongodb(self):
-        """Attempt to connect to MongoDB"""
-        try:
-            self.client = MongoClient(
-                MONGO_URI,
-                serverSelectionTimeoutMS=5000,  # 5 second timeout
-                connectTimeoutMS=5000
-            )
-            # Test the connection
-            self.client.admin.command('ping')
+    def start(self):
+        """
+        Create the MongoDB client and start the health checker, without waiting for either
+        
+        MongoDB is assumed reachable until the first ping (made right away in
+        the background) or an operation says otherwise. Writes still buffered
+        from a previous run keep local storage primary until they are replayed.
+        Safe to call more than once.
+        """
+        with self._start_lock:
+            if self._health_checker is not None or self._closed.is_set():
+                return
+            stamped = self.in_memory_storage.stamp_versions()
+            if stamped:
+                print(f"✓ Versioned {stamped} locally stored flashcards")
+            # The driver connects in the background; nothing here blocks
+            self.client = MongoClient(MONGO_URI, **mongo_client_options())
             self.db = self.client[DATABASE_NAME]
             self.collection = self.db["flashcards"]
-            self.use_mongodb = True
+            self.translations = self.db["translation_cache"]
+            self.jobs = self.db["jobs"]
+            self.counters = self.db["counters"]
+            self.tombstones = self.db["flashcard_tombstones"]
+            if len(self.write_behind):
+                print(f"⚠ {len(self.write_behind)} buffered writes pending replay to MongoDB")
+            else:
+                self.use_mongodb = True
+            self._health_checker = threading.Thread(target=self._health_loop, name="mongo-health", daemon=True)
+            self._health_checker.start()
+    
+    def connect(self, timeout: Optional[float] = None) -> bool:
+        """
+        Start, then wait for the first health check; for scripts that need to know the storage mode up front
+        
+        Returns:
+            Whether MongoDB is primary
+        """
+        self.start()
+        self._checked.wait(timeout if timeout is not None else MONGO_TIMEOUT_MS / 1000 + 1)
+        return self.use_mongodb
+    
+    def _setup_collections(self):
+        """Ensure indexes after the first successful ping"""
+        if self._indexed:
+            return
+        # Keyset pagination walks the collection in "id" order
+        self.collection.create_index("id", unique=True)
+        # Multikey index over the prefix/fuzzy/n-gram terms used by search
+        self.collection.create_index(TERMS_FIELD)
+        # Due-card queries walk this index in due order and stop after `limit`
+        self.collection.create_index([("due", 1), ("id", 1)])
+        # Multikey index over perceptual hash bands, for near-duplicate image lookups
+        self.collection.create_index(BANDS_FIELD)
+        # Change feeds walk cards and tombstones in version order
+        self.collection.create_index("version")
+        self.tombstones.create_index("id", unique=True)
+        self.tombstones.create_index("version")
+        self.translations.create_index("key", unique=True)
+        self.jobs.create_index("id", unique=True)
+        self.jobs.create_index("status")
+        self._indexed = True
+        threading.Thread(target=self._backfill, name="mongo-backfill", daemon=True).start()
+    
+    def _fall_back(self, operation: str, error: Exception):
+        """Switch to local storage after a MongoDB failure; the health checker switches back"""
+        print(f"MongoDB {operation} failed: {error}, using in-memory storage")
+        record_fallback(operation)
+        self.last_error = str(error)
+        self.use_mongodb = False
+    
+    def _backfill(self):
+        """Bring flashcards saved by older versions up to date"""
+        try:
+            # Cards without review state are new cards, due immediately
+            result = self.collection.update_many({"due": {"$exists": False}}, {"$set": {"due": 0.0}})
+            if result.modified_count:
+                print(f"✓ Scheduled {result.modified_count} flashcards for review")
+        except Exception as e:
+            print(f"Review schedule backfill failed: {e}")
+        
+        try:
+            count = 0
+            projection = {"_id": 1, **{field: 1 for field in SEARCH_FIELDS}}
+            for document in self.collection.find({TERMS_FIELD: {"$exists": False}}, projection):
+                self.collection.update_one(
+                    {"_id": document["_id"]},
+                    {"$set": {TERMS_FIELD: search_terms(document)}}
+                )
+                count += 1
+            if count:
+                print(f"✓ Indexed {count} flashcards for search")
+        except Exception as e:
+            print(f"Search index backfill failed: {e}")
+        
+        try:
+            count = 0
+            query = {"image_phash": {"$nin": ["", None]}, BANDS_FIELD: {"$exists": False}}
+            for document in self.collection.find(query, {"_id": 1, "image_phash": 1}):
+                self.collection.update_one(
+                    {"_id": document["_id"]},
+                    {"$set": {BANDS_FIELD: hash_bands(document["image_phash"])}}
+                )
+                count += 1
+            if count:
+                print(f"✓ Indexed {count} flashcard images for duplicate detection")
+        except Exception as e:
+            print(f"Image hash backfill failed: {e}")
+        
+        try:
+            count = 0
+            unversioned = {"version": {"$exists": False}}
+            while True:
+                ids = [document["_id"] for document in self.collection.find(unversioned, {"_id": 1}).limit(WRITE_BEHIND_BATCH_SIZE)]
+                if not ids:
+                    break
+                with self._reserve_versions(len(ids)) as first:
+                    for version, document_id in enumerate(ids, first):
+                        self.collection.update_one({"_id": document_id, **unversioned}, {"$set": stamp({}, version)})
+                count += len(ids)
+            if count:
+                print(f"✓ Versioned {count} flashcards")
+        except Exception as e:
+            print(f"Version backfill failed: {e}")
+    
+    def _retry(self, func, *args, **kwargs):
+        """
+        Call a MongoDB operation, retrying transient errors with exponential backoff
+        
+        Only for reads and idempotent writes. Inserts rely on the driver's
+        retryable writes instead, since re-sending an insert that did land
+        would fail on the unique ID index.
+        """
+        for attempt in range(MONGO_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except ConnectionFailure as e:
+                if attempt == MONGO_RETRIES or not is_transient(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+    
+    @contextmanager
+    def _reserve_versions(self, count: int = 1) -> Iterator[int]:
+        """
+        Reserve `count` consecutive flashcard versions from the MongoDB counter for a write
+        
+        Change feeds stop below the reserved versions until the block exits,
+        so the write must land inside it.
+        
+        Yields:
+            The first reserved version
+        """
+        token, update = reservation(count, self.known_version)
+        result = self._retry(
+            self.counters.find_one_and_update,
+            {"_id": VERSION_COUNTER},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._saw_version(result["version"])
+        try:
+            yield result["version"] - count + 1
+        finally:
+            try:
+                self.counters.update_one({"_id": VERSION_COUNTER}, {"$pull": {"pending": {"token": token}}})
+            except ConnectionFailure:
+                pass  # The reservation expires after VERSION_LEASE_SECONDS
+    
+    def _saw_version(self, version: int):
+        """Note a counter value: floor for later reservations, and local writes must stay above it"""
+        self.known_version = max(self.known_version, version)
+        self.in_memory_storage.min_version = max(self.in_memory_storage.min_version, version)
+    
+    def _buffer_writes(self, flashcard_ids: Iterable[str]):
+        """Queue flashcards written whole to local storage for replay to MongoDB"""
+        self.write_behind.insert_many([{"id": flashcard_id, "replace": True} for flashcard_id in flashcard_ids])
+    
+    def _buffer_update(self, flashcard_id: str, update_data: dict):
+        """
+        Queue an update's changed fields for replay to MongoDB
+        
+        Only the fields are replayed, so a stale or missing local copy never
+        overwrites newer fields in MongoDB. A card queued whole stays queued
+        whole, since its local copy includes the update.
+        """
+        self.write_behind.merge(flashcard_id, {WRITE_BEHIND_SET_PREFIX + field: value for field, value in update_data.items()})
+    
+    def _buffer_delete(self, flashcard_id: str):
+        """Queue a delete for replay to MongoDB"""
+        self.write_behind.insert({"id": flashcard_id, "deleted": True})
+    
+    def _may_be_in_mongodb(self, flashcard_id: str) -> bool:
+        """Whether a card missing locally may still be in MongoDB, so writes to it are queued"""
+        if not self.mongo_reached:
+            return False
+        entry = self.write_behind.get(flashcard_id)
+        return entry is None or not entry.get("deleted")
+    
+    def _update_locally(self, flashcard_id: str, update_data: dict) -> Optional[Flashcard]:
+        """Update a flashcard in local storage and queue the update; see update_flashcard"""
+        flashcard_dict = self.in_memory_storage.update(flashcard_id, update_data)
+        if flashcard_dict is None and not self._may_be_in_mongodb(flashcard_id):
+            return None
+        self._buffer_update(flashcard_id, update_data)
+        if flashcard_dict is None:
+            raise WriteQueuedError(f"Flashcard {flashcard_id} is not stored locally; its update is queued for MongoDB")
+        return trusted_flashcard(flashcard_dict)
+    
+    def _delete_locally(self, flashcard_id: str) -> bool:
+        """Delete a flashcard from local storage and queue the delete; see delete_flashcard"""
+        deleted = self.in_memory_storage.delete(flashcard_id)
+        if not deleted and not self._may_be_in_mongodb(flashcard_id):
+            return False
+        # A card only MongoDB holds is deleted there on replay
+        self._buffer_delete(flashcard_id)
+        return True
+    
+    def _health_loop(self):
+        """Background thread: ping MongoDB, fall back when it is gone, recover when it is back"""
+        while not self._closed.is_set():
+            try:
+                self._check_health()
+            except Exception as e:
+                print(f"MongoDB health check failed: {e}")
+            self._checked.set()
+            try:
+                self._prune_tombstones()
+            except Exception as e:
+                print(f"Tombstone clean-up failed: {e}")
+            self._closed.wait(MONGO_HEALTH_INTERVAL)
+    
+    def _check_health(self):
+        if self.client is None:
+            return
+        try:
+            self.client.admin.command('ping')
+        except Exception as e:
+            self.last_error = str(e)
+            if not self._checked.is_set():
+                print(f"⚠ MongoDB connection failed: {e}")
+                print("⚠ Falling back to in-memory storage")
+                self.use_mongodb = False
+            elif self.use_mongodb:
+                self._fall_back("health check", e)
+            return
+        
+        if not self._checked.is_set() and self.use_mongodb:
             print("✓ Successfully connected to MongoDB")
-        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            print(f"⚠ MongoDB connection failed: {e}")
-            print("⚠ Falling back to in-memory storage")
-            self.use_mongodb = False
+        self.mongo_reached = True
+        self._setup_collections()
+        if not self.use_mongodb or len(self.write_behind):
+            self._replay_write_behind()
     
+    def _prune_tombstones(self):
+        """Drop tombstones older than TOMBSTONE_TTL and expired version reservations, at most once per TOMBSTONE_PRUNE_INTERVAL"""
+        if time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + TOMBSTONE_PRUNE_INTERVAL
+        deleted_before = time.time() - TOMBSTONE_TTL
+        self.in_memory_storage.prune_tombstones(deleted_before)
+        if not self.use_mongodb:
+            return
+        self.counters.update_one({"_id": VERSION_COUNTER}, {"$pull": {"pending": {"expires_at": {"$lt": time.time()}}}})
+        newest = self.tombstones.find_one({"deleted_at": {"$lt": deleted_before}}, sort=[("version", -1)])
+        if newest:
+            # Raise the floor first, so a change feed never silently misses a dropped tombstone
+            self.counters.update_one({"_id": VERSION_COUNTER}, {"$max": {"pruned": newest["version"]}}, upsert=True)
+            self.tombstones.delete_many({"version": {"$lte": newest["version"]}})
+    
+    def _replay_write_behind(self):
+        """
+        Replay locally buffered writes to MongoDB, then make MongoDB primary again
+        
+        Cards written whole are replaced with their local copy, updates are
+        applied as $set of the fields they changed (matching nothing if the
+        card is gone) and deletes delete. Replayed writes get new versions
+        from the MongoDB counter, which is first raised past every local
+        version, so clients that synced with either store see them as changes.
+        """
+        with self._recovery_lock:
+            replayed = 0
+            try:
+                self.counters.update_one(
+                    {"_id": VERSION_COUNTER},
+                    {"$max": {"version": self.in_memory_storage.current_version()}},
+                    upsert=True
+                )
+                after_id = None
+                while True:
+                    # Stored entries (not copies), so a re-buffered flashcard is recognized below
+                    entries = list(self.write_behind.iter(after_id=after_id, include_image=True, limit=WRITE_BEHIND_BATCH_SIZE))
+                    if not entries:
+                        break
+                    requests = []
+                    tombstones = []
+                    # Updated cards whose search terms must be rebuilt from their MongoDB copy
+                    retokenize = []
+                    with self._reserve_versions(len(entries)) as first:
+                        for version, entry in enumerate(entries, first):
+                            # Entries without fields come from older releases and are replayed whole
+                            fields = buffered_fields(entry)
+                            if fields and not entry.get("replace") and not entry.get("deleted"):
+                                changes = stamp(fields, version)
+                                if "image_phash" in fields:
+                                    changes[BANDS_FIELD] = hash_bands(fields["image_phash"]) if fields["image_phash"] else []
+                                requests.append(UpdateOne({"id": entry["id"]}, {"$set": changes}))
+                                if any(field in fields for field in SEARCH_FIELDS):
+                                    retokenize.append(entry["id"])
+                                continue
+                            document = None if entry.get("deleted") else self.in_memory_storage.get(entry["id"])
+                            if document is None:
+                                requests.append(DeleteOne({"id": entry["id"]}))
+                                tombstones.append(ReplaceOne({"id": entry["id"]}, tombstone(entry["id"], version), upsert=True))
+                            else:
+                                requests.append(ReplaceOne({"id": entry["id"]}, mongo_document(stamp(dict(document), version)), upsert=True))
+                        self.collection.bulk_write(requests, ordered=False)
+                        if tombstones:
+                            self.tombstones.bulk_write(tombstones, ordered=False)
+                        if retokenize:
+                            projection = {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELDS}}
+                            terms = [
+                                UpdateOne({"id": document["id"]}, {"$set": {TERMS_FIELD: search_terms(document)}})
+                                for document in self.collection.find({"id": {"$in": retokenize}}, projection)
+                            ]
+                            if terms:
+                                self.collection.bulk_write(terms, ordered=False)
+                    with self.write_behind.lock:
+                        for entry in entries:
+                            # Keep entries written again while this batch was in flight
+                            if self.write_behind.get(entry["id"]) is entry:
+                                self.write_behind.delete(entry["id"])
+                    replayed += len(entries)
+                    after_id = entries[-1]["id"]
+            except Exception as e:
+                print(f"Write-behind replay failed: {e}")
+                self.last_error = str(e)
+                return
+            
+            if not self.use_mongodb:
+                self.use_mongodb = True
+                self.last_error = None
+                print(f"✓ Reconnected to MongoDB ({replayed} buffered writes replayed)")
+            elif replayed:
+                print(f"✓ Replayed {replayed} buffered writes to MongoDB")
+    
+    def status(self) -> dict:
+        """Current storage mode, buffered write count and last MongoDB error"""
+        return {
+            "mode": "mongodb" if self.use_mongodb else "memory",
+            "write_behind_queue": len(self.write_behind),
+            "last_error": self.last_error
+        }
+    
+    @traced("db.create_flashcard")
     def create_flashcard(self, flashcard: Flashcard) -> Flashcard:
-        """Create a new flashcard"""
+        """Create a new flashcard; returns it with its version"""
         flashcard_dict = flashcard.model_dump()
         
         if self.use_mongodb:
             try:
-                self.collection.insert_one(flashcard_dict)
-                return flashcard
-            except Exception as e:
-                print(f"MongoDB insert failed: {e}, using in-memory storage")
-                self.use_mongodb = False
+                with self._reserve_versions() as version:
+                    stamp(flashcard_dict, version)
+                    self.collection.insert_one(mongo_document(flashcard_dict))
+                return trusted_flashcard(flashcard_dict)
+            except ConnectionFailure as e:
+                self._fall_back("insert", e)
+        
+        # Use in-memory storage
+        stored = self.in_memory_storage.insert(flashcard_dict)
+        self._buffer_writes([flashcard_dict["id"]])
+        return trusted_flashcard(stored)
+    
+    @traced("db.create_flashcards")
+    def create_flashcards(self, flashcards: List[Flashcard]) -> List[Optional[str]]:
+        """
+        Create many flashcards in one bulk write
+        
+        Args:
+            flashcards: Flashcards to create; their version and updated_at are set
+        
+        Returns:
+            One entry per flashcard: None if it was saved, otherwise the error message
+        """
+        errors: List[Optional[str]] = [None] * len(flashcards)
+        if not flashcards:
+            return errors
+        documents = [flashcard.model_dump() for flashcard in flashcards]
+        
+        if self.use_mongodb:
+            try:
+                with self._reserve_versions(len(documents)) as first:
+                    for version, (flashcard, document) in enumerate(zip(flashcards, documents), first):
+                        stamp(document, version)
+                        flashcard.version, flashcard.updated_at = version, document["updated_at"]
+                    # insert_many adds _id to the documents it is given, so pass copies
+                    self.collection.insert_many([mongo_document(document) for document in documents], ordered=False)
+                return errors
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    errors[write_error["index"]] = write_error.get("errmsg", "Insert failed")
+                return errors
+            except ConnectionFailure as e:
+                self._fall_back("insert", e)
         
         # Use in-memory storage
-        self.in_memory_storage[flashcard.id] = flashcard_dict
-        return flashcard
+        for flashcard, stored in zip(flashcards, self.in_memory_storage.insert_many(documents)):
+            flashcard.version, flashcard.updated_at = stored["version"], stored["updated_at"]
+        self._buffer_writes(document["id"] for document in documents)
+        return errors
     
+    @traced("db.upsert_flashcards")
+    def upsert_flashcards(self, documents: List[dict]):
+        """
+        Insert or replace many flashcards, matched by ID, in one bulk write
+        
+        Args:
+            documents: Validated flashcard documents; each gets a new version
+        """
+        if not documents:
+            return
+        
+        if self.use_mongodb:
+            try:
+                with self._reserve_versions(len(documents)) as first:
+                    for version, document in enumerate(documents, first):
+                        stamp(document, version)
+                    self._retry(
+                        self.collection.bulk_write,
+                        [ReplaceOne({"id": document["id"]}, mongo_document(document), upsert=True) for document in documents],
+                        ordered=False
+                    )
+                return
+            except ConnectionFailure as e:
+                self._fall_back("bulk write", e)
+        
+        # Use in-memory storage
+        self.in_memory_storage.insert_many(documents)
+        self._buffer_writes(document["id"] for document in documents)
+    
+    @traced("db.get_flashcard")
     def get_flashcard(self, flashcard_id: str) -> Optional[Flashcard]:
         """Get a flashcard by ID"""
         if self.use_mongodb:
             try:
-                result = self.collection.find_one({"id": flashcard_id})
+                result = self._retry(self.collection.find_one, {"id": flashcard_id})
                 if result:
                     result.pop("_id", None)  # Remove MongoDB's _id field
-                    return Flashcard(**result)
+                    return trusted_flashcard(result)
                 return None
-            except Exception as e:
-                print(f"MongoDB query failed: {e}, using in-memory storage")
-                self.use_mongodb = False
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
         
         # Use in-memory storage
         flashcard_dict = self.in_memory_storage.get(flashcard_id)
         if flashcard_dict:
-            return Flashcard(**flashcard_dict)
+            return trusted_flashcard(flashcard_dict)
         return None
     
+    @traced("db.get_all_flashcards")
     def get_all_flashcards(self) -> List[Flashcard]:
         """Get all flashcards"""
         if self.use_mongodb:
             try:
-                results = list(self.collection.find())
+                results = self._retry(lambda: list(self.collection.find()))
                 flashcards = []
                 for result in results:
                     result.pop("_id", None)  # Remove MongoDB's _id field
-                    flashcards.append(Flashcard(**result))
+                    flashcards.append(trusted_flashcard(result))
                 return flashcards
-            except Exception as e:
-                print(f"MongoDB query failed: {e}, using in-memory storage")
-                self.use_mongodb = False
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        return [trusted_flashcard(data) for data in self.in_memory_storage.iter(include_image=True)]
+    
+    @traced("db.list_flashcards")
+    def list_flashcards(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        include_image: bool = False
+    ) -> List[Flashcard]:
+        """
+        Get one page of flashcards ordered by ID
+        
+        Args:
+            limit: Maximum number of flashcards to return
+            after_id: Return flashcards whose ID sorts after this one
+            include_image: Include the image field (left out by default)
+        
+        Returns:
+            List of flashcards
+        """
+        return [
+            trusted_flashcard(data)
+            for data in self.iter_flashcards(after_id=after_id, include_image=include_image, limit=limit)
+        ]
+    
+    def iter_flashcards(
+        self,
+        after_id: Optional[str] = None,
+        include_image: bool = False,
+        limit: Optional[int] = None
+    ) -> Iterator[dict]:
+        """
+        Yield flashcard documents in ID order without materializing the whole collection
+        
+        Args:
+            after_id: Start after this flashcard ID
+            include_image: Include the image field (left out by default)
+            limit: Maximum number of documents to yield (None for all)
+        
+        Yields:
+            Flashcard documents as plain dicts
+        """
+        if self.use_mongodb:
+            try:
+                query = {"id": {"$gt": after_id}} if after_id else {}
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0}
+                if not include_image:
+                    projection.update({field: 0 for field in HEAVY_FIELDS})
+                cursor = self.collection.find(query, projection).sort("id", 1)
+                if limit:
+                    cursor = cursor.limit(limit)
+                # Fetch the first batch eagerly so connection errors fall back below
+                first = next(cursor, None)
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+            else:
+                if first is not None:
+                    yield first
+                    yield from cursor
+                return
         
         # Use in-memory storage
-        return [Flashcard(**data) for data in self.in_memory_storage.values()]
+        yield from self.in_memory_storage.iter(after_id=after_id, include_image=include_image, limit=limit)
     
+    @traced("db.update_flashcard")
     def update_flashcard(self, flashcard_id: str, update_data: dict) -> Optional[Flashcard]:
-        """Update a flashcard"""
+        """
+        Update a flashcard
+        
+        Raises:
+            WriteQueuedError: If MongoDB is unavailable and the card is not stored locally;
+                the update is applied once MongoDB is back
+        """
         # Remove None values from update_data
         update_data = {k: v for k, v in update_data.items() if v is not None}
         
         if self.use_mongodb:
             try:
-                result = self.collection.find_one_and_update(
-                    {"id": flashcard_id},
-                    {"$set": update_data},
-                    return_document=True
-                )
+                # A missing card must not use up a version (and change the collection ETag)
+                if not self._retry(self.collection.find_one, {"id": flashcard_id}, {"_id": 1}):
+                    return None
+                with self._reserve_versions() as version:
+                    changes = stamp(dict(update_data), version)
+                    if "image_phash" in update_data:
+                        changes[BANDS_FIELD] = hash_bands(update_data["image_phash"]) if update_data["image_phash"] else []
+                    result = self._retry(
+                        self.collection.find_one_and_update,
+                        {"id": flashcard_id},
+                        {"$set": changes},
+                        return_document=True
+                    )
                 if result:
                     result.pop("_id", None)
-                    return Flashcard(**result)
+                    if any(field in update_data for field in SEARCH_FIELDS):
+                        self._retry(
+                            self.collection.update_one,
+                            {"id": flashcard_id},
+                            {"$set": {TERMS_FIELD: search_terms(result)}}
+                        )
+                    return trusted_flashcard(result)
                 return None
-            except Exception as e:
-                print(f"MongoDB update failed: {e}, using in-memory storage")
-                self.use_mongodb = False
+            except ConnectionFailure as e:
+                self._fall_back("update", e)
         
         # Use in-memory storage
-        if flashcard_id in self.in_memory_storage:
-            self.in_memory_storage[flashcard_id].update(update_data)
-            return Flashcard(**self.in_memory_storage[flashcard_id])
+        return self._update_locally(flashcard_id, update_data)
+    
+    @traced("db.search_flashcards")
+    def search_flashcards(self, query: str, limit: int = 20, fuzzy: bool = True) -> List[Flashcard]:
+        """
+        Search flashcards by original text, translation and image description
+        
+        Args:
+            query: Search text; every word must match, as a whole word, a prefix
+                or (with fuzzy) within one edit. Thai is matched by character bigrams.
+            limit: Maximum number of results
+            fuzzy: Tolerate one typo per word
+        
+        Returns:
+            Best matching flashcards first
+        """
+        groups = query_groups(query, fuzzy)
+        if not groups:
+            return []
+        
+        if self.use_mongodb:
+            try:
+                projection = {"_id": 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                # Retried as a whole: a cursor cannot resume after a dropped connection
+                candidates = self._retry(
+                    lambda: rank(self.collection.find(search_filter(groups), projection).limit(SEARCH_MAX_CANDIDATES), groups, limit)
+                )
+                return [trusted_flashcard(data) for data in candidates]
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        return [trusted_flashcard(data) for data in self.in_memory_storage.search(query, limit=limit, fuzzy=fuzzy)]
+    
+    @traced("db.due_flashcards")
+    def due_flashcards(self, now: float, limit: int) -> List[Flashcard]:
+        """
+        Get flashcards due for review
+        
+        Args:
+            now: UNIX timestamp; cards due at or before it are returned
+            limit: Maximum number of flashcards to return
+        
+        Returns:
+            Most overdue flashcards first (without image data)
+        """
+        if self.use_mongodb:
+            try:
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                documents = self._retry(
+                    lambda: list(self.collection.find({"due": {"$lte": now}}, projection).sort([("due", 1), ("id", 1)]).limit(limit))
+                )
+                return [trusted_flashcard(data) for data in documents]
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        return [trusted_flashcard(data) for data in self.in_memory_storage.due(now, limit)]
+    
+    @traced("db.find_similar_image")
+    def find_similar_image(
+        self,
+        phash: str,
+        max_distance: int = IMAGE_DUPLICATE_MAX_DISTANCE
+    ) -> Optional[Tuple[Flashcard, int]]:
+        """
+        Find the flashcard whose image looks most like a given image
+        
+        Args:
+            phash: Perceptual hash of the image (see image_similarity.dhash)
+            max_distance: Largest Hamming distance counted as the same picture
+        
+        Returns:
+            (flashcard without image data, distance), or None if nothing is close enough
+        """
+        if self.use_mongodb:
+            try:
+                # Candidates share at least one hash band; only their hashes are fetched
+                candidates = self._retry(lambda: list(self.collection.find(
+                    {BANDS_FIELD: {"$in": hash_bands(phash)}},
+                    {"_id": 0, "id": 1, "image_phash": 1}
+                )))
+                matches = sorted(
+                    (hamming(phash, candidate["image_phash"]), candidate["id"])
+                    for candidate in candidates if candidate.get("image_phash")
+                )
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0, **{field: 0 for field in HEAVY_FIELDS}}
+                for distance, flashcard_id in matches:
+                    if distance > max_distance:
+                        break
+                    result = self._retry(self.collection.find_one, {"id": flashcard_id}, projection)
+                    if result:
+                        return trusted_flashcard(result), distance
+                return None
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        for distance, data in self.in_memory_storage.similar_images(phash, max_distance):
+            return trusted_flashcard(data), distance
         return None
     
+    @traced("db.delete_flashcard")
     def delete_flashcard(self, flashcard_id: str) -> bool:
-        """Delete a flashcard"""
+        """
+        Delete a flashcard, leaving a tombstone for change feeds
+        
+        While MongoDB is unavailable, deleting a card not stored locally is
+        queued and reported as done; it is deleted from MongoDB once it is back.
+        """
         if self.use_mongodb:
             try:
-                result = self.collection.delete_one({"id": flashcard_id})
+                # A missing card must not use up a version (and change the collection ETag)
+                if not self._retry(self.collection.find_one, {"id": flashcard_id}, {"_id": 1}):
+                    return False
+                with self._reserve_versions() as version:
+                    result = self._retry(self.collection.delete_one, {"id": flashcard_id})
+                    if result.deleted_count:
+                        self._retry(self.tombstones.replace_one, {"id": flashcard_id}, tombstone(flashcard_id, version), upsert=True)
                 return result.deleted_count > 0
-            except Exception as e:
-                print(f"MongoDB delete failed: {e}, using in-memory storage")
-                self.use_mongodb = False
+            except ConnectionFailure as e:
+                self._fall_back("delete", e)
+        
+        # Use in-memory storage
+        return self._delete_locally(flashcard_id)
+    
+    @traced("db.flashcard_changes")
+    def flashcard_changes(self, since: int, limit: int, include_image: bool = False) -> List[dict]:
+        """
+        Get flashcards written and deleted after a version, oldest first
+        
+        Args:
+            since: Version the client last saw (0 for everything still known)
+            limit: Maximum number of changes
+            include_image: Include the image field (left out by default)
+        
+        Returns:
+            Flashcard documents, and {"id", "version", "deleted_at", "deleted": True}
+            tombstones for deleted flashcards, in version order; on MongoDB
+            only up to the settled version, so none is skipped by a later poll
+        
+        Raises:
+            ChangesExpiredError: If tombstones newer than `since` were already pruned
+        """
+        if self.use_mongodb:
+            try:
+                counter = self._retry(self.counters.find_one, {"_id": VERSION_COUNTER}) or {}
+                if since and since < counter.get("pruned", 0):
+                    raise ChangesExpiredError(f"Changes since version {since} are no longer available")
+                self._saw_version(counter.get("version", 0))
+                query = {"version": {"$gt": since, "$lte": settled_version(counter)}}
+                projection = {"_id": 0, TERMS_FIELD: 0, BANDS_FIELD: 0}
+                if not include_image:
+                    projection.update({field: 0 for field in HEAVY_FIELDS})
+                documents = self._retry(lambda: list(self.collection.find(query, projection).sort("version", 1).limit(limit)))
+                tombstones = self._retry(lambda: list(self.tombstones.find(query, {"_id": 0}).sort("version", 1).limit(limit)))
+                return merge_changes(documents, tombstones, limit)
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
         
         # Use in-memory storage
-        if flashcard_id in self.in_memory_storage:
-            del self.in_memory_storage[flashcard_id]
-            return True
-        return False
+        changes = self.in_memory_storage.changes(since, limit, include_image=include_image)
+        if since and since < self.in_memory_storage.tombstone_floor:
+            raise ChangesExpiredError(f"Changes since version {since} are no longer available")
+        return changes
+    
+    @traced("db.flashcards_version")
+    def flashcards_version(self) -> Optional[int]:
+        """
+        Last version written to the flashcard collection; changes whenever any flashcard does
+        
+        Returns:
+            The version, or None while a MongoDB write is still landing, since
+            a read now may miss a card that the version already counts
+        """
+        if self.use_mongodb:
+            try:
+                counter = self._retry(self.counters.find_one, {"_id": VERSION_COUNTER})
+                return collection_version(counter)
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        return self.in_memory_storage.current_version()
+    
+    @traced("db.get_cached_translation")
+    def get_cached_translation(self, key: str, max_age: float) -> Optional[dict]:
+        """
+        Get a cached translation result
+        
+        Args:
+            key: Translation cache key
+            max_age: Ignore entries older than this many seconds
+        
+        Returns:
+            Cached result, or None if missing or expired
+        """
+        min_created_at = time.time() - max_age
+        
+        if self.use_mongodb:
+            try:
+                result = self._retry(
+                    self.translations.find_one,
+                    {"key": key, "created_at": {"$gte": min_created_at}},
+                    {"_id": 0, "value": 1}
+                )
+                return result["value"] if result else None
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage
+        entry = self.in_memory_translations.get(key)
+        if entry and entry["created_at"] >= min_created_at:
+            return entry["value"]
+        return None
+    
+    @traced("db.set_cached_translation")
+    def set_cached_translation(self, key: str, value: dict):
+        """
+        Store a translation result in the cache
+        
+        Args:
+            key: Translation cache key
+            value: Translation result
+        """
+        entry = {"key": key, "value": value, "created_at": time.time()}
+        
+        if self.use_mongodb:
+            try:
+                self._retry(self.translations.replace_one, {"key": key}, entry, upsert=True)
+                return
+            except ConnectionFailure as e:
+                self._fall_back("update", e)
+        
+        # Use in-memory storage
+        self.in_memory_translations[key] = entry
+    
+    @traced("db.save_job")
+    def save_job(self, job: dict):
+        """
+        Insert or replace a background job record
+        
+        Args:
+            job: Job document, identified by its "id"
+        """
+        if self.use_mongodb:
+            try:
+                self._retry(self.jobs.replace_one, {"id": job["id"]}, job, upsert=True)
+                return
+            except ConnectionFailure as e:
+                self._fall_back("update", e)
+        
+        # Use in-memory storage
+        self.in_memory_jobs.insert(job)
+    
+    @traced("db.get_job")
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Get a background job record by ID"""
+        if self.use_mongodb:
+            try:
+                result = self._retry(self.jobs.find_one, {"id": job_id}, {"_id": 0})
+                if result:
+                    return result
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        
+        # Use in-memory storage (also holds jobs saved while MongoDB was down)
+        return self.in_memory_jobs.get(job_id)
+    
+    @traced("db.claim_job")
+    def claim_job(self, job_id: str, expected_status: str, changes: dict) -> Optional[dict]:
+        """
+        Atomically update a job record that is still in the expected status
+        
+        Used by workers to take a queued job, so a job is never run twice
+        even when several worker processes see it.
+        
+        Returns:
+            The updated job, or None if it is missing or no longer in expected_status
+        """
+        if self.use_mongodb:
+            try:
+                result = self.jobs.find_one_and_update(
+                    {"id": job_id, "status": expected_status},
+                    {"$set": changes},
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.AFTER
+                )
+                if result:
+                    return result
+            except ConnectionFailure as e:
+                self._fall_back("update", e)
+        
+        # Use in-memory storage (also holds jobs saved while MongoDB was down)
+        return self.in_memory_jobs.update_if(job_id, {"status": expected_status}, changes)
+    
+    @traced("db.find_jobs")
+    def find_jobs(self, statuses: List[str]) -> List[dict]:
+        """Get background job records in any of the given statuses, oldest first"""
+        jobs = [job for job in self.in_memory_jobs.iter(include_image=True) if job["status"] in statuses]
+        if self.use_mongodb:
+            try:
+                jobs += self._retry(lambda: list(self.jobs.find({"status": {"$in": statuses}}, {"_id": 0})))
+            except ConnectionFailure as e:
+                self._fall_back("query", e)
+        return sorted({job["id"]: job for job in jobs}.values(), key=lambda job: job["created_at"])
+    
+    @traced("db.delete_jobs")
+    def delete_jobs(self, finished_before: float, statuses: List[str]) -> int:
+        """
+        Delete job records in the given statuses last updated before a timestamp
+        
+        Returns:
+            Number of jobs deleted
+        """
+        deleted = 0
+        for job in list(self.in_memory_jobs.iter(include_image=True)):
+            if job["status"] in statuses and job["updated_at"] < finished_before:
+                deleted += self.in_memory_jobs.delete(job["id"])
+        if self.use_mongodb:
+            try:
+                result = self._retry(
+                    self.jobs.delete_many,
+                    {"status": {"$in": statuses}, "updated_at": {"$lt": finished_before}}
+                )
+                deleted += result.deleted_count
+            except ConnectionFailure as e:
+                self._fall_back("delete", e)
+        return deleted
     
     def close(self):
-        """Close database connection"""
+        """Close database connection and snapshot local storage"""
+        with self._start_lock:
+            self._closed.set()
         if self.client:
             self.client.close()
-
-
-# Global database instance
-db_manager = DatabaseManager()
-
+        self.in_memory_storage.close()
+        self.write_behind.close()
+        self.in_memory_jobs.close()
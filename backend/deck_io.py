@@ -0,0 +1,283 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+from typing import AsyncIterator, IO, Iterator, Optional, Tuple
+from dotenv import load_dotenv
+from models import Flashcard
+from database import DatabaseManager
+from image_store import image_url, store_inline_image, ImageStore, IMAGE_HASH_PATTERN
+
+# Load environment variables
+load_dotenv()
+
+# Import/export configuration
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))  # spill uploads to disk above this
+EXPORT_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 20
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8", "zip": "application/zip"}
+
+# Exported card fields; images travel by hash (and as archive members in zip), never inline
+EXPORT_FIELDS = [name for name in Flashcard.model_fields if name != "image"]
+CARDS_MEMBER = "cards.ndjson"
+IMAGES_PREFIX = "images/"
+
+
+def export_record(document: dict) -> dict:
+    """Keep the exported fields of a flashcard document"""
+    return {field: document[field] for field in EXPORT_FIELDS if field in document}
+
+
+class _ExportStats:
+    """Counts exported cards and logs throughput when done"""
+
+    def __init__(self, format: str):
+        self.format = format
+        self.count = 0
+        self.started = time.perf_counter()
+
+    def done(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.count / elapsed if elapsed else 0.0
+        print(f"✓ Exported {self.count} flashcards as {self.format} in {elapsed:.2f}s ({rate:.0f} cards/s)")
+
+
+async def export_ndjson(documents: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Stream flashcard documents as NDJSON in EXPORT_CHUNK_SIZE-ish chunks"""
+    stats = _ExportStats("ndjson")
+    buffer = []
+    size = 0
+    async for document in documents:
+        line = (json.dumps(export_record(document), ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        stats.count += 1
+        if size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+    stats.done()
+
+
+async def export_csv(documents: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Stream flashcard documents as CSV with an EXPORT_FIELDS header row"""
+    stats = _ExportStats("csv")
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    async for document in documents:
+        writer.writerow(export_record(document))
+        stats.count += 1
+        if text.tell() >= EXPORT_CHUNK_SIZE:
+            yield text.getvalue().encode("utf-8")
+            text.seek(0)
+            text.truncate()
+    if text.tell():
+        yield text.getvalue().encode("utf-8")
+    stats.done()
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, non-seekable sink that zipfile streams into"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def export_zip(documents: AsyncIterator[dict], store: ImageStore) -> AsyncIterator[bytes]:
+    """
+    Stream a zip archive holding cards.ndjson and one images/<hash> member per image
+
+    Only image hashes are kept in memory; each image is read and written on its own.
+    Compression and image reads run in worker threads, about EXPORT_CHUNK_SIZE
+    of cards at a time.
+    """
+    stats = _ExportStats("zip")
+    sink = _ZipStream()
+    image_hashes = set()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(CARDS_MEMBER, "w", force_zip64=True) as cards:
+            buffer = []
+            size = 0
+            async for document in documents:
+                record = export_record(document)
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                buffer.append(line)
+                size += len(line)
+                stats.count += 1
+                for field in ("image_hash", "thumbnail_hash"):
+                    if record.get(field):
+                        image_hashes.add(record[field])
+                if size >= EXPORT_CHUNK_SIZE:
+                    await asyncio.to_thread(cards.write, b"".join(buffer))
+                    buffer, size = [], 0
+                    # The compressor emits blocks as its buffer fills, so this yields sizeable chunks
+                    if sink.chunks:
+                        yield sink.drain()
+            if buffer:
+                await asyncio.to_thread(cards.write, b"".join(buffer))
+        yield sink.drain()
+
+        for image_hash in sorted(image_hashes):
+            image = await asyncio.to_thread(store.get, image_hash)
+            if image is None:
+                continue
+            # Images are already compressed; deflating them again only costs CPU
+            await asyncio.to_thread(
+                archive.writestr, IMAGES_PREFIX + image_hash, image[0], compress_type=zipfile.ZIP_STORED
+            )
+            yield sink.drain()
+    yield sink.drain()
+    stats.done()
+
+
+def _parse_ndjson(lines: IO[str]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"invalid JSON ({e})"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "expected a JSON object"
+            continue
+        yield number, record, None
+
+
+def _parse_csv(lines: IO[str]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    for number, row in enumerate(csv.DictReader(lines), 1):
+        # Empty cells mean "not set", so model defaults apply
+        yield number, {field: value for field, value in row.items() if field and value not in ("", None)}, None
+
+
+def read_records(file: IO[bytes], format: str, store: ImageStore) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Parse an uploaded deck
+
+    Args:
+        file: Seekable binary file holding the upload
+        format: "ndjson", "csv" or "zip"
+        store: Image store receiving the images of a zip archive
+
+    Yields:
+        (record number, record, error); record is None when error is set
+    """
+    if format == "zip":
+        with zipfile.ZipFile(file) as archive:
+            # Store images first so cards never reference a missing image
+            for name in archive.namelist():
+                if not name.startswith(IMAGES_PREFIX) or name.endswith("/"):
+                    continue
+                expected_hash = name[len(IMAGES_PREFIX):]
+                if not IMAGE_HASH_PATTERN.match(expected_hash):
+                    continue
+                if store.put(archive.read(name)) != expected_hash:
+                    yield 0, None, f"image {name} does not match its hash"
+            if CARDS_MEMBER not in archive.namelist():
+                raise ValueError(f"Archive has no {CARDS_MEMBER}")
+            with archive.open(CARDS_MEMBER) as cards:
+                yield from _parse_ndjson(io.TextIOWrapper(cards, encoding="utf-8"))
+        return
+
+    lines = io.TextIOWrapper(file, encoding="utf-8-sig", newline="" if format == "csv" else None)
+    try:
+        yield from (_parse_csv(lines) if format == "csv" else _parse_ndjson(lines))
+    finally:
+        # Leave the underlying upload open for the caller
+        lines.detach()
+
+
+def import_deck(
+    file: IO[bytes],
+    format: str,
+    database: DatabaseManager,
+    store: ImageStore,
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Import a deck, writing flashcards in batches
+
+    Cards keep their IDs, so re-importing an export replaces the existing
+    cards instead of duplicating them; cards without an ID get a new one.
+
+    Args:
+        file: Seekable binary file holding the upload
+        format: "ndjson", "csv" or "zip"
+        database: Database to write to
+        store: Image store for inline and archived images
+        batch_size: Cards per bulk write
+
+    Returns:
+        Counts, the first errors and throughput
+
+    Raises:
+        ValueError: If the upload cannot be read at all
+    """
+    started = time.perf_counter()
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    try:
+        for number, record, error in read_records(file, format, store):
+            if error is None:
+                try:
+                    document = Flashcard(**store_inline_image(record, store)).model_dump()
+                    for hash_field, url_field in (("image_hash", "image_url"), ("thumbnail_hash", "thumbnail_url")):
+                        if document[hash_field] and not document[url_field]:
+                            document[url_field] = image_url(document[hash_field])
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(f"Record {number}: {error}")
+                continue
+
+            batch.append(document)
+            if len(batch) >= batch_size:
+                database.upsert_flashcards(batch)
+                imported += len(batch)
+                batch = []
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive: {e}")
+    except csv.Error as e:
+        raise ValueError(f"Invalid CSV: {e}")
+
+    database.upsert_flashcards(batch)
+    imported += len(batch)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "cards_per_second": round(imported / elapsed, 1) if elapsed else 0.0
+    }
@@ -0,0 +1,419 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from tts_cache import normalize_text
+
+# Load environment variables
+load_dotenv()
+
+# Offline dictionary configuration
+DICTIONARY_ENABLED = os.getenv("DICTIONARY_ENABLED", "true").lower() == "true"
+# Word lists named <source>-<target>.tsv, e.g. en-th.tsv: "headword<TAB>translation[<TAB>description]" per line
+DICTIONARY_DIR = os.getenv("DICTIONARY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dictionaries"))
+# Compiled, memory-mapped indexes of the word lists; rebuilt when a list changes
+DICTIONARY_INDEX_DIR = os.getenv(
+    "DICTIONARY_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "dictionaries")
+)
+
+INDEX_MAGIC = b"FCDICT3\n"  # FCDICT1 indexes had lowercased keys, FCDICT2 ones no folded keys
+INDEX_HEADER = struct.Struct("<8sI")  # magic, entry count
+INDEX_OFFSET = struct.Struct("<I")  # file offset of one entry
+
+# Inflected English forms that suffix rules cannot undo
+IRREGULAR_LEMMAS = {
+    "am": "be", "is": "be", "are": "be", "was": "be", "were": "be", "been": "be",
+    "has": "have", "had": "have", "does": "do", "did": "do", "done": "do",
+    "went": "go", "gone": "go", "came": "come", "ate": "eat", "eaten": "eat",
+    "drank": "drink", "drunk": "drink", "saw": "see", "seen": "see", "ran": "run",
+    "made": "make", "took": "take", "taken": "take", "gave": "give", "given": "give",
+    "got": "get", "knew": "know", "known": "know", "thought": "think", "told": "tell",
+    "found": "find", "bought": "buy", "brought": "bring", "wrote": "write", "written": "write",
+    "spoke": "speak", "spoken": "speak", "slept": "sleep", "felt": "feel", "said": "say",
+    "swam": "swim", "children": "child", "men": "man", "women": "woman", "people": "person",
+    "feet": "foot", "teeth": "tooth", "mice": "mouse", "geese": "goose",
+    "better": "good", "best": "good", "worse": "bad", "worst": "bad"
+}
+VOWELS = set("aeiou")
+
+
+def english_lemmas(word: str) -> List[str]:
+    """
+    Candidate base forms of an inflected English word, most likely first
+
+    Rule-based: plurals, possessives, -ed, -ing and comparatives, plus
+    IRREGULAR_LEMMAS. Candidates are only useful as dictionary keys; most of
+    them are not words.
+    """
+    candidates = []
+    if word in IRREGULAR_LEMMAS:
+        candidates.append(IRREGULAR_LEMMAS[word])
+    if word.endswith("'s"):
+        candidates.append(word[:-2])
+    for suffix, replacements in (
+        ("ies", ("y",)),
+        ("ves", ("f", "fe")),
+        ("es", ("",)),
+        ("s", ("",)),
+        ("ied", ("y",)),
+        ("ed", ("", "e")),
+        ("ying", ("ie",)),
+        ("ing", ("", "e")),
+        ("ier", ("y",)),
+        ("iest", ("y",)),
+        ("er", ("", "e")),
+        ("est", ("", "e"))
+    ):
+        if not word.endswith(suffix) or len(word) - len(suffix) < 2:
+            continue
+        if suffix == "s" and word.endswith("ss"):
+            continue
+        stem = word[:-len(suffix)]
+        candidates.extend(stem + replacement for replacement in replacements)
+        # stopped -> stop, running -> run, bigger -> big
+        if suffix in ("ed", "ing", "er", "est") and len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in VOWELS:
+            candidates.append(stem[:-1])
+    return list(dict.fromkeys(candidate for candidate in candidates if len(candidate) > 1 and candidate != word))
+
+
+# Language code -> lemmatizer; languages without one only get exact hits
+LEMMATIZERS = {
+    "en": english_lemmas
+}
+
+
+def lemma_keys(key: str, language: str) -> List[str]:
+    """Dictionary keys to try after an exact miss; in a phrase only the last word is lemmatized"""
+    lemmatize = LEMMATIZERS.get(language)
+    if lemmatize is None:
+        return []
+    head, _, last = key.rpartition(" ")
+    prefix = f"{head} " if head else ""
+    return [prefix + lemma for lemma in lemmatize(last)]
+
+
+def fold(key: str) -> str:
+    """Case-insensitive form of a normalized key"""
+    return key.lower()
+
+
+def compile_dictionary(source_path: str, index_path: str) -> int:
+    """
+    Build the sorted binary index of a TSV word list
+
+    Layout: INDEX_HEADER, one INDEX_OFFSET per entry in key order, then the
+    entries as UTF-8 "folded key<TAB>key<TAB>translation<TAB>description<LF>".
+    Keys are normalized like translation cache keys, and sorted by their
+    lower-case (folded) form, so headwords differing only in case are
+    neighbours; the first line for a key wins.
+    The index is written to a temporary file and renamed into place, so
+    processes building it at once never see a partial file.
+
+    Returns:
+        Number of entries
+    """
+    entries: Dict[bytes, bytes] = {}
+    with open(source_path, encoding="utf-8-sig") as source:
+        for line in source:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.rstrip("\n").split("\t")]
+            if len(fields) < 2 or not fields[0] or not fields[1]:
+                continue
+            key = normalize_text(fields[0]).encode("utf-8")
+            description = fields[2] if len(fields) > 2 else ""
+            entries.setdefault(key, f"{fields[1]}\t{description}".encode("utf-8"))
+
+    keys = sorted(entries, key=lambda key: (fold(key.decode("utf-8")).encode("utf-8"), key))
+    offset = INDEX_HEADER.size + INDEX_OFFSET.size * len(keys)
+    offsets = bytearray()
+    records = bytearray()
+    for key in keys:
+        offsets += INDEX_OFFSET.pack(offset + len(records))
+        records += fold(key.decode("utf-8")).encode("utf-8") + b"\t" + key + b"\t" + entries[key] + b"\n"
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(index_path))
+    try:
+        with os.fdopen(fd, "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(keys)))
+            index_file.write(offsets)
+            index_file.write(records)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, index_path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return len(keys)
+
+
+class BilingualDictionary:
+    """
+    Word list of one language pair, memory-mapped from its compiled index
+
+    Opening costs one mmap call however large the list is, pages are shared
+    by every worker process, and a lookup is a binary search over the offset
+    table touching O(log n) entries.
+    """
+
+    def __init__(self, index_path: str):
+        with open(index_path, "rb") as index_file:
+            self.data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = INDEX_HEADER.unpack_from(self.data, 0)
+        if magic != INDEX_MAGIC:
+            self.data.close()
+            raise ValueError(f"{index_path} is not a dictionary index")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _entry(self, position: int) -> Tuple[int, int]:
+        """(start, end of folded key) of the entry at a position in key order"""
+        start, = INDEX_OFFSET.unpack_from(self.data, INDEX_HEADER.size + INDEX_OFFSET.size * position)
+        return start, self.data.find(b"\t", start)
+
+    def find(self, key: str) -> List[Tuple[str, str, str]]:
+        """
+        Look up a normalized key, ignoring case
+
+        Returns:
+            (headword, translation, description) of every headword equal to
+            the key but for case, usually none or one
+        """
+        target = fold(key).encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start, end = self._entry(middle)
+            if self.data[start:end] < target:
+                low = middle + 1
+            else:
+                high = middle
+        matches = []
+        for position in range(low, self.count):
+            start, end = self._entry(position)
+            if self.data[start:end] != target:
+                break
+            line_end = self.data.find(b"\n", end)
+            headword, translation, description = self.data[end + 1:line_end].decode("utf-8").split("\t", 2)
+            matches.append((headword, translation, description))
+        return matches
+
+    def close(self):
+        self.data.close()
+
+
+class LookupTier:
+    """
+    A translation source consulted before Gemini
+
+    Subclass it and add an instance to LocalTranslator.tiers to plug in
+    another source (a phrasebook, another service, ...).
+    """
+
+    name = "local"
+
+    def lookup(self, text: str, source_lang: str, target_lang: str) -> Optional[Tuple[str, dict]]:
+        """
+        Translate text, if this tier knows it for certain
+
+        Returns:
+            (tier that answered, dict with original_text, translated_text and
+            image_description), or None to fall through to the next tier
+        """
+        raise NotImplementedError
+
+    def suggest(self, text: str, source_lang: str, target_lang: str) -> Optional[Tuple[str, dict]]:
+        """
+        A likely but unconfirmed translation, e.g. of a related word
+
+        Only used when the cache and Gemini give no answer. Same return value
+        as lookup().
+        """
+        return None
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class DictionaryTier(LookupTier):
+    """
+    Offline bilingual dictionaries
+
+    An exact headword match is an answer, and so is a match ignoring case
+    when the list has no other headword differing only in case: "Apple"
+    finds "apple", but "POLISH" answers nothing while the list has both
+    "Polish" and "polish". A match on a base form ("apples" -> "apple") is
+    just a suggestion: suffix rules cannot tell "news" or "goods" from
+    plurals, so those go to the cache and Gemini.
+    Word lists in DICTIONARY_DIR are compiled to DICTIONARY_INDEX_DIR on
+    first use of their language pair (again whenever the list is newer than
+    its index) and memory-mapped from there.
+    """
+
+    name = "dictionary"
+
+    def __init__(self, directory: str = DICTIONARY_DIR, index_directory: str = DICTIONARY_INDEX_DIR):
+        self.directory = directory
+        self.index_directory = index_directory
+        self.lock = threading.Lock()
+        # (source, target) -> dictionary, or None when there is no word list for the pair
+        self.dictionaries: Dict[Tuple[str, str], Optional[BilingualDictionary]] = {}
+
+    def _open(self, source_lang: str, target_lang: str) -> Optional[BilingualDictionary]:
+        pair = (source_lang, target_lang)
+        if pair in self.dictionaries:
+            return self.dictionaries[pair]
+        with self.lock:
+            if pair not in self.dictionaries:
+                self.dictionaries[pair] = self._load(f"{source_lang}-{target_lang}")
+            return self.dictionaries[pair]
+
+    def _load(self, name: str) -> Optional[BilingualDictionary]:
+        source_path = os.path.join(self.directory, f"{name}.tsv")
+        index_path = os.path.join(self.index_directory, f"{name}.idx")
+        try:
+            source_mtime = os.path.getmtime(source_path)
+        except OSError:
+            return None
+        try:
+            if os.path.exists(index_path) and os.path.getmtime(index_path) >= source_mtime:
+                try:
+                    return BilingualDictionary(index_path)
+                except ValueError:
+                    pass  # Index of an older format: rebuild it
+            count = compile_dictionary(source_path, index_path)
+            print(f"✓ Compiled {name} dictionary ({count} entries)")
+            return BilingualDictionary(index_path)
+        except (OSError, ValueError) as e:
+            print(f"Dictionary {name} unavailable: {e}")
+            return None
+
+    def lookup(self, text: str, source_lang: str, target_lang: str) -> Optional[Tuple[str, dict]]:
+        dictionary = self._open(source_lang, target_lang)
+        if dictionary is None:
+            return None
+        key = normalize_text(text)
+        matches = dictionary.find(key)
+        for headword, translation, description in matches:
+            if headword == key:
+                return "dictionary", self._result(text, (translation, description))
+        if len(matches) == 1:
+            _, translation, description = matches[0]
+            return "dictionary", self._result(text, (translation, description))
+        return None
+
+    def suggest(self, text: str, source_lang: str, target_lang: str) -> Optional[Tuple[str, dict]]:
+        dictionary = self._open(source_lang, target_lang)
+        if dictionary is None:
+            return None
+        folded = fold(normalize_text(text))
+        for candidate in [folded] + lemma_keys(folded, source_lang):
+            matches = dictionary.find(candidate)
+            if matches:
+                # Headwords differing only in case: prefer the lower-case one
+                _, translation, description = min(matches, key=lambda match: match[0] != candidate)
+                return "lemma", self._result(text, (translation, description))
+        return None
+
+    @staticmethod
+    def _result(text: str, entry: Tuple[str, str]) -> dict:
+        translation, description = entry
+        return {
+            "original_text": text,
+            "translated_text": translation,
+            "image_description": description or f"Visual representation of {text}"
+        }
+
+    def stats(self) -> dict:
+        return {
+            f"{source}-{target}": len(dictionary)
+            for (source, target), dictionary in list(self.dictionaries.items()) if dictionary is not None
+        }
+
+    def close(self):
+        with self.lock:
+            for dictionary in self.dictionaries.values():
+                if dictionary is not None:
+                    dictionary.close()
+            self.dictionaries.clear()
+
+
+class LocalTranslator:
+    """Runs a translation through the local tiers in order and counts which one answered"""
+
+    def __init__(self, tiers: List[LookupTier]):
+        self.tiers = tiers
+        self.lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses = 0
+        self.fallbacks = 0
+
+    def translate(self, text: str, source_lang: str, target_lang: str) -> Optional[dict]:
+        """
+        Translate text without calling Gemini
+
+        Returns:
+            dict with original_text, translated_text, image_description and
+            the tier that answered, or None if no tier knows the text
+        """
+        answer = self._ask("lookup", text, source_lang, target_lang)
+        with self.lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits[answer["tier"]] = self.hits.get(answer["tier"], 0) + 1
+        return answer
+
+    def fallback(self, text: str, source_lang: str, target_lang: str) -> Optional[dict]:
+        """
+        Best local guess for text that the cache and Gemini could not translate
+
+        Returns:
+            Same as translate(), from the tiers' suggestions
+        """
+        answer = self._ask("suggest", text, source_lang, target_lang)
+        if answer is not None:
+            with self.lock:
+                self.fallbacks += 1
+        return answer
+
+    def _ask(self, method: str, text: str, source_lang: str, target_lang: str) -> Optional[dict]:
+        for tier in self.tiers:
+            try:
+                answer = getattr(tier, method)(text, source_lang, target_lang)
+            except Exception as e:
+                print(f"Translation tier {tier.name} failed: {e}")
+                continue
+            if answer is not None:
+                name, result = answer
+                return {**result, "tier": name}
+        return None
+
+    def stats(self) -> dict:
+        """Hits per tier, misses (passed on to the cache and Gemini), suggestions used when those failed and loaded word lists"""
+        with self.lock:
+            hits = dict(self.hits)
+            misses = self.misses
+            fallbacks = self.fallbacks
+        lookups = sum(hits.values()) + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "fallbacks": fallbacks,
+            "hit_rate": sum(hits.values()) / lookups if lookups else 0.0,
+            "dictionaries": {tier.name: tier.stats() for tier in self.tiers}
+        }
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
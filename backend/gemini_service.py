@@ -2,8 +2,20 @@ import os
 import google.generativeai as genai
 from dotenv import load_dotenv
 from PIL import Image
+import asyncio
 import io
 import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from translation_cache import TranslationCache
+from dictionary import LocalTranslator
+from metrics import TRANSLATION_LATENCY, TRANSLATIONS, span, traced
+from resilience import CircuitBreaker, CircuitOpenError, ConcurrencyLimiter, InvalidReplyError, ResilientCaller
+from rate_limit import RateLimiter, current_client, record_gemini_usage
 
 # Load environment variables
 load_dotenv()
@@ -12,15 +24,228 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Batch generation configuration
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "25"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Most Gemini requests in flight at once per process, across all routes and jobs, retries and hedges included
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# Deadlines, retries, hedging and circuit breaking for Gemini calls
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))  # seconds per attempt
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "45"))  # seconds per call, retries included
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))  # extra attempts after a retryable error
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", "0.5"))  # seconds, doubled per attempt
+GEMINI_RETRY_MAX_BACKOFF = float(os.getenv("GEMINI_RETRY_MAX_BACKOFF", "4"))
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95"))  # latency after which a duplicate is sent
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "1.0"))  # seconds
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))  # consecutive failures that open the circuit
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds before a probe call
+
+# Errors that are worth another attempt: rate limiting, overload, timeouts and unusable replies
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    TimeoutError,
+    ConnectionError,
+    InvalidReplyError
+)
+
+# Map language codes to full names
+LANGUAGE_NAMES = {
+    "en": "English",
+    "th": "Thai"
+}
+
+# JSON schemas Gemini's replies are constrained to
+TRANSLATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "translation": {"type": "string"},
+        "description": {"type": "string"}
+    },
+    "required": ["translation", "description"]
+}
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "translation": {"type": "string"},
+                    "description": {"type": "string"}
+                },
+                "required": ["index", "translation", "description"]
+            }
+        }
+    },
+    "required": ["items"]
+}
+IMAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "word": {"type": "string"},
+        "translation": {"type": "string"},
+        "description": {"type": "string"}
+    },
+    "required": ["word", "translation", "description"]
+}
+
+
+class GeminiError(RuntimeError):
+    """Raised when Gemini gives no usable answer within the retries and deadline"""
+
+
+class _TranslationReply(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    translation: str = Field(min_length=1)
+    description: str = ""
+
+
+class _ImageReply(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    word: str = Field(min_length=1)
+    translation: str = Field(min_length=1)
+    description: str = ""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed Gemini attempt is worth repeating"""
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def json_config(schema: dict) -> genai.GenerationConfig:
+    """Generation config constraining the reply to JSON matching schema"""
+    return genai.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+
 
 class GeminiService:
-    """Service for interacting with Google Gemini API"""
+    """
+    Service for interacting with Google Gemini API
+    
+    Replies are requested in JSON mode against a schema and validated; a
+    reply that does not validate is retried like a timeout instead of being
+    stored. Every call goes through a ResilientCaller: GEMINI_TIMEOUT per
+    attempt, GEMINI_DEADLINE overall, GEMINI_RETRIES retries with jittered
+    backoff, optional hedging, and a circuit breaker that refuses calls for
+    GEMINI_BREAKER_RESET seconds after GEMINI_BREAKER_FAILURES failures in a row.
+    
+    Translations are answered by the local translator, then the translation
+    cache, and only then by Gemini, whose token usage is charged to the rate limiter.
+    """
     
-    def __init__(self):
+    def __init__(self, translation_cache: TranslationCache, local_translator: LocalTranslator, rate_limiter: RateLimiter):
+        self.translation_cache = translation_cache
+        self.local_translator = local_translator
+        self.rate_limiter = rate_limiter
         # Use gemini-2.5-flash for text and gemini-pro-vision for images
         self.text_model = genai.GenerativeModel('gemini-2.5-flash')
         self.vision_model = genai.GenerativeModel('gemini-2.5-flash')
+        # Bounds how many batch chunks are sent to Gemini at once
+        self.batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+        self._batch_semaphore = None
+        # Bounds concurrent model requests from the event loop and worker threads alike
+        self.call_slots = ConcurrencyLimiter(GEMINI_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker("gemini", GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET)
+        self.caller = ResilientCaller(
+            "gemini",
+            timeout=GEMINI_TIMEOUT,
+            deadline=GEMINI_DEADLINE,
+            retries=GEMINI_RETRIES,
+            backoff=GEMINI_RETRY_BACKOFF,
+            max_backoff=GEMINI_RETRY_MAX_BACKOFF,
+            retryable=is_retryable,
+            breaker=self.breaker,
+            hedge=GEMINI_HEDGE_ENABLED,
+            hedge_quantile=GEMINI_HEDGE_QUANTILE,
+            hedge_min_delay=GEMINI_HEDGE_MIN_DELAY,
+            limiter=self.call_slots
+        )
     
+    @property
+    def batch_semaphore(self) -> asyncio.Semaphore:
+        """Async counterpart of batch_executor, created inside the running event loop"""
+        if self._batch_semaphore is None:
+            self._batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        return self._batch_semaphore
+    
+    def _generate(self, operation: str, model, contents, schema: dict, parse: Callable[[str], Any], payload_bytes: Optional[int] = None) -> Any:
+        """
+        Ask Gemini for a JSON reply and parse it, with deadlines, retries and the circuit breaker
+        
+        Args:
+            operation: Name for spans and metrics, e.g. "translation"
+            model: Model to call
+            contents: Prompt (and image) to send
+            schema: JSON schema the reply must follow
+            parse: Turns the reply text into the result; raises InvalidReplyError if it is unusable
+            payload_bytes: Size of the data sent, for the span
+        
+        Tokens used by every attempt are charged to the current client's
+        daily budget. Each attempt, hedged duplicates included, holds one of
+        GEMINI_MAX_CONCURRENCY slots shared with async callers.
+        
+        Raises:
+            CircuitOpenError: If Gemini has been failing and is not being called
+            Exception: The last attempt's error
+        """
+        client = current_client.get()
+        
+        def attempt(timeout: float):
+            with span(f"gemini.api.{operation}", payload_bytes=payload_bytes):
+                response = model.generate_content(
+                    contents,
+                    generation_config=json_config(schema),
+                    request_options={"timeout": timeout}
+                )
+            self.rate_limiter.record_usage(client, record_gemini_usage(operation, response))
+            return parse(response.text)
+        
+        return self.caller.call(operation, attempt)
+    
+    async def _generate_async(
+        self,
+        operation: str,
+        model,
+        contents,
+        schema: dict,
+        parse: Callable[[str], Any],
+        payload_bytes: Optional[int] = None
+    ) -> Any:
+        """Non-blocking version of _generate; slow attempts may also be hedged"""
+        client = current_client.get()
+        
+        async def attempt(timeout: float):
+            with span(f"gemini.api.{operation}", payload_bytes=payload_bytes):
+                response = await model.generate_content_async(
+                    contents,
+                    generation_config=json_config(schema),
+                    request_options={"timeout": timeout}
+                )
+            await self.rate_limiter.record_usage_async(client, record_gemini_usage(operation, response))
+            return parse(response.text)
+        
+        return await self.caller.call_async(operation, attempt)
+    
+    def _unavailable(self, what: str) -> GeminiError:
+        """Error for a call that produced nothing: the open circuit, or a plain failure"""
+        if self.breaker.is_open:
+            return CircuitOpenError("gemini", self.breaker.retry_after())
+        return GeminiError(f"Gemini returned no usable {what}")
+    
+    @traced("gemini.generate_translation")
     def generate_translation(self, text: str, source_lang: str = "en", target_lang: str = "th") -> dict:
         """
         Generate translation and description for text input
@@ -31,123 +256,460 @@ class GeminiService:
             target_lang: Target language code (default: "th")
         
         Returns:
-            dict with original_text, translated_text, and image_description
+            dict with original_text, translated_text, image_description and
+            the tier that answered: "dictionary" (offline dictionary),
+            "cache", "gemini" or, if Gemini failed, "lemma" (dictionary
+            entry of the word's base form)
+        
+        Raises:
+            CircuitOpenError: If Gemini has been failing and is not being called
+            GeminiError: If Gemini gave no usable translation
         """
-        # Map language codes to full names
-        lang_map = {
-            "en": "English",
-            "th": "Thai"
-        }
+        started = time.perf_counter()
+        local = self.local_translator.translate(text, source_lang, target_lang)
+        if local is not None:
+            return self._answered(local, started)
+        
+        called = False
+        
+        def compute() -> Optional[dict]:
+            nonlocal called
+            called = True
+            return self._request_translation(text, source_lang, target_lang)
+        
+        key = self.translation_cache.make_key(text, source_lang, target_lang)
+        result = self.translation_cache.get_or_compute(key, compute)
+        
+        if result is None:
+            # Gemini failed: settle for the dictionary's guess from the word's base form
+            result = self.local_translator.fallback(text, source_lang, target_lang)
+            if result is None:
+                raise self._unavailable("translation")
+            return self._answered(result, started)
+        return self._answered({**result, "original_text": text, "tier": "gemini" if called else "cache"}, started)
+    
+    @traced("gemini.generate_translation")
+    async def generate_translation_async(self, text: str, source_lang: str = "en", target_lang: str = "th") -> dict:
+        """Non-blocking version of generate_translation"""
+        started = time.perf_counter()
+        # Binary search over a memory-mapped index; cheap enough for the event loop
+        local = self.local_translator.translate(text, source_lang, target_lang)
+        if local is not None:
+            return self._answered(local, started)
+        
+        called = False
+        
+        def compute() -> Awaitable[Optional[dict]]:
+            nonlocal called
+            called = True
+            return self._request_translation_async(text, source_lang, target_lang)
         
-        source_language = lang_map.get(source_lang, source_lang)
-        target_language = lang_map.get(target_lang, target_lang)
+        key = self.translation_cache.make_key(text, source_lang, target_lang)
+        result = await self.translation_cache.get_or_compute_async(key, compute)
         
-        prompt = f"""
+        if result is None:
+            # Gemini failed: settle for the dictionary's guess from the word's base form
+            result = self.local_translator.fallback(text, source_lang, target_lang)
+            if result is None:
+                raise self._unavailable("translation")
+            return self._answered(result, started)
+        return self._answered({**result, "original_text": text, "tier": "gemini" if called else "cache"}, started)
+    
+    def _fill_suggestions(self, texts: List[str], results: List[Optional[dict]], source_lang: str, target_lang: str):
+        """Replace failed batch results with the offline dictionary's guesses, where it has one"""
+        for index, result in enumerate(results):
+            if result is None:
+                results[index] = self.local_translator.fallback(texts[index], source_lang, target_lang)
+                if results[index] is not None:
+                    TRANSLATIONS.labels(results[index]["tier"]).inc()
+    
+    def _answered(self, result: dict, started: float) -> dict:
+        """Count a translation against the tier that answered it"""
+        TRANSLATIONS.labels(result["tier"]).inc()
+        TRANSLATION_LATENCY.labels(result["tier"]).observe(time.perf_counter() - started)
+        return result
+    
+    def _translation_prompt(self, text: str, source_lang: str, target_lang: str) -> str:
+        """Build the prompt for a single translation"""
+        source_language = LANGUAGE_NAMES.get(source_lang, source_lang)
+        target_language = LANGUAGE_NAMES.get(target_lang, target_lang)
+        
+        return f"""
 You are a language learning assistant. Given a word or phrase in {source_language}, provide:
 1. The translation in {target_language}
 2. A brief description of the word/phrase that would help create a visual representation
 
-Input: "{text}"
+Input: {json.dumps(text, ensure_ascii=False)}
 
-Please respond in the following format:
-Translation: [translation here]
-Description: [brief visual description here]
+Respond with a JSON object in the following format:
+{{"translation": "...", "description": "..."}}
 
 Note: The translation does not need to include pronunciation.
 """
+    
+    def _parse_translation(self, text: str, result_text: str) -> dict:
+        """
+        Parse and validate a single translation reply
         
+        Raises:
+            InvalidReplyError: If the reply is not JSON with a non-empty translation
+        """
         try:
-            response = self.text_model.generate_content(prompt)
-            result_text = response.text
-            
-            # Parse the response
-            translation = ""
-            description = ""
-            
-            for line in result_text.split('\n'):
-                if line.startswith('Translation:'):
-                    translation = line.replace('Translation:', '').strip()
-                elif line.startswith('Description:'):
-                    description = line.replace('Description:', '').strip()
-            
-            return {
-                "original_text": text,
-                "translated_text": translation if translation else text,
-                "image_description": description if description else f"Visual representation of {text}"
-            }
+            reply = _TranslationReply.model_validate_json(result_text)
+        except ValidationError as e:
+            raise InvalidReplyError(f"Invalid translation reply for {text!r}: {e.error_count()} errors")
+        
+        return {
+            "original_text": text,
+            "translated_text": reply.translation,
+            "image_description": reply.description or f"Visual representation of {text}"
+        }
+    
+    def _request_translation(self, text: str, source_lang: str, target_lang: str) -> Optional[dict]:
+        """
+        Ask Gemini for a translation
+        
+        Args:
+            text: The text to translate
+            source_lang: Source language code
+            target_lang: Target language code
+        
+        Returns:
+            dict with original_text, translated_text, and image_description,
+            or None if the request failed or returned no translation
+        """
+        try:
+            return self._generate(
+                "translation",
+                self.text_model,
+                self._translation_prompt(text, source_lang, target_lang),
+                TRANSLATION_SCHEMA,
+                lambda reply: self._parse_translation(text, reply)
+            )
         except Exception as e:
             print(f"Error generating translation: {e}")
-            # Fallback response
-            return {
-                "original_text": text,
-                "translated_text": text,
-                "image_description": f"Visual representation of {text}"
-            }
+            return None
     
-    def analyze_image(self, image_data: bytes, target_lang: str = "th") -> dict:
+    async def _request_translation_async(self, text: str, source_lang: str, target_lang: str) -> Optional[dict]:
+        """Non-blocking version of _request_translation"""
+        try:
+            return await self._generate_async(
+                "translation",
+                self.text_model,
+                self._translation_prompt(text, source_lang, target_lang),
+                TRANSLATION_SCHEMA,
+                lambda reply: self._parse_translation(text, reply)
+            )
+        except Exception as e:
+            print(f"Error generating translation: {e}")
+            return None
+    
+    @traced("gemini.generate_translations_batch")
+    def generate_translations_batch(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "th",
+        chunk_size: int = BATCH_CHUNK_SIZE
+    ) -> List[Optional[dict]]:
         """
-        Analyze an image and generate vocabulary with translation
+        Generate translations for many words, packing each chunk into one Gemini call
         
         Args:
-            image_data: Image data in bytes
-            target_lang: Target language for translation (default: "th")
+            texts: Words or phrases to translate
+            source_lang: Source language code (default: "en")
+            target_lang: Target language code (default: "th")
+            chunk_size: Number of uncached texts sent per Gemini call
         
         Returns:
-            dict with original_text, translated_text, and image_description
+            One result per input text (same order), tagged with the tier that
+            answered it; None where translation failed
         """
-        # Map language codes to full names
-        lang_map = {
-            "en": "English",
-            "th": "Thai"
-        }
+        results = self._local_results(texts, source_lang, target_lang)
+        keys = [self.translation_cache.make_key(text, source_lang, target_lang) for text in texts]
+        for index, key in enumerate(keys):
+            if results[index] is None:
+                results[index] = self._from_cache(self.translation_cache.lookup(key))
+        chunks = self._pending_chunks(results, chunk_size)
+        
+        # Only dictionary and cache misses go to Gemini
+        futures = [
+            self.batch_executor.submit(
+                self._request_translation_chunk,
+                [texts[index] for index in chunk],
+                source_lang,
+                target_lang
+            )
+            for chunk in chunks
+        ]
+        for chunk, future in zip(chunks, futures):
+            self._merge_chunk(keys, results, chunk, future.result())
+        
+        self._fill_suggestions(texts, results, source_lang, target_lang)
+        return self._with_original_text(texts, results)
+    
+    @traced("gemini.generate_translations_batch")
+    async def generate_translations_batch_async(
+        self,
+        texts: List[str],
+        source_lang: str = "en",
+        target_lang: str = "th",
+        chunk_size: int = BATCH_CHUNK_SIZE
+    ) -> List[Optional[dict]]:
+        """Non-blocking version of generate_translations_batch"""
+        results = self._local_results(texts, source_lang, target_lang)
+        keys = [self.translation_cache.make_key(text, source_lang, target_lang) for text in texts]
+        for index, key in enumerate(keys):
+            if results[index] is None:
+                results[index] = self._from_cache(await self.translation_cache.lookup_async(key))
+        chunks = self._pending_chunks(results, chunk_size)
         
-        target_language = lang_map.get(target_lang, target_lang)
+        async def run_chunk(chunk: List[int]) -> List[Optional[dict]]:
+            async with self.batch_semaphore:
+                return await self._request_translation_chunk_async(
+                    [texts[index] for index in chunk],
+                    source_lang,
+                    target_lang
+                )
+        
+        # Only dictionary and cache misses go to Gemini
+        chunk_results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            self._merge_chunk(keys, results, chunk, chunk_result)
+        
+        self._fill_suggestions(texts, results, source_lang, target_lang)
+        return self._with_original_text(texts, results)
+    
+    def _local_results(self, texts: List[str], source_lang: str, target_lang: str) -> List[Optional[dict]]:
+        """Offline dictionary answers, None where the cache and Gemini have to be asked"""
+        results = [self.local_translator.translate(text, source_lang, target_lang) for text in texts]
+        for result in results:
+            if result is not None:
+                TRANSLATIONS.labels(result["tier"]).inc()
+        return results
+    
+    def _from_cache(self, result: Optional[dict]) -> Optional[dict]:
+        if result is None:
+            return None
+        TRANSLATIONS.labels("cache").inc()
+        return {**result, "tier": "cache"}
+    
+    def _pending_chunks(self, results: List[Optional[dict]], chunk_size: int) -> List[List[int]]:
+        """Group the indexes of texts without a local or cached result into chunks"""
+        pending = [index for index, result in enumerate(results) if result is None]
+        return [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    
+    def _merge_chunk(self, keys: List[str], results: List[Optional[dict]], chunk: List[int], chunk_results: List[Optional[dict]]):
+        """Store a chunk's results in place and cache the successful ones"""
+        for index, result in zip(chunk, chunk_results):
+            if result is not None:
+                self.translation_cache.store(keys[index], result)
+                TRANSLATIONS.labels("gemini").inc()
+                result = {**result, "tier": "gemini"}
+            results[index] = result
+    
+    def _with_original_text(self, texts: List[str], results: List[Optional[dict]]) -> List[Optional[dict]]:
+        """Report each result against the text exactly as it was submitted"""
+        return [
+            {**result, "original_text": text} if result is not None else None
+            for text, result in zip(texts, results)
+        ]
+    
+    def _batch_prompt(self, texts: List[str], source_lang: str, target_lang: str) -> str:
+        """Build the JSON-mode prompt for a chunk of translations"""
+        source_language = LANGUAGE_NAMES.get(source_lang, source_lang)
+        target_language = LANGUAGE_NAMES.get(target_lang, target_lang)
+        
+        inputs = "\n".join(f"{index}: {json.dumps(text, ensure_ascii=False)}" for index, text in enumerate(texts))
+        return f"""
+You are a language learning assistant. For each numbered word or phrase in {source_language} below, provide:
+1. The translation in {target_language}
+2. A brief description of the word/phrase that would help create a visual representation
+
+Inputs:
+{inputs}
+
+Respond with a JSON object in the following format, with one item per input:
+{{"items": [{{"index": 0, "translation": "...", "description": "..."}}]}}
+
+Note: The translation does not need to include pronunciation.
+"""
+    
+    def _parse_batch(self, texts: List[str], result_text: str) -> List[Optional[dict]]:
+        """
+        Parse a JSON-mode batch reply; None for items it has no translation for
+        
+        Raises:
+            InvalidReplyError: If the reply is not a JSON object with an items list
+        """
+        try:
+            items = json.loads(result_text).get("items")
+        except (ValueError, AttributeError):
+            items = None
+        if not isinstance(items, list):
+            raise InvalidReplyError(f"Invalid batch reply for {len(texts)} texts")
+        
+        results: List[Optional[dict]] = [None] * len(texts)
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index")
+            translation = str(item.get("translation") or "").strip()
+            if not isinstance(index, int) or not 0 <= index < len(texts) or not translation:
+                continue
+            description = str(item.get("description") or "").strip()
+            results[index] = {
+                "original_text": texts[index],
+                "translated_text": translation,
+                "image_description": description if description else f"Visual representation of {texts[index]}"
+            }
+        return results
+    
+    def _request_translation_chunk(self, texts: List[str], source_lang: str, target_lang: str) -> List[Optional[dict]]:
+        """
+        Ask Gemini for translations of several texts in one JSON-mode call
+        
+        Args:
+            texts: Texts to translate
+            source_lang: Source language code
+            target_lang: Target language code
+        
+        Returns:
+            One result per text; None where the response had no usable translation
+        """
+        try:
+            results = self._generate(
+                "batch",
+                self.text_model,
+                self._batch_prompt(texts, source_lang, target_lang),
+                BATCH_SCHEMA,
+                lambda reply: self._parse_batch(texts, reply)
+            )
+        except Exception as e:
+            print(f"Error generating batch translation: {e}")
+            self.translation_cache.record_gemini_call(failed=True)
+            return [None] * len(texts)
         
+        self.translation_cache.record_gemini_call()
+        return results
+    
+    async def _request_translation_chunk_async(
+        self,
+        texts: List[str],
+        source_lang: str,
+        target_lang: str
+    ) -> List[Optional[dict]]:
+        """Non-blocking version of _request_translation_chunk"""
         try:
-            # Open image from bytes
-            image = Image.open(io.BytesIO(image_data))
-            
-            prompt = f"""
+            results = await self._generate_async(
+                "batch",
+                self.text_model,
+                self._batch_prompt(texts, source_lang, target_lang),
+                BATCH_SCHEMA,
+                lambda reply: self._parse_batch(texts, reply)
+            )
+        except Exception as e:
+            print(f"Error generating batch translation: {e}")
+            self.translation_cache.record_gemini_call(failed=True)
+            return [None] * len(texts)
+        
+        self.translation_cache.record_gemini_call()
+        return results
+    
+    def _image_prompt(self, target_lang: str) -> str:
+        """Build the prompt for image analysis"""
+        target_language = LANGUAGE_NAMES.get(target_lang, target_lang)
+        
+        return f"""
 Analyze this image and provide:
 1. A single word or short phrase in English that best describes the main subject or object in the image
 2. The translation of that word/phrase in {target_language}
 3. A brief description of what you see in the image
 
-Please respond in the following format:
-Word: [English word/phrase]
-Translation: [translation in {target_language}]
-Description: [brief description of the image]
+Respond with a JSON object in the following format:
+{{"word": "...", "translation": "...", "description": "..."}}
 """
-            
-            response = self.vision_model.generate_content([prompt, image])
-            result_text = response.text
-            
-            # Parse the response
-            word = ""
-            translation = ""
-            description = ""
-            
-            for line in result_text.split('\n'):
-                if line.startswith('Word:'):
-                    word = line.replace('Word:', '').strip()
-                elif line.startswith('Translation:'):
-                    translation = line.replace('Translation:', '').strip()
-                elif line.startswith('Description:'):
-                    description = line.replace('Description:', '').strip()
-            
-            return {
-                "original_text": word if word else "Unknown",
-                "translated_text": translation if translation else "Unknown",
-                "image_description": description if description else "Image content"
-            }
+    
+    def _image_part(self, image_data: bytes, mime_type: Optional[str]):
+        """Wrap image bytes for the vision model"""
+        if mime_type:
+            return {"mime_type": mime_type, "data": image_data}
+        # Open image from bytes
+        return Image.open(io.BytesIO(image_data))
+    
+    def _parse_image_analysis(self, result_text: str) -> dict:
+        """
+        Parse and validate an image analysis reply
+        
+        Raises:
+            InvalidReplyError: If the reply is not JSON with a non-empty word and translation
+        """
+        try:
+            reply = _ImageReply.model_validate_json(result_text)
+        except ValidationError as e:
+            raise InvalidReplyError(f"Invalid image analysis reply: {e.error_count()} errors")
+        
+        return {
+            "original_text": reply.word,
+            "translated_text": reply.translation,
+            "image_description": reply.description or "Image content"
+        }
+    
+    @traced("gemini.analyze_image")
+    def analyze_image(self, image_data: bytes, target_lang: str = "th", mime_type: Optional[str] = None) -> dict:
+        """
+        Analyze an image and generate vocabulary with translation
+        
+        Args:
+            image_data: Image data in bytes
+            target_lang: Target language for translation (default: "th")
+            mime_type: MIME type of already preprocessed image data; when given
+                the bytes are sent as is instead of being decoded with PIL
+        
+        Returns:
+            dict with original_text, translated_text, and image_description
+        
+        Raises:
+            CircuitOpenError: If Gemini has been failing and is not being called
+            GeminiError: If Gemini gave no usable analysis
+        """
+        try:
+            return self._generate(
+                "image",
+                self.vision_model,
+                [self._image_prompt(target_lang), self._image_part(image_data, mime_type)],
+                IMAGE_SCHEMA,
+                self._parse_image_analysis,
+                payload_bytes=len(image_data)
+            )
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"Error analyzing image: {e}")
-            # Fallback response
-            return {
-                "original_text": "Unknown",
-                "translated_text": "ไม่ทราบ",
-                "image_description": "Unable to analyze image"
-            }
+            raise GeminiError(f"Image analysis failed: {e}") from e
+    
+    @traced("gemini.analyze_image")
+    async def analyze_image_async(
+        self,
+        image_data: bytes,
+        target_lang: str = "th",
+        mime_type: Optional[str] = None
+    ) -> dict:
+        """Non-blocking version of analyze_image"""
+        try:
+            return await self._generate_async(
+                "image",
+                self.vision_model,
+                [self._image_prompt(target_lang), self._image_part(image_data, mime_type)],
+                IMAGE_SCHEMA,
+                self._parse_image_analysis,
+                payload_bytes=len(image_data)
+            )
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Error analyzing image: {e}")
+            raise GeminiError(f"Image analysis failed: {e}") from e
     
     def analyze_image_base64(self, image_base64: str, target_lang: str = "th") -> dict:
         """
@@ -159,20 +721,15 @@ Description: [brief description of the image]
         
         Returns:
             dict with original_text, translated_text, and image_description
+        
+        Raises:
+            ValueError: If the string is not valid base64
+            CircuitOpenError: If Gemini has been failing and is not being called
+            GeminiError: If Gemini gave no usable analysis
         """
         try:
             # Decode base64 to bytes
-            image_data = base64.b64decode(image_base64)
-            return self.analyze_image(image_data, target_lang)
+            image_data = base64.b64decode(image_base64, validate=True)
         except Exception as e:
-            print(f"Error decoding base64 image: {e}")
-            return {
-                "original_text": "Unknown",
-                "translated_text": "ไม่ทราบ",
-                "image_description": "Unable to decode image"
-            }
-
-
-# Global Gemini service instance
-gemini_service = GeminiService()
-
+            raise ValueError(f"Unable to decode image: {e}")
+        return self.analyze_image(image_data, target_lang)
@@ -0,0 +1,101 @@
+import time
+from typing import Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from models import Flashcard
+from async_database import AsyncDatabaseManager
+from gemini_service import GeminiService
+from image_store import ImageStore, image_url
+from image_pipeline import ImagePipeline
+from tts_prefetch import TTSPrefetcher
+
+
+class InvalidImageError(ValueError):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+async def generate_from_image(
+    image_path: str,
+    target_language: str,
+    reuse_duplicates: bool,
+    timings: dict,
+    database: AsyncDatabaseManager,
+    gemini: GeminiService,
+    store: ImageStore,
+    pipeline: ImagePipeline,
+    prefetcher: TTSPrefetcher
+) -> Tuple[Flashcard, Optional[str]]:
+    """
+    Preprocess an uploaded image, analyze it with Gemini and save the flashcard
+
+    Shared by the synchronous image route and the background job workers.
+
+    Args:
+        image_path: Path of the spooled upload; it is read by the preprocessing worker
+        target_language: Target language for translation
+        reuse_duplicates: Return the card of a near-identical image instead of analyzing it
+        timings: Per-stage timings in ms are added to this dict
+        database: Flashcard storage
+        gemini: Gemini client
+        store: Image store for the display image and thumbnail
+        pipeline: Preprocessing worker pool
+        prefetcher: Synthesizes the new card's audio in the background
+
+    Returns:
+        (flashcard, ID of the reused card or None)
+
+    Raises:
+        InvalidImageError: If the upload is not a readable image
+    """
+    # Decode once, auto-orient and derive model/display/thumbnail sizes
+    try:
+        processed = await pipeline.process(image_path)
+    except Exception as e:
+        raise InvalidImageError(f"Invalid image file: {str(e)}")
+    timings.update(processed["timings"])
+
+    # Another shot of an already captured object reuses its card
+    if reuse_duplicates:
+        started = time.perf_counter()
+        duplicate = await database.find_similar_image(processed["perceptual_hash"])
+        timings["dedupe"] = round((time.perf_counter() - started) * 1000, 2)
+        if duplicate is not None:
+            existing, _ = duplicate
+            return existing, existing.id
+
+    # Analyze the downscaled image with Gemini
+    started = time.perf_counter()
+    analysis_result = await gemini.analyze_image_async(
+        processed["model_image"],
+        target_language,
+        mime_type=processed["model_content_type"]
+    )
+    timings["analyze"] = round((time.perf_counter() - started) * 1000, 2)
+
+    # Store the display version and thumbnail; the flashcard only references them by hash
+    started = time.perf_counter()
+    image_hash = await run_in_threadpool(
+        store.put, processed["display_image"], processed["display_content_type"]
+    )
+    thumbnail_hash = await run_in_threadpool(
+        store.put, processed["thumbnail"], processed["thumbnail_content_type"]
+    )
+    timings["store_image"] = round((time.perf_counter() - started) * 1000, 2)
+
+    # Create flashcard
+    flashcard = Flashcard(
+        original_text=analysis_result["original_text"],
+        translated_text=analysis_result["translated_text"],
+        image_description=analysis_result["image_description"],
+        image_hash=image_hash,
+        image_url=image_url(image_hash),
+        thumbnail_hash=thumbnail_hash,
+        thumbnail_url=image_url(thumbnail_hash),
+        image_phash=processed["perceptual_hash"]
+    )
+
+    # Save to database
+    started = time.perf_counter()
+    saved_flashcard = await database.create_flashcard(flashcard)
+    timings["save"] = round((time.perf_counter() - started) * 1000, 2)
+    prefetcher.prefetch(saved_flashcard)
+    return saved_flashcard, None
@@ -0,0 +1,169 @@
+import asyncio
+import io
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from metrics import traced
+from image_similarity import dhash
+
+# Load environment variables
+load_dotenv()
+
+# Image preprocessing configuration
+IMAGE_MODEL_MAX_EDGE = int(os.getenv("IMAGE_MODEL_MAX_EDGE", "1024"))
+IMAGE_DISPLAY_MAX_EDGE = int(os.getenv("IMAGE_DISPLAY_MAX_EDGE", "1600"))
+IMAGE_THUMBNAIL_MAX_EDGE = int(os.getenv("IMAGE_THUMBNAIL_MAX_EDGE", "320"))
+IMAGE_DISPLAY_FORMAT = os.getenv("IMAGE_DISPLAY_FORMAT", "WEBP").upper()  # WEBP or JPEG
+IMAGE_DISPLAY_QUALITY = int(os.getenv("IMAGE_DISPLAY_QUALITY", "82"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Forking a process that already runs threads (MongoDB health checks, thread pools) can copy a held
+# lock into the child, so workers start from a clean fork server, or a fresh interpreter without one
+IMAGE_START_METHOD = os.getenv(
+    "IMAGE_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp"
+}
+
+
+def _fit(size: Tuple[int, int], max_edge: int) -> Tuple[int, int]:
+    """Size with the same aspect ratio whose longest edge is max_edge"""
+    scale = max_edge / max(size)
+    return max(1, math.ceil(size[0] * scale)), max(1, math.ceil(size[1] * scale))
+
+
+def _resize(image: Image.Image, max_edge: int) -> Image.Image:
+    """Return the image with its longest edge at most max_edge; the image itself if it already fits"""
+    if max(image.size) <= max_edge:
+        return image
+    # reducing_gap box-reduces large images first, then finishes with LANCZOS
+    return image.resize(_fit(image.size, max_edge), Image.LANCZOS, reducing_gap=3.0)
+
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    """Encode an image to bytes"""
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def preprocess_image(source: Union[str, bytes]) -> dict:
+    """
+    Decode an uploaded image once and derive every size we need from it
+
+    Args:
+        source: Path of the uploaded image file, or its raw bytes
+
+    Returns:
+        dict with model_image (JPEG sent to Gemini), display_image, thumbnail,
+        their content types, the oriented size, the perceptual hash used to
+        spot near-duplicate uploads and per-stage timings in ms
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    def mark(stage: str):
+        nonlocal started
+        now = time.perf_counter()
+        timings[stage] = round((now - started) * 1000, 2)
+        started = now
+
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    width, height = image.size
+    if max(image.size) > IMAGE_DISPLAY_MAX_EDGE:
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale, as long as the display size still fits
+        image.draft("RGB", _fit(image.size, IMAGE_DISPLAY_MAX_EDGE))
+    image.load()
+    mark("decode")
+
+    # Camera captures are often stored sideways with an EXIF rotation flag
+    decoded_size = image.size
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.size != decoded_size:
+        width, height = height, width
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    mark("orient")
+
+    display = _resize(image, IMAGE_DISPLAY_MAX_EDGE)
+    display_image = _encode(display, IMAGE_DISPLAY_FORMAT, IMAGE_DISPLAY_QUALITY)
+    mark("display")
+
+    # Derive the smaller sizes from the already downscaled display copy
+    model_image = _encode(_resize(display, IMAGE_MODEL_MAX_EDGE), "JPEG", 85)
+    mark("model")
+
+    thumbnail = _encode(_resize(display, IMAGE_THUMBNAIL_MAX_EDGE), IMAGE_DISPLAY_FORMAT, IMAGE_DISPLAY_QUALITY)
+    mark("thumbnail")
+
+    perceptual_hash = dhash(display)
+    mark("phash")
+
+    return {
+        "model_image": model_image,
+        "model_content_type": "image/jpeg",
+        "display_image": display_image,
+        "display_content_type": CONTENT_TYPES.get(IMAGE_DISPLAY_FORMAT, "application/octet-stream"),
+        "thumbnail": thumbnail,
+        "thumbnail_content_type": CONTENT_TYPES.get(IMAGE_DISPLAY_FORMAT, "application/octet-stream"),
+        "width": width,
+        "height": height,
+        "perceptual_hash": perceptual_hash,
+        "timings": timings
+    }
+
+
+class ImagePipeline:
+    """Runs image preprocessing in a process pool so it never blocks the event loop"""
+
+    def __init__(self, max_workers: int = IMAGE_WORKERS):
+        self.max_workers = max_workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Start the worker processes on first use"""
+        if self.executor is None:
+            context = multiprocessing.get_context(IMAGE_START_METHOD)
+            if IMAGE_START_METHOD == "forkserver":
+                # Imported once in the fork server, so each worker starts with Pillow loaded
+                context.set_forkserver_preload([__name__])
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self.executor
+
+    @traced("image.preprocess")
+    async def process(self, source: Union[str, bytes]) -> dict:
+        """
+        Preprocess an image in a worker process
+
+        Pass a path where possible: the worker then reads the file itself
+        instead of the image bytes being copied to it.
+
+        Args:
+            source: Path of the uploaded image file, or its raw bytes
+
+        Returns:
+            Result of preprocess_image
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), preprocess_image, source)
+
+    def close(self):
+        """Stop the worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def format_server_timing(timings: dict) -> str:
+    """Format stage timings (in ms) as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={duration}" for stage, duration in timings.items())
@@ -0,0 +1,152 @@
+import io
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+# Load environment variables
+load_dotenv()
+
+HASH_BITS = 64
+HASH_SIZE = 8  # dHash compares neighbours on a (HASH_SIZE + 1) x HASH_SIZE grid
+
+# Document field holding the perceptual hash bands in MongoDB; never returned to clients
+BANDS_FIELD = "phash_bands"
+# Any two hashes within BAND_COUNT - 1 bits share at least one whole band (pigeonhole),
+# so an exact-match index on the bands finds every candidate for such distances
+BAND_COUNT = 6
+
+# Largest Hamming distance (of 64 bits) treated as the same picture
+IMAGE_DUPLICATE_MAX_DISTANCE = min(int(os.getenv("IMAGE_DUPLICATE_MAX_DISTANCE", "4")), BAND_COUNT - 1)
+
+
+def dhash(image: Image.Image) -> str:
+    """
+    Difference hash of an image as 16 hex digits
+
+    Each bit records whether a pixel of a tiny grayscale copy is brighter than
+    its right-hand neighbour, so re-encoding, rescaling and small exposure
+    changes leave the hash (nearly) unchanged.
+    """
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return f"{value:016x}"
+
+
+def perceptual_hash(image_data: bytes) -> str:
+    """dHash of encoded image bytes, after applying the EXIF orientation"""
+    image = Image.open(io.BytesIO(image_data))
+    return dhash(ImageOps.exif_transpose(image))
+
+
+def _popcount(value: int) -> int:
+    return bin(value).count("1")
+
+
+def hamming(first: str, second: str) -> int:
+    """Number of differing bits between two hex hashes"""
+    return _popcount(int(first, 16) ^ int(second, 16))
+
+
+def _band_bounds() -> List[Tuple[int, int]]:
+    """(shift, width) of each band, spreading the 64 bits as evenly as possible"""
+    bounds = []
+    start = 0
+    for band in range(BAND_COUNT):
+        width = HASH_BITS // BAND_COUNT + (1 if band < HASH_BITS % BAND_COUNT else 0)
+        bounds.append((HASH_BITS - start - width, width))
+        start += width
+    return bounds
+
+
+BAND_BOUNDS = _band_bounds()
+
+
+def hash_bands(phash: str) -> List[str]:
+    """Band terms of a hash ("<band>:<bits>") for the MongoDB multikey index"""
+    value = int(phash, 16)
+    return [f"{band}:{(value >> shift) & ((1 << width) - 1):x}" for band, (shift, width) in enumerate(BAND_BOUNDS)]
+
+
+def with_hash_bands(document: dict) -> dict:
+    """Copy of a flashcard document with its hash bands added, for writing to MongoDB"""
+    phash = document.get("image_phash")
+    return {**document, BANDS_FIELD: hash_bands(phash) if phash else []}
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over perceptual hashes, for Hamming-distance lookups
+
+    Every child of a node sits at a known distance from it, so the triangle
+    inequality prunes all subtrees that cannot hold a match; a lookup with a
+    small radius visits a tiny fraction of 100k+ hashes. Removing a flashcard
+    only drops its ID; the hash node stays in place to keep the tree valid.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root: Optional[list] = None  # [hash value, {distance: child node}]
+        self.ids: Dict[int, Set[str]] = {}  # hash value -> flashcard IDs
+        self.doc_hashes: Dict[str, int] = {}
+
+    def add(self, flashcard_id: str, phash: str):
+        """Index (or re-index) a flashcard's image hash"""
+        value = int(phash, 16)
+        with self.lock:
+            self._remove(flashcard_id)
+            self.doc_hashes[flashcard_id] = value
+            if value in self.ids:
+                self.ids[value].add(flashcard_id)
+                return
+            self.ids[value] = {flashcard_id}
+            if self.root is None:
+                self.root = [value, {}]
+                return
+            node = self.root
+            while True:
+                distance = _popcount(node[0] ^ value)
+                child = node[1].get(distance)
+                if child is None:
+                    node[1][distance] = [value, {}]
+                    return
+                node = child
+
+    def remove(self, flashcard_id: str):
+        """Drop a flashcard from the index"""
+        with self.lock:
+            self._remove(flashcard_id)
+
+    def _remove(self, flashcard_id: str):
+        value = self.doc_hashes.pop(flashcard_id, None)
+        if value is not None:
+            # Empty sets are kept: the value is still a node of the tree
+            self.ids[value].discard(flashcard_id)
+
+    def search(self, phash: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        Find flashcards whose image hash is within max_distance bits
+
+        Returns:
+            List of (distance, flashcard ID), closest first
+        """
+        value = int(phash, 16)
+        matches = []
+        with self.lock:
+            pending = [self.root] if self.root is not None else []
+            while pending:
+                node = pending.pop()
+                distance = _popcount(node[0] ^ value)
+                if distance <= max_distance:
+                    matches.extend((distance, flashcard_id) for flashcard_id in self.ids[node[0]])
+                for child_distance, child in node[1].items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        pending.append(child)
+        matches.sort()
+        return matches
@@ -0,0 +1,235 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from database import DatabaseManager
+from metrics import record_fallback, traced
+from image_similarity import perceptual_hash
+
+# Load environment variables
+load_dotenv()
+
+# Image store configuration
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_store"))
+IMAGE_BUCKET_NAME = "images"
+
+IMAGE_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Magic numbers for the image formats browsers and cameras produce
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def guess_content_type(data: bytes) -> str:
+    """Guess an image MIME type from its leading bytes"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def image_url(image_hash: str) -> str:
+    """Return the API path that serves an image"""
+    return f"/images/{image_hash}"
+
+
+class ImageStore:
+    """Content-addressed image storage: GridFS with MongoDB, local files otherwise"""
+
+    def __init__(self, database: DatabaseManager, store_dir: str = IMAGE_STORE_DIR):
+        self.database = database
+        self.store_dir = store_dir
+        self._bucket = None
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @property
+    def bucket(self):
+        """GridFS bucket, created on first use"""
+        if self._bucket is None:
+            import gridfs
+            self._bucket = gridfs.GridFSBucket(self.database.db, bucket_name=IMAGE_BUCKET_NAME)
+        return self._bucket
+
+    def _local_path(self, image_hash: str) -> str:
+        """Return the on-disk path for an image, sharded by hash prefix"""
+        return os.path.join(self.store_dir, image_hash[:2], image_hash)
+
+    @traced("image_store.put")
+    def put(self, data: bytes, content_type: Optional[str] = None) -> str:
+        """
+        Store image bytes, deduplicated by content
+
+        Args:
+            data: Raw image bytes
+            content_type: MIME type (guessed from the bytes if not given)
+
+        Returns:
+            SHA-256 hash identifying the image
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        if not content_type or not content_type.startswith("image/"):
+            content_type = guess_content_type(data)
+
+        if self.database.use_mongodb:
+            try:
+                files = self.database.db[f"{IMAGE_BUCKET_NAME}.files"]
+                if files.find_one({"filename": image_hash}, {"_id": 1}) is None:
+                    self.bucket.upload_from_stream(
+                        image_hash, data, metadata={"content_type": content_type}
+                    )
+                return image_hash
+            except Exception as e:
+                print(f"GridFS upload failed: {e}, using local image store")
+                record_fallback("image upload")
+
+        # Use local file storage
+        path = self._local_path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except Exception:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                raise
+        return image_hash
+
+    @traced("image_store.get")
+    def get(self, image_hash: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Load an image
+
+        Args:
+            image_hash: Hash returned by put()
+
+        Returns:
+            Tuple of (image bytes, content type), or None if not found
+        """
+        if not IMAGE_HASH_PATTERN.match(image_hash):
+            return None
+
+        if self.database.use_mongodb:
+            try:
+                with self.bucket.open_download_stream_by_name(image_hash) as stream:
+                    metadata = stream.metadata or {}
+                    data = stream.read()
+                    return data, metadata.get("content_type") or guess_content_type(data)
+            except Exception:
+                # Not in GridFS (or GridFS unavailable); it may have been stored locally
+                pass
+
+        # Use local file storage
+        path = self._local_path(image_hash)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as image_file:
+            data = image_file.read()
+        return data, guess_content_type(data)
+
+
+def store_inline_image(data: dict, store: "ImageStore") -> dict:
+    """
+    Move a base64 image from flashcard data into the image store
+
+    Args:
+        data: Flashcard fields, possibly with a base64 "image"
+        store: Image store to put the image in
+
+    Returns:
+        Flashcard fields referencing the stored image by hash
+
+    Raises:
+        ValueError: If the image is not valid base64
+    """
+    if not data.get("image"):
+        return data
+    try:
+        image_data = base64.b64decode(data["image"], validate=True)
+    except Exception:
+        raise ValueError("Invalid base64 image")
+    image_hash = store.put(image_data)
+    return {
+        **data,
+        "image": "",
+        "image_hash": image_hash,
+        "image_url": image_url(image_hash),
+        "image_phash": _try_perceptual_hash(image_data)
+    }
+
+
+def _try_perceptual_hash(image_data: bytes) -> str:
+    """Perceptual hash of image bytes, or "" if they cannot be decoded"""
+    try:
+        return perceptual_hash(image_data)
+    except Exception:
+        return ""
+
+
+def migrate_inline_images(database: DatabaseManager, store: "ImageStore") -> int:
+    """
+    Move base64 images embedded in flashcards into the image store
+
+    Args:
+        database: Database holding the flashcards
+        store: Image store to move the images into
+
+    Returns:
+        Number of flashcards migrated
+    """
+    migrated = 0
+    for data in database.iter_flashcards(include_image=True):
+        if not data.get("image"):
+            continue
+        try:
+            image_data = base64.b64decode(data["image"])
+        except Exception as e:
+            print(f"Skipping flashcard {data.get('id')}: invalid base64 image ({e})")
+            continue
+        image_hash = store.put(image_data)
+        database.update_flashcard(data["id"], {
+            "image": "",
+            "image_hash": image_hash,
+            "image_url": image_url(image_hash),
+            "image_phash": _try_perceptual_hash(image_data)
+        })
+        migrated += 1
+    return migrated
+
+
+def backfill_perceptual_hashes(database: DatabaseManager, store: "ImageStore") -> int:
+    """
+    Compute the perceptual hash of stored images that do not have one yet
+
+    Args:
+        database: Database holding the flashcards
+        store: Image store holding their images
+
+    Returns:
+        Number of flashcards updated
+    """
+    updated = 0
+    for data in database.iter_flashcards():
+        if data.get("image_phash") or not data.get("image_hash"):
+            continue
+        image = store.get(data["image_hash"])
+        if image is None:
+            continue
+        phash = _try_perceptual_hash(image[0])
+        if phash:
+            database.update_flashcard(data["id"], {"image_phash": phash})
+            updated += 1
+    return updated
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from database import DatabaseManager
+from gemini_service import GeminiError
+from image_flashcards import InvalidImageError
+from metrics import JOB_QUEUE_DEPTH, JOBS_FINISHED, span
+from models import Flashcard
+from rate_limit import current_client
+from resilience import CircuitOpenError
+from uploads import SpooledUpload
+
+# Load environment variables
+load_dotenv()
+
+# Background job configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))  # queued jobs before uploads are refused
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 60 * 60)))  # seconds finished jobs are kept
+JOB_UPLOAD_DIR = os.getenv("JOB_UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_uploads"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "600"))  # seconds before a running job of another host is retried
+JOB_EVENT_KEEPALIVE = 15.0  # seconds between SSE keep-alive comments
+JOB_EVENT_POLL = 2.0  # seconds between checks for changes made by other worker processes
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+PENDING_STATUSES = [QUEUED, RUNNING]
+FINISHED_STATUSES = [SUCCEEDED, FAILED]
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at JOB_QUEUE_SIZE"""
+
+
+class JobQueue:
+    """
+    Bounded queue of image-to-flashcard jobs worked off by asyncio tasks
+
+    Uploads are spooled to JOB_UPLOAD_DIR and job records are saved through
+    the DatabaseManager (MongoDB or local storage), so jobs still queued or
+    running when the server stops are picked up again on the next start.
+    Workers claim a job with a compare-and-set on its status, so with several
+    worker processes sharing the store each job still runs once. Status
+    changes are pushed to in-process subscribers for server-sent events;
+    changes made by other processes are picked up by polling.
+
+    Jobs are run by `generate`, called like image_flashcards.generate_from_image
+    without its service arguments, i.e. with them bound.
+    """
+
+    def __init__(
+        self,
+        database: DatabaseManager,
+        generate: Callable[[str, str, bool, dict], Awaitable[Tuple[Flashcard, Optional[str]]]],
+        workers: int = JOB_WORKERS,
+        max_size: int = JOB_QUEUE_SIZE,
+        upload_dir: str = JOB_UPLOAD_DIR
+    ):
+        self.database = database
+        self.generate = generate
+        self.workers = workers
+        self.max_size = max_size
+        self.upload_dir = upload_dir
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.worker_id: Optional[str] = None
+        os.makedirs(self.upload_dir, exist_ok=True)
+        JOB_QUEUE_DEPTH.set_function(lambda: self.queue.qsize() if self.queue is not None else 0)
+
+    def _upload_path(self, job_id: str) -> str:
+        return os.path.join(self.upload_dir, job_id)
+
+    async def start(self):
+        """Start the workers and requeue jobs left unfinished by a previous run"""
+        if self.queue is not None:
+            return
+        # Identifies this process in running jobs; set here, after any fork
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Unbounded internally: submit() enforces max_size, recovered jobs always fit
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._work(), name=f"job-worker-{index}") for index in range(self.workers)]
+
+        removed = await run_in_threadpool(
+            self.database.delete_jobs, time.time() - JOB_RETENTION, FINISHED_STATUSES
+        )
+        if removed:
+            print(f"✓ Removed {removed} finished jobs older than {JOB_RETENTION:.0f}s")
+
+        for job in await run_in_threadpool(self.database.find_jobs, PENDING_STATUSES):
+            if job["status"] == RUNNING and not self._abandoned(job):
+                # Running in another live worker process
+                continue
+            if not os.path.exists(self._upload_path(job["id"])):
+                await self._transition(job, status=FAILED, error="Upload lost before the job could run")
+                continue
+            if job["status"] == RUNNING and not await self._transition(job, status=QUEUED):
+                continue
+            # Other workers may queue the same job; whichever claims it first runs it
+            self.queue.put_nowait(job["id"])
+        if self.queue.qsize():
+            print(f"✓ Requeued {self.queue.qsize()} unfinished jobs")
+
+    async def stop(self):
+        """Cancel the workers; interrupted jobs stay pending and are retried on the next start"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+
+    async def submit(self, upload: SpooledUpload, target_language: str, reuse_duplicates: bool) -> dict:
+        """
+        Queue an image for flashcard generation
+
+        The spooled upload is moved into JOB_UPLOAD_DIR; the job owns it from then on.
+
+        Returns:
+            The new job record
+
+        Raises:
+            QueueFullError: If JOB_QUEUE_SIZE jobs are already waiting
+        """
+        if self.queue is None:
+            await self.start()
+        if self.queue.qsize() >= self.max_size:
+            raise QueueFullError(f"Job queue is full ({self.max_size} jobs waiting)")
+
+        now = time.time()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": "image_flashcard",
+            "status": QUEUED,
+            "params": {
+                "target_language": target_language,
+                "reuse_duplicates": reuse_duplicates,
+                "upload_bytes": upload.size,
+                "upload_sha256": upload.sha256,
+                # Gemini tokens the job uses are charged to the client that submitted it
+                "client": current_client.get()
+            },
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "duplicate_of": None,
+            "error": None,
+            "timings": {}
+        }
+        path = self._upload_path(job["id"])
+        # A rename when both directories share a filesystem, a copy otherwise
+        await run_in_threadpool(shutil.move, upload.path, path)
+        try:
+            await run_in_threadpool(self.database.save_job, job)
+        except Exception:
+            os.unlink(path)
+            raise
+        self.queue.put_nowait(job["id"])
+        return job
+
+    def _abandoned(self, job: dict) -> bool:
+        """Whether the worker running a job is gone: a dead process on this host, or no progress for JOB_STALE_AFTER"""
+        host, _, pid = (job.get("worker") or "").rpartition(":")
+        if not pid.isdigit():
+            # Recorded before workers were tracked
+            return True
+        if host == socket.gethostname():
+            if int(pid) == os.getpid():
+                # A previous process with our PID (common in containers); this one has not run anything yet
+                return True
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return time.time() - job["updated_at"] > JOB_STALE_AFTER
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """Get a job record by ID"""
+        return await run_in_threadpool(self.database.get_job, job_id)
+
+    async def events(self, job_id: str) -> AsyncIterator[bytes]:
+        """
+        Server-sent events with the job record: now, on every change, and until it finishes
+
+        Raises:
+            KeyError: If there is no such job
+        """
+        updates: asyncio.Queue = asyncio.Queue()
+        self.subscribers.setdefault(job_id, set()).add(updates)
+        # Subscribe before reading, so no change between the two is missed
+        job = await self.get(job_id)
+        if job is None:
+            self._unsubscribe(job_id, updates)
+            raise KeyError(job_id)
+
+        async def stream():
+            current = job
+            try:
+                yield _sse(current)
+                sent_at = time.monotonic()
+                while current["status"] not in FINISHED_STATUSES:
+                    try:
+                        current = await asyncio.wait_for(updates.get(), JOB_EVENT_POLL)
+                    except asyncio.TimeoutError:
+                        # The job may be run by another worker process, which cannot notify us
+                        latest = await self.get(job_id)
+                        if latest is None or latest["updated_at"] == current["updated_at"]:
+                            if time.monotonic() - sent_at >= JOB_EVENT_KEEPALIVE:
+                                # Comment line: keeps proxies from closing an idle connection
+                                yield b": keep-alive\n\n"
+                                sent_at = time.monotonic()
+                            continue
+                        current = latest
+                    yield _sse(current)
+                    sent_at = time.monotonic()
+            finally:
+                self._unsubscribe(job_id, updates)
+
+        return stream()
+
+    def _unsubscribe(self, job_id: str, updates: asyncio.Queue):
+        subscribers = self.subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(updates)
+            if not subscribers:
+                del self.subscribers[job_id]
+
+    async def _update(self, job: dict, **changes) -> dict:
+        """Save a changed job record and notify its subscribers"""
+        job = {**job, **changes, "updated_at": time.time()}
+        await run_in_threadpool(self.database.save_job, job)
+        self._notify(job)
+        return job
+
+    async def _transition(self, job: dict, **changes) -> Optional[dict]:
+        """Like _update, but only if no other worker changed the job's status meanwhile"""
+        changes["updated_at"] = time.time()
+        job = await run_in_threadpool(self.database.claim_job, job["id"], job["status"], changes)
+        if job is not None:
+            self._notify(job)
+        return job
+
+    def _notify(self, job: dict):
+        for updates in self.subscribers.get(job["id"], ()):
+            updates.put_nowait(job)
+
+    async def _work(self):
+        """Worker task: run queued jobs one at a time"""
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} could not be updated: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await self._transition({"id": job_id, "status": QUEUED}, status=RUNNING, worker=self.worker_id)
+        if job is None:
+            # Gone, or claimed by another worker
+            return
+        path = self._upload_path(job_id)
+        timings = {}
+        current_client.set(job["params"].get("client"))
+        try:
+            with span("job.image_flashcard"):
+                flashcard, duplicate_of = await self.generate(
+                    path,
+                    job["params"]["target_language"],
+                    job["params"]["reuse_duplicates"],
+                    timings
+                )
+        except asyncio.CancelledError:
+            # Shutting down: leave the job pending (and its upload in place) for the next start
+            raise
+        except (InvalidImageError, GeminiError, CircuitOpenError) as e:
+            job = await self._update(job, status=FAILED, error=str(e), timings=timings)
+        except Exception as e:
+            job = await self._update(job, status=FAILED, error=f"Error processing image: {str(e)}", timings=timings)
+        else:
+            job = await self._update(
+                job, status=SUCCEEDED, result=flashcard.model_dump(), duplicate_of=duplicate_of, timings=timings
+            )
+        JOBS_FINISHED.labels(job["status"]).inc()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _sse(job: dict) -> bytes:
+    """Format a job record as one server-sent event"""
+    return f"event: {job['status']}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n".encode("utf-8")
@@ -1,30 +1,142 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
-from typing import List
-import base64
-import io
-from gtts import gTTS
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, StreamingResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
+import functools
 import os
 import tempfile
+import time
+from gtts import gTTS
+import orjson
 
 from models import (
     Flashcard,
+    FlashcardChanges,
     FlashcardCreate,
     FlashcardUpdate,
     GenerateFlashcardRequest,
-    GenerateFlashcardResponse
+    GenerateFlashcardResponse,
+    BatchGenerateRequest,
+    BatchItemResult,
+    BatchGenerateResponse,
+    ReviewRequest,
+    ImportResponse,
+    Job,
+    UploadSession,
+    flashcard_document
 )
-from database import db_manager
-from gemini_service import gemini_service
+from database import DatabaseManager, ChangesExpiredError, WriteQueuedError
+from async_database import AsyncDatabaseManager
+from gemini_service import GeminiService, GeminiError
+from resilience import CircuitOpenError
+from tts_cache import TTSCache, detect_language
+from tts_stream import stream_speech, parse_range, iter_file_range
+from tts_prefetch import TTSPrefetcher, AUDIO_SIDES
+from translation_cache import TranslationCache, TRANSLATION_CACHE_PERSIST
+from dictionary import DictionaryTier, LocalTranslator, DICTIONARY_ENABLED
+from image_store import ImageStore, store_inline_image
+from image_pipeline import ImagePipeline, format_server_timing
+from image_flashcards import InvalidImageError, generate_from_image
+from jobs import JobQueue, QueueFullError
+from rate_limit import MongoBackend, RateLimiter, RateLimitMiddleware, RATE_LIMIT_BACKEND
+from uploads import (
+    UploadIncompleteError,
+    UploadLimitMiddleware,
+    UploadOffsetError,
+    UploadSessions,
+    UploadTooLargeError,
+    iter_multipart_file,
+    spool_upload
+)
+import scheduler
+from metrics import MetricsMiddleware, METRICS_CONTENT_TYPE, record_payload, render_metrics, span, traced
+from deck_io import MEDIA_TYPES, IMPORT_SPOOL_BYTES, export_csv, export_ndjson, export_zip, import_deck
+
+# Pagination limits for GET /flashcards/
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Seconds a client is asked to wait when the job queue is full
+JOB_RETRY_AFTER = 5
+
+# gTTS blocks on network I/O, so synthesis runs in its own bounded thread pool
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build the services when a worker process starts and stop them when it exits
+    
+    Services live on app.state and reach route handlers through the get_*
+    providers below. Importing this module creates none of them, so every
+    process (e.g. `uvicorn main:app --workers 4`) loads local storage and
+    starts its clients and pools here, after any fork. Nothing waits on the
+    network: the MongoDB client connects in the background, so a worker
+    serves requests right away.
+    """
+    db_manager = DatabaseManager()
+    async_db_manager = AsyncDatabaseManager(db_manager)
+    image_store = ImageStore(db_manager)
+    rate_limiter = RateLimiter(MongoBackend(db_manager) if RATE_LIMIT_BACKEND == "mongo" else None)
+    translation_cache = TranslationCache(database=db_manager if TRANSLATION_CACHE_PERSIST else None)
+    # The offline dictionaries, unless disabled
+    local_translator = LocalTranslator([DictionaryTier()] if DICTIONARY_ENABLED else [])
+    gemini_service = GeminiService(translation_cache, local_translator, rate_limiter)
+    tts_cache = TTSCache()
+    tts_prefetcher = TTSPrefetcher(tts_cache)
+    image_pipeline = ImagePipeline()
+    job_queue = JobQueue(db_manager, functools.partial(
+        generate_from_image,
+        database=async_db_manager,
+        gemini=gemini_service,
+        store=image_store,
+        pipeline=image_pipeline,
+        prefetcher=tts_prefetcher
+    ))
+    
+    app.state.db_manager = db_manager
+    app.state.async_db_manager = async_db_manager
+    app.state.image_store = image_store
+    app.state.rate_limiter = rate_limiter
+    app.state.translation_cache = translation_cache
+    app.state.local_translator = local_translator
+    app.state.gemini_service = gemini_service
+    app.state.tts_cache = tts_cache
+    app.state.tts_prefetcher = tts_prefetcher
+    app.state.tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS)
+    app.state.image_pipeline = image_pipeline
+    app.state.upload_sessions = UploadSessions()
+    app.state.job_queue = job_queue
+    
+    db_manager.start()
+    await job_queue.start()
+    yield
+    # Close database connections and stop worker pools
+    await job_queue.stop()
+    db_manager.close()
+    async_db_manager.close()
+    image_pipeline.close()
+    app.state.tts_executor.shutdown(wait=False)
+    tts_prefetcher.close()
+    local_translator.close()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="AI Language Flashcards API",
     description="API for creating and managing language learning flashcards with AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Per-client request limits and daily Gemini token budgets for the Gemini routes (429 with Retry-After),
+# using app.state.rate_limiter; added before CORS so refusals still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -32,27 +144,87 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After-Id", "Server-Timing", "Content-Range", "Accept-Ranges", "X-Profile-Id", "X-Duplicate-Of", "Location", "Upload-Offset", "Retry-After", "ETag"],
 )
 
+# Refuse oversized image uploads from their Content-Length, before the body is read
+app.add_middleware(UploadLimitMiddleware, prefixes=("/generate-flashcard-from-image/", "/uploads/"))
 
-@app.on_event("shutdown")
-def shutdown_event():
-    """Close database connection on shutdown"""
-    db_manager.close()
+# Per-route latency, in-flight and size metrics (and opt-in profiling); see /metrics
+app.add_middleware(MetricsMiddleware)
+
+
+def get_database(request: Request) -> AsyncDatabaseManager:
+    """Flashcard storage for route handlers; swap it with app.dependency_overrides"""
+    return request.app.state.async_db_manager
+
+
+def get_gemini_service(request: Request) -> GeminiService:
+    """Gemini client for route handlers; swap it with app.dependency_overrides"""
+    return request.app.state.gemini_service
+
+
+def get_image_store(request: Request) -> ImageStore:
+    """Image store for route handlers"""
+    return request.app.state.image_store
+
+
+def get_image_pipeline(request: Request) -> ImagePipeline:
+    """Image preprocessing pool for route handlers"""
+    return request.app.state.image_pipeline
+
+
+def get_tts_prefetcher(request: Request) -> TTSPrefetcher:
+    """Background audio synthesis for route handlers"""
+    return request.app.state.tts_prefetcher
+
+
+def get_upload_sessions(request: Request) -> UploadSessions:
+    """Resumable upload sessions for route handlers"""
+    return request.app.state.upload_sessions
+
+
+def get_job_queue(request: Request) -> JobQueue:
+    """Background job queue for route handlers"""
+    return request.app.state.job_queue
+
+
+def flashcards_response(flashcards: List[Flashcard], headers: Optional[dict] = None) -> ORJSONResponse:
+    """
+    Serialize a list of flashcards with orjson
+    
+    The flashcards come from the database read paths, which build them
+    without validation (see trusted_flashcard); returning a response directly
+    also skips FastAPI's re-validation against response_model, which for big
+    lists costs more than the database query.
+    """
+    return ORJSONResponse([vars(flashcard) for flashcard in flashcards], headers=headers)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match lists the ETag (or is *); weak and strong forms compare equal"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
 
 
 @app.get("/")
-def read_root():
+def read_root(request: Request):
     """Root endpoint"""
+    state = request.app.state
     return {
         "message": "AI Language Flashcards API",
         "version": "1.0.0",
-        "database": "MongoDB" if db_manager.use_mongodb else "In-Memory"
+        "database": "MongoDB" if state.db_manager.use_mongodb else "In-Memory",
+        "storage": state.db_manager.status(),
+        "limits": state.rate_limiter.stats()
     }
 
 
 @app.post("/generate-flashcard/", response_model=GenerateFlashcardResponse)
-def generate_flashcard(request: GenerateFlashcardRequest):
+async def generate_flashcard(request: GenerateFlashcardRequest, gemini: GeminiService = Depends(get_gemini_service)):
     """
     Generate flashcard content from text input using Gemini API
     
@@ -63,74 +235,378 @@ def generate_flashcard(request: GenerateFlashcardRequest):
         Generated flashcard content with translation and description
     """
     try:
-        result = gemini_service.generate_translation(
+        result = await gemini.generate_translation_async(
             text=request.text,
             source_lang=request.source_language,
             target_lang=request.target_language
         )
         return GenerateFlashcardResponse(**result)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(round(e.retry_after))})
+    except GeminiError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating flashcard: {str(e)}")
 
 
-@app.post("/generate-flashcard-from-image/", response_model=Flashcard)
+@app.post("/generate-flashcards/batch", response_model=BatchGenerateResponse)
+async def generate_flashcards_batch(
+    request: BatchGenerateRequest,
+    db: AsyncDatabaseManager = Depends(get_database),
+    gemini: GeminiService = Depends(get_gemini_service),
+    prefetcher: TTSPrefetcher = Depends(get_tts_prefetcher)
+):
+    """
+    Generate flashcard content for many words at once using Gemini API
+    
+    Args:
+        request: Words, language preferences and whether to save the flashcards
+    
+    Returns:
+        Per-word results; failures are reported per item
+    """
+    try:
+        results = await gemini.generate_translations_batch_async(
+            texts=request.texts,
+            source_lang=request.source_language,
+            target_lang=request.target_language
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating flashcards: {str(e)}")
+    
+    items = []
+    for index, (text, result) in enumerate(zip(request.texts, results)):
+        if result is None:
+            items.append(BatchItemResult(index=index, text=text, status="error", error="Translation failed"))
+        else:
+            items.append(BatchItemResult(
+                index=index,
+                text=text,
+                status="ok",
+                result=GenerateFlashcardResponse(**result)
+            ))
+    
+    if request.save:
+        succeeded = [item for item in items if item.status == "ok"]
+        flashcards = [Flashcard(**item.result.model_dump(exclude={"tier"})) for item in succeeded]
+        try:
+            errors = await db.create_flashcards(flashcards)
+        except Exception as e:
+            errors = [str(e)] * len(flashcards)
+        for item, flashcard, error in zip(succeeded, flashcards, errors):
+            if error is None:
+                item.flashcard = flashcard
+                prefetcher.prefetch(flashcard)
+            else:
+                item.status = "error"
+                item.error = f"Error saving flashcard: {error}"
+    
+    failed = sum(1 for item in items if item.status == "error")
+    return BatchGenerateResponse(items=items, succeeded=len(items) - failed, failed=failed)
+
+
+# The multipart body is parsed by the route as it streams in, so it is declared here for the docs
+IMAGE_UPLOAD_BODY = {
+    "requestBody": {
+        "required": False,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary", "description": "Uploaded image file"}}
+                }
+            }
+        }
+    }
+}
+
+
+@app.post("/generate-flashcard-from-image/", response_model=Flashcard, openapi_extra=IMAGE_UPLOAD_BODY)
 async def generate_flashcard_from_image(
-    file: UploadFile = File(...),
-    target_language: str = Query(default="th", description="Target language for translation")
+    request: Request,
+    response: Response,
+    upload_id: Optional[str] = Query(default=None, description="Completed resumable upload to use instead of a file"),
+    target_language: str = Query(default="th", description="Target language for translation"),
+    reuse_duplicates: bool = Query(default=True, description="Return the existing card for a near-identical image"),
+    mode: str = Query(default="sync", pattern="^(sync|job)$", description="sync, or job to return 202 and work in the background"),
+    db: AsyncDatabaseManager = Depends(get_database),
+    gemini: GeminiService = Depends(get_gemini_service),
+    store: ImageStore = Depends(get_image_store),
+    pipeline: ImagePipeline = Depends(get_image_pipeline),
+    prefetcher: TTSPrefetcher = Depends(get_tts_prefetcher),
+    uploads: UploadSessions = Depends(get_upload_sessions),
+    jobs: JobQueue = Depends(get_job_queue)
 ):
     """
     Generate and create a flashcard from an uploaded image using Gemini Vision API
     
+    The image is either sent as the multipart `file`, or uploaded beforehand
+    in chunks through /uploads/ and referenced by `upload_id`. Either way it
+    is spooled to disk (at most UPLOAD_MAX_BYTES) and preprocessed from the
+    file, so the full upload is never held in memory. A multipart body is
+    parsed while it arrives and the file written straight to the spool, so
+    it is not copied to a temporary file first.
+    
+    A photo that looks like the image of an existing card (same perceptual
+    hash, give or take IMAGE_DUPLICATE_MAX_DISTANCE bits) returns that card
+    instead of running a new analysis; its ID is sent in the X-Duplicate-Of header.
+    
+    With mode=job the upload is queued and answered right away with 202 and
+    the job (Location: /jobs/{id}); poll GET /jobs/{id} or follow
+    GET /jobs/{id}/events. A full queue answers 503 with Retry-After.
+    
     Args:
-        file: Uploaded image file
+        file: Uploaded image file (multipart form field)
+        upload_id: ID of a completed upload session, instead of file
         target_language: Target language for translation (default: "th")
+        reuse_duplicates: Reuse the card of a near-identical image (default: True)
+        mode: "sync" (default) or "job"
     
     Returns:
-        Complete flashcard object with generated content
+        Complete flashcard object with generated content; per-stage timings
+        are reported in the Server-Timing header
     """
+    content_type = request.headers.get("content-type", "")
+    has_file = content_type.startswith("multipart/form-data")
+    if has_file == (upload_id is not None):
+        raise HTTPException(status_code=400, detail="Send either an image file or an upload_id")
+    timings = {}
+    
     try:
-        # Read image file
-        image_data = await file.read()
+        # Stream the image to disk, or claim a completed resumable upload
+        started = time.perf_counter()
+        if has_file:
+            try:
+                with span("image.read_upload"):
+                    upload = await spool_upload(iter_multipart_file(request.stream(), content_type))
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            try:
+                upload = await run_in_threadpool(uploads.take, upload_id)
+            except KeyError:
+                raise HTTPException(status_code=404, detail="Upload not found")
+            except UploadIncompleteError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+        record_payload("image.read_upload", upload.size)
+        timings["read"] = round((time.perf_counter() - started) * 1000, 2)
         
-        # Convert to base64 for storage
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        with upload:
+            if mode == "job":
+                try:
+                    job = await jobs.submit(upload, target_language, reuse_duplicates)
+                except QueueFullError as e:
+                    raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(JOB_RETRY_AFTER)})
+                return JSONResponse(
+                    status_code=202,
+                    content=Job(**job).model_dump(),
+                    headers={"Location": f"/jobs/{job['id']}"}
+                )
+            
+            try:
+                flashcard, duplicate_of = await generate_from_image(
+                    upload.path,
+                    target_language,
+                    reuse_duplicates,
+                    timings,
+                    database=db,
+                    gemini=gemini,
+                    store=store,
+                    pipeline=pipeline,
+                    prefetcher=prefetcher
+                )
+            except InvalidImageError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except CircuitOpenError as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(round(e.retry_after))})
+            except GeminiError as e:
+                raise HTTPException(status_code=502, detail=str(e))
         
-        # Analyze image with Gemini
-        analysis_result = gemini_service.analyze_image(image_data, target_language)
-        
-        # Create flashcard
-        flashcard = Flashcard(
-            original_text=analysis_result["original_text"],
-            translated_text=analysis_result["translated_text"],
-            image_description=analysis_result["image_description"],
-            image=image_base64
-        )
-        
-        # Save to database
-        saved_flashcard = db_manager.create_flashcard(flashcard)
-        
-        return saved_flashcard
+        if duplicate_of:
+            response.headers["X-Duplicate-Of"] = duplicate_of
+        response.headers["Server-Timing"] = format_server_timing(timings)
+        return flashcard
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 
-@app.get("/flashcards/", response_model=List[Flashcard])
-def get_all_flashcards():
+@app.post("/uploads/", response_model=UploadSession, status_code=201)
+async def create_upload(
+    response: Response,
+    size: int = Query(..., ge=1, description="Total upload size in bytes"),
+    sha256: Optional[str] = Query(default=None, pattern="^[0-9a-fA-F]{64}$", description="Expected SHA-256 of the whole upload"),
+    uploads: UploadSessions = Depends(get_upload_sessions)
+):
+    """
+    Start a resumable image upload
+    
+    Send the bytes with PATCH /uploads/{id} in as many chunks as needed, then
+    pass the ID as `upload_id` to POST /generate-flashcard-from-image/.
+    
+    Args:
+        size: Total upload size in bytes (at most UPLOAD_MAX_BYTES)
+        sha256: Expected checksum; a completed upload that does not match is rejected
+    
+    Returns:
+        The upload session (Location: /uploads/{id})
+    """
+    try:
+        session = await run_in_threadpool(uploads.create, size, sha256)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    response.headers["Location"] = f"/uploads/{session['id']}"
+    return session
+
+
+@app.get("/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(upload_id: str, uploads: UploadSessions = Depends(get_upload_sessions)):
+    """
+    Get the state of a resumable upload; after a dropped connection, resume
+    with a chunk starting at `offset`
+    """
+    session = await run_in_threadpool(uploads.get, upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+@app.patch("/uploads/{upload_id}", response_model=UploadSession)
+async def append_upload(request: Request, upload_id: str, uploads: UploadSessions = Depends(get_upload_sessions)):
+    """
+    Append a chunk, sent as the raw request body, to a resumable upload
+    
+    The Upload-Offset header must equal the session's current offset;
+    otherwise the chunk is refused with 409 and the current offset is
+    returned in Upload-Offset. Bytes received before a connection drops are kept.
+    
+    Returns:
+        The upload session; `complete` and `sha256` are set after the last chunk
+    """
+    offset = request.headers.get("upload-offset", "")
+    if not offset.isdigit():
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+    try:
+        return await uploads.append(upload_id, int(offset), request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str, uploads: UploadSessions = Depends(get_upload_sessions)):
+    """Cancel a resumable upload and discard its bytes"""
+    if not await run_in_threadpool(uploads.delete, upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"message": "Upload deleted successfully"}
+
+
+@app.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, jobs: JobQueue = Depends(get_job_queue)):
     """
-    Get all flashcards
+    Get the state of a background job
+    
+    Args:
+        job_id: ID returned by POST /generate-flashcard-from-image/?mode=job
+    
+    Returns:
+        Job state; once succeeded, `result` holds the flashcard
+    """
+    job = await jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, jobs: JobQueue = Depends(get_job_queue)):
+    """
+    Follow a background job with server-sent events
+    
+    Sends the current state, then every change, and closes once the job has
+    succeeded or failed. Each event is named after the job status and carries
+    the job as JSON.
+    """
+    try:
+        events = await jobs.events(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/flashcards/", response_model=List[Flashcard], response_class=ORJSONResponse)
+async def get_all_flashcards(
+    request: Request,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after_id: Optional[str] = Query(default=None, description="Return flashcards after this ID"),
+    include_image: bool = Query(default=False, description="Include base64 image data"),
+    format: str = Query(default="json", pattern="^(json|ndjson)$", description="Response format"),
+    db: AsyncDatabaseManager = Depends(get_database)
+):
+    """
+    Get flashcards, one page at a time
+    
+    The ETag is the collection version, which changes with every write, so a
+    client revalidating with If-None-Match gets 304 until any card changes.
+    While a MongoDB write is still landing there is no ETag, since the page
+    may miss a card the version already counts.
+    
+    Args:
+        limit: Page size (ignored for ndjson, which streams every flashcard)
+        after_id: Keyset cursor; pass the X-Next-After-Id header of the previous page
+        include_image: Include base64 image data
+        format: "json" for a page, "ndjson" to stream one flashcard per line
     
     Returns:
-        List of all flashcards
+        List of flashcards, or 304 if the If-None-Match ETag is still current
     """
     try:
-        flashcards = db_manager.get_all_flashcards()
-        return flashcards
+        # Read before the cards, so a write landing in between changes the next ETag
+        version = await db.flashcards_version()
+        headers = {"Cache-Control": "no-cache"}
+        if version is not None:
+            headers["ETag"] = f'"{version}"'
+            if etag_matches(request, headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+        
+        if format == "ndjson":
+            async def iter_lines():
+                async for data in db.iter_flashcards(after_id=after_id, include_image=include_image):
+                    yield orjson.dumps(data) + b"\n"
+            
+            return StreamingResponse(iter_lines(), media_type="application/x-ndjson", headers=headers)
+        
+        # Stored documents go straight to orjson; no models are built for a page
+        documents = [
+            flashcard_document(data)
+            async for data in db.iter_flashcards(after_id=after_id, include_image=include_image, limit=limit)
+        ]
+        if len(documents) == limit:
+            headers["X-Next-After-Id"] = documents[-1]["id"]
+        return ORJSONResponse(documents, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving flashcards: {str(e)}")
 
 
 @app.post("/flashcards/", response_model=Flashcard)
-def create_flashcard(flashcard: FlashcardCreate):
+async def create_flashcard(
+    flashcard: FlashcardCreate,
+    db: AsyncDatabaseManager = Depends(get_database),
+    store: ImageStore = Depends(get_image_store),
+    prefetcher: TTSPrefetcher = Depends(get_tts_prefetcher)
+):
     """
     Create a new flashcard with provided data
     
@@ -141,15 +617,143 @@ def create_flashcard(flashcard: FlashcardCreate):
         Created flashcard with generated ID
     """
     try:
-        new_flashcard = Flashcard(**flashcard.model_dump())
-        saved_flashcard = db_manager.create_flashcard(new_flashcard)
+        new_flashcard = Flashcard(**await run_in_threadpool(store_inline_image, flashcard.model_dump(), store))
+        saved_flashcard = await db.create_flashcard(new_flashcard)
+        prefetcher.prefetch(saved_flashcard)
         return saved_flashcard
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating flashcard: {str(e)}")
 
 
+@app.get("/flashcards/search", response_model=List[Flashcard], response_class=ORJSONResponse)
+async def search_flashcards(
+    q: str = Query(..., min_length=1, max_length=200, description="Search text"),
+    limit: int = Query(default=20, ge=1, le=100, description="Maximum number of results"),
+    fuzzy: bool = Query(default=True, description="Tolerate one typo per word"),
+    db: AsyncDatabaseManager = Depends(get_database)
+):
+    """
+    Search flashcards by original text, translation and image description
+    
+    Args:
+        q: Search text; each word matches whole words or prefixes (Thai by character n-grams)
+        limit: Maximum number of results
+        fuzzy: Also match words within one edit
+    
+    Returns:
+        Best matching flashcards first (without image data)
+    """
+    try:
+        return flashcards_response(await db.search_flashcards(q, limit=limit, fuzzy=fuzzy))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching flashcards: {str(e)}")
+
+
+@app.get("/flashcards/changes", response_model=FlashcardChanges, response_class=ORJSONResponse)
+async def get_flashcard_changes(
+    since: int = Query(default=0, ge=0, description="Version returned by the previous call"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of changes"),
+    include_image: bool = Query(default=False, description="Include base64 image data"),
+    db: AsyncDatabaseManager = Depends(get_database)
+):
+    """
+    Get the flashcards created, updated and deleted since a version
+    
+    Pass the returned version as `since` on the next call, right away while
+    has_more is true; each call then returns only what changed. since=0
+    returns every flashcard (and the tombstones still kept).
+    
+    Args:
+        since: Version returned by the previous call (0 to start over)
+        limit: Maximum number of changes
+        include_image: Include base64 image data
+    
+    Returns:
+        Changes oldest first, the version to continue from and whether more are ready;
+        410 if deletes since `since` were already forgotten (start over from 0)
+    """
+    try:
+        entries = await db.flashcard_changes(since, limit + 1, include_image=include_image)
+    except ChangesExpiredError as e:
+        raise HTTPException(status_code=410, detail=f"{e}; start over from since=0")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving changes: {str(e)}")
+    
+    changes = [
+        {"id": entry["id"], "version": entry["version"], "deleted": True, "flashcard": None, "deleted_at": entry["deleted_at"]}
+        if entry.get("deleted") else
+        {"id": entry["id"], "version": entry.get("version") or 0, "deleted": False, "flashcard": flashcard_document(entry), "deleted_at": None}
+        for entry in entries[:limit]
+    ]
+    return ORJSONResponse({
+        "changes": changes,
+        "version": changes[-1]["version"] if changes else since,
+        "has_more": len(entries) > limit
+    })
+
+
+@app.get("/flashcards/export")
+async def export_flashcards(
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv|zip)$", description="Export format"),
+    db: AsyncDatabaseManager = Depends(get_database),
+    store: ImageStore = Depends(get_image_store)
+):
+    """
+    Export every flashcard, streamed straight from the database cursor
+    
+    Args:
+        format: "ndjson" or "csv" (images referenced by hash), or "zip"
+            (cards.ndjson plus the images as images/<hash> members)
+    
+    Returns:
+        Streaming file download
+    """
+    headers = {"Content-Disposition": f'attachment; filename="flashcards.{format}"'}
+    documents = db.iter_flashcards()
+    if format == "zip":
+        chunks = export_zip(documents, store)
+    else:
+        chunks = export_csv(documents) if format == "csv" else export_ndjson(documents)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers=headers)
+
+
+@app.post("/flashcards/import", response_model=ImportResponse)
+async def import_flashcards(
+    request: Request,
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv|zip)$", description="Upload format"),
+    db: AsyncDatabaseManager = Depends(get_database),
+    store: ImageStore = Depends(get_image_store)
+):
+    """
+    Import flashcards from an NDJSON, CSV or zip upload sent as the request body
+    
+    Cards are written in batches and keep their IDs, so importing an export
+    again replaces cards instead of duplicating them.
+    
+    Args:
+        format: Upload format, as produced by GET /flashcards/export
+    
+    Returns:
+        Imported and failed counts, the first errors and throughput
+    """
+    # Spool the body (to disk once it is large) so memory stays bounded for any deck size
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as upload:
+        try:
+            # Writes past IMPORT_SPOOL_BYTES go to disk, so they run in worker threads
+            async for chunk in request.stream():
+                await run_in_threadpool(upload.write, chunk)
+            upload.seek(0)
+            return await run_in_threadpool(import_deck, upload, format, db.database, store)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error importing flashcards: {str(e)}")
+
+
 @app.get("/flashcards/{card_id}", response_model=Flashcard)
-def get_flashcard(card_id: str):
+async def get_flashcard(card_id: str, request: Request, response: Response, db: AsyncDatabaseManager = Depends(get_database)):
     """
     Get a specific flashcard by ID
     
@@ -157,16 +761,59 @@ def get_flashcard(card_id: str):
         card_id: Flashcard ID
     
     Returns:
-        Flashcard object
+        Flashcard object, or 304 if the If-None-Match ETag (its version) is still current
     """
-    flashcard = db_manager.get_flashcard(card_id)
+    flashcard = await db.get_flashcard(card_id)
     if not flashcard:
         raise HTTPException(status_code=404, detail="Flashcard not found")
+    headers = {"ETag": f'"{flashcard.version}"', "Cache-Control": "no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return flashcard
 
 
+@app.get("/flashcards/{card_id}/audio/{side}")
+async def get_flashcard_audio(
+    card_id: str,
+    request: Request,
+    side: str = Path(..., pattern="^(original|translated)$", description="original or translated"),
+    db: AsyncDatabaseManager = Depends(get_database)
+):
+    """
+    Get the spoken audio of one side of a flashcard
+    
+    Audio is prefetched when the card is created or its text changes, so this
+    is usually a cache read. It is keyed by the current text, so an edited card
+    never plays the old audio.
+    
+    Args:
+        card_id: Flashcard ID
+        side: "original" (original_text) or "translated" (translated_text)
+    
+    Returns:
+        MP3 audio, with the same caching and Range support as /tts/
+    """
+    flashcard = await db.get_flashcard(card_id)
+    if not flashcard:
+        raise HTTPException(status_code=404, detail="Flashcard not found")
+    text = getattr(flashcard, AUDIO_SIDES[side]) or ""
+    if not text.strip():
+        raise HTTPException(status_code=404, detail="This side of the flashcard has no text")
+    try:
+        return await speech_response(request, text)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
+
+
 @app.put("/flashcards/{card_id}", response_model=Flashcard)
-def update_flashcard(card_id: str, update_data: FlashcardUpdate):
+async def update_flashcard(
+    card_id: str,
+    update_data: FlashcardUpdate,
+    db: AsyncDatabaseManager = Depends(get_database),
+    store: ImageStore = Depends(get_image_store),
+    prefetcher: TTSPrefetcher = Depends(get_tts_prefetcher)
+):
     """
     Update a flashcard
     
@@ -175,19 +822,27 @@ def update_flashcard(card_id: str, update_data: FlashcardUpdate):
         update_data: Fields to update
     
     Returns:
-        Updated flashcard
+        Updated flashcard, or 202 while MongoDB is down and the card is not stored locally
+        (the update is applied once MongoDB is back)
     """
-    updated_flashcard = db_manager.update_flashcard(
-        card_id,
-        update_data.model_dump(exclude_unset=True)
-    )
+    try:
+        update_fields = await run_in_threadpool(store_inline_image, update_data.model_dump(exclude_unset=True), store)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        updated_flashcard = await db.update_flashcard(card_id, update_fields)
+    except WriteQueuedError as e:
+        return JSONResponse(status_code=202, content={"message": str(e)})
     if not updated_flashcard:
         raise HTTPException(status_code=404, detail="Flashcard not found")
+    # Changed text has new audio keys; unchanged sides are already cached and skipped
+    prefetcher.prefetch(updated_flashcard, [side for side, field in AUDIO_SIDES.items() if field in update_fields])
     return updated_flashcard
 
 
 @app.delete("/flashcards/{card_id}")
-def delete_flashcard(card_id: str):
+async def delete_flashcard(card_id: str, db: AsyncDatabaseManager = Depends(get_database)):
     """
     Delete a flashcard
     
@@ -197,50 +852,182 @@ def delete_flashcard(card_id: str):
     Returns:
         Success message
     """
-    success = db_manager.delete_flashcard(card_id)
+    success = await db.delete_flashcard(card_id)
     if not success:
         raise HTTPException(status_code=404, detail="Flashcard not found")
     return {"message": "Flashcard deleted successfully"}
 
 
+@app.get("/review/next", response_model=List[Flashcard], response_class=ORJSONResponse)
+async def get_due_flashcards(
+    limit: int = Query(default=20, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of cards"),
+    db: AsyncDatabaseManager = Depends(get_database)
+):
+    """
+    Get flashcards due for review
+    
+    Args:
+        limit: Maximum number of cards
+    
+    Returns:
+        Due flashcards, most overdue first (without image data)
+    """
+    try:
+        return flashcards_response(await db.due_flashcards(time.time(), limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving due flashcards: {str(e)}")
+
+
+@app.post("/review/{card_id}", response_model=Flashcard)
+async def review_flashcard(card_id: str, review: ReviewRequest, db: AsyncDatabaseManager = Depends(get_database)):
+    """
+    Grade a review and schedule the flashcard's next one
+    
+    Args:
+        card_id: Flashcard ID
+        review: Recall grade from 0 (forgotten) to 5 (perfect)
+    
+    Returns:
+        Flashcard with its updated review state
+    """
+    flashcard = await db.get_flashcard(card_id)
+    if not flashcard:
+        raise HTTPException(status_code=404, detail="Flashcard not found")
+    
+    review_state = scheduler.review(flashcard.model_dump(), review.grade)
+    updated_flashcard = await db.update_flashcard(card_id, review_state)
+    if not updated_flashcard:
+        raise HTTPException(status_code=404, detail="Flashcard not found")
+    return updated_flashcard
+
+
+@app.get("/images/{image_hash}")
+def get_image(image_hash: str, request: Request, store: ImageStore = Depends(get_image_store)):
+    """
+    Get raw image bytes
+    
+    Args:
+        image_hash: Image hash referenced by a flashcard
+    
+    Returns:
+        Image file
+    """
+    etag = f'"{image_hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    
+    # Images are content-addressed, so a matching ETag never goes stale
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    result = store.get(image_hash)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    image_data, content_type = result
+    return Response(content=image_data, media_type=content_type, headers=headers)
+
+
+async def speech_response(request: Request, text: str, slow: bool = False) -> Response:
+    """
+    MP3 audio for a text, served from the TTS cache when available and
+    otherwise streamed while it is synthesized; supports ETag and Range requests
+    """
+    tts_cache = request.app.state.tts_cache
+    tts_executor = request.app.state.tts_executor
+    lang = detect_language(text)
+    key = tts_cache.make_key(text, lang, slow)
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Content-Disposition": "attachment; filename=tts.mp3",
+        "Accept-Ranges": "bytes"
+    }
+    
+    # Audio is content-addressed, so a matching ETag never goes stale
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    path = tts_cache.get(key)
+    if path is None:
+        tts = gTTS(text=text, lang=lang, slow=slow)
+        if not range_header:
+            # Stream segments to the client as they are synthesized, teeing into the cache
+            chunks = await stream_speech(tts, tts_cache, key, tts_executor)
+            return StreamingResponse(chunks, media_type="audio/mpeg", headers=headers)
+        # A byte range needs the full length, so synthesize into the cache first
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(tts_executor, tts_cache.put_file, key, traced("tts.synthesize")(tts.save))
+    
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type="audio/mpeg", headers=headers)
+    
+    start, end = byte_range
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1)
+    })
+    return StreamingResponse(
+        iter_file_range(path, start, end),
+        status_code=206,
+        media_type="audio/mpeg",
+        headers=headers
+    )
+
+
 @app.get("/tts/")
-def text_to_speech(text: str = Query(..., description="Text to convert to speech")):
+async def text_to_speech(
+    request: Request,
+    text: str = Query(..., description="Text to convert to speech"),
+    slow: bool = Query(default=False, description="Use slower speech")
+):
     """
     Convert text to speech and return audio file
     
     Args:
         text: Text to convert to speech
+        slow: Use slower speech
     
     Returns:
-        MP3 audio file
+        MP3 audio, served from the TTS cache when available and otherwise
+        streamed while it is synthesized
     """
     try:
-        # Detect language (simple heuristic: if contains Thai characters, use Thai)
-        lang = 'th' if any('\u0E00' <= char <= '\u0E7F' for char in text) else 'en'
-        
-        # Generate speech
-        tts = gTTS(text=text, lang=lang, slow=False)
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
-            tts.save(fp.name)
-            temp_file = fp.name
-        
-        # Return file and schedule deletion
-        def iterfile():
-            with open(temp_file, mode="rb") as file_like:
-                yield from file_like
-            os.unlink(temp_file)  # Delete after sending
-        
-        return StreamingResponse(
-            iterfile(),
-            media_type="audio/mpeg",
-            headers={"Content-Disposition": f"attachment; filename=tts.mp3"}
-        )
+        return await speech_response(request, text, slow)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: request and span latency histograms, in-flight gauges, payload sizes and storage fallbacks"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/cache/stats")
+def cache_stats(request: Request):
+    """
+    Get cache and offline dictionary hit/miss counters
+    
+    Returns:
+        Counters for each cache
+    """
+    state = request.app.state
+    return {
+        "tts": state.tts_cache.stats(),
+        "translation": state.translation_cache.stats(),
+        "dictionary": state.local_translator.stats()
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
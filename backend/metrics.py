@@ -0,0 +1,208 @@
+import asyncio
+import functools
+import inspect
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Load environment variables
+load_dotenv()
+
+# Profiling configuration: off unless enabled, then only for requests sending PROFILE_HEADER
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))  # seconds between samples
+PROFILE_HEADER = "x-profile"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+# Labelled by method only: the route template is not known until routing has run
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled", ["method"])
+REQUEST_SIZE = Histogram("http_request_size_bytes", "HTTP request body size", ["route"], buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "HTTP response body size", ["route"], buckets=SIZE_BUCKETS)
+
+SPAN_LATENCY = Histogram("span_duration_seconds", "Latency of instrumented operations", ["span", "outcome"], buckets=LATENCY_BUCKETS)
+SPANS_IN_PROGRESS = Gauge("spans_in_progress", "Instrumented operations in flight", ["span"])
+PAYLOAD_SIZE = Histogram("payload_size_bytes", "Size of payloads handled by instrumented operations", ["span"], buckets=SIZE_BUCKETS)
+
+STORAGE_FALLBACKS = Counter("storage_fallbacks_total", "Switches from MongoDB to local storage after a failure", ["operation"])
+MONGODB_UP = Gauge("mongodb_up", "1 while flashcards are served from MongoDB, 0 while on local storage")
+WRITE_BEHIND_DEPTH = Gauge("write_behind_queue_depth", "Flashcards written locally and waiting to be replayed to MongoDB")
+
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "Background jobs waiting for a worker")
+JOBS_FINISHED = Counter("jobs_finished_total", "Background jobs finished, by outcome", ["status"])
+TTS_PREFETCH = Counter("tts_prefetch_total", "Card audio prefetch attempts, by outcome", ["outcome"])
+
+UPSTREAM_CALLS = Counter("upstream_calls_total", "Attempts to call external services, by outcome", ["service", "operation", "outcome"])
+UPSTREAM_HEDGES = Counter("upstream_hedges_total", "Duplicate requests sent for slow external calls", ["service", "operation"])
+CIRCUIT_OPEN = Gauge("circuit_breaker_open", "1 while calls to an external service are refused", ["service"])
+GEMINI_TOKENS = Counter("gemini_tokens_total", "Gemini tokens used, from response usage metadata", ["operation", "kind"])
+RATE_LIMITED = Counter("rate_limited_total", "Requests refused with 429, by reason", ["reason"])
+TRANSLATIONS = Counter("translations_total", "Translations answered, by tier: dictionary, lemma, cache or gemini", ["tier"])
+TRANSLATION_LATENCY = Histogram(
+    "translation_duration_seconds", "Latency of single translations, by the tier that answered", ["tier"], buckets=LATENCY_BUCKETS
+)
+
+
+@contextmanager
+def span(name: str, payload_bytes: Optional[int] = None):
+    """
+    Time a block of code, sync or async, as a named span
+
+    Args:
+        name: Span name, e.g. "gemini.analyze_image"
+        payload_bytes: Size of the data the block handles, if known
+    """
+    if payload_bytes is not None:
+        PAYLOAD_SIZE.labels(name).observe(payload_bytes)
+    in_progress = SPANS_IN_PROGRESS.labels(name)
+    in_progress.inc()
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        SPAN_LATENCY.labels(name, outcome).observe(time.perf_counter() - started)
+        in_progress.dec()
+
+
+def traced(name: str):
+    """Decorator running a function or coroutine function inside span(name)"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_payload(name: str, size: int):
+    """Record a payload size without timing anything"""
+    PAYLOAD_SIZE.labels(name).observe(size)
+
+
+def record_fallback(operation: str):
+    """Count a switch from MongoDB to local storage"""
+    STORAGE_FALLBACKS.labels(operation).inc()
+
+
+def render_metrics() -> bytes:
+    """Current metrics in the Prometheus text format"""
+    return generate_latest()
+
+
+def _start_profiler():
+    """Start a sampling profiler, or return None if pyinstrument is not installed"""
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        print("⚠ Profiling requested but pyinstrument is not installed")
+        return None
+    profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+    profiler.start()
+    return profiler
+
+
+def _save_profile(profiler, profile_id: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.html")
+    with open(path, "w", encoding="utf-8") as profile_file:
+        profile_file.write(profiler.output_html())
+    print(f"✓ Profile written to {path}")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, in-flight requests and body sizes per route
+
+    Routes are labelled by their path template (e.g. /flashcards/{card_id}) so
+    label cardinality stays bounded. With PROFILING_ENABLED, a request sending
+    an `X-Profile: 1` header is run under a sampling profiler; the HTML report
+    is written to PROFILE_DIR and its name returned in the X-Profile-Id header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        profiler = None
+        profile_id = None
+        if PROFILING_ENABLED and _header(scope, PROFILE_HEADER) in ("1", "true"):
+            profiler = _start_profiler()
+            profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}" if profiler else None
+
+        async def receive_wrapper():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            in_progress.dec()
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(method, route_label, str(status)).observe(time.perf_counter() - started)
+            REQUEST_SIZE.labels(route_label).observe(request_bytes)
+            RESPONSE_SIZE.labels(route_label).observe(response_bytes)
+            if profiler is not None:
+                # Stop on the thread that started it, then render the (CPU-bound) report off the event loop
+                profiler.stop()
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, _save_profile, profiler, profile_id)
+                except Exception as e:
+                    print(f"Saving profile failed: {e}")
+
+
+def _header(scope, name: str) -> Optional[str]:
+    """Value of a request header from an ASGI scope"""
+    target = name.encode("latin-1")
+    for key, value in scope.get("headers", []):
+        if key.lower() == target:
+            return value.decode("latin-1")
+    return None
@@ -0,0 +1,20 @@
+"""
+Move base64 images embedded in existing flashcards into the image store,
+and index stored images for near-duplicate detection
+
+Usage:
+    python migrate_images.py
+"""
+from database import DatabaseManager
+from image_store import ImageStore, backfill_perceptual_hashes, migrate_inline_images
+
+
+if __name__ == "__main__":
+    db_manager = DatabaseManager()
+    db_manager.connect()
+    image_store = ImageStore(db_manager)
+    count = migrate_inline_images(db_manager, image_store)
+    print(f"✓ Migrated {count} flashcard image(s) to the image store")
+    count = backfill_perceptual_hashes(db_manager, image_store)
+    print(f"✓ Indexed {count} flashcard image(s) for duplicate detection")
+    db_manager.close()
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, List, Optional
+import time
 import uuid
 
 
@@ -13,7 +14,12 @@ class FlashcardBase(BaseModel):
     original_text: str
     translated_text: str
     image_description: Optional[str] = ""
-    image: Optional[str] = ""  # Base64 encoded image
+    image: Optional[str] = ""  # Base64 encoded image (legacy; moved to the image store on write)
+    image_hash: Optional[str] = ""  # SHA-256 of the image in the image store
+    image_url: Optional[str] = ""  # Path serving the image bytes
+    thumbnail_hash: Optional[str] = ""  # SHA-256 of the list-view thumbnail
+    thumbnail_url: Optional[str] = ""  # Path serving the thumbnail bytes
+    image_phash: Optional[str] = ""  # Perceptual (difference) hash of the image, for near-duplicate lookups
 
 
 class FlashcardCreate(FlashcardBase):
@@ -27,11 +33,26 @@ class FlashcardUpdate(BaseModel):
     translated_text: Optional[str] = None
     image_description: Optional[str] = None
     image: Optional[str] = None
+    image_hash: Optional[str] = None
+    image_url: Optional[str] = None
+    thumbnail_hash: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    image_phash: Optional[str] = None
 
 
 class Flashcard(FlashcardBase):
     """Complete flashcard model with ID"""
     id: str = Field(default_factory=generate_uuid)
+    # Spaced-repetition state (see scheduler.py); new cards are due immediately
+    ease: float = 2.5
+    interval: float = 0.0  # days until the next review
+    repetitions: int = 0  # successful reviews in a row
+    lapses: int = 0
+    due: float = Field(default_factory=time.time)  # UNIX timestamp of the next review
+    last_reviewed: Optional[float] = None
+    # Set by the database on every write; see GET /flashcards/changes
+    version: int = 0  # collection-wide, increases with every write
+    updated_at: Optional[float] = None  # UNIX timestamp of the last write
 
     class Config:
         json_schema_extra = {
@@ -40,11 +61,62 @@ class Flashcard(FlashcardBase):
                 "original_text": "Hello",
                 "translated_text": "สวัสดี",
                 "image_description": "A greeting gesture",
-                "image": "base64_encoded_string_here"
+                "image": "",
+                "image_hash": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+                "image_url": "/images/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
             }
         }
 
 
+FLASHCARD_FIELDS = tuple(Flashcard.model_fields)
+_FLASHCARD_FIELD_SET = frozenset(FLASHCARD_FIELDS)
+
+
+def flashcard_document(data: dict) -> dict:
+    """
+    Response-shaped dict of a stored flashcard document
+
+    Keeps the model fields only, in model order, and fills in defaults for
+    fields added after the document was written. Serializing this directly is
+    the cheapest way to return many flashcards.
+    """
+    return {
+        name: data[name] if name in data else field.get_default(call_default_factory=True)
+        for name, field in Flashcard.model_fields.items()
+    }
+
+
+def trusted_flashcard(data: dict) -> Flashcard:
+    """
+    Build a Flashcard from a stored document without validating it again
+
+    Flashcards are validated on the way in, so read paths use this instead of
+    Flashcard(**data); storage-only keys (_id, search terms, hash bands) are dropped.
+    """
+    return Flashcard.model_construct(_fields_set=_FLASHCARD_FIELD_SET, **flashcard_document(data))
+
+
+class FlashcardChange(BaseModel):
+    """One entry of a change feed: a written flashcard or a deleted one"""
+    id: str
+    version: int
+    deleted: bool = False
+    flashcard: Optional[Flashcard] = None  # current state, unless deleted
+    deleted_at: Optional[float] = None
+
+
+class FlashcardChanges(BaseModel):
+    """Response model for the flashcard change feed"""
+    changes: List[FlashcardChange]  # oldest first
+    version: int  # pass as `since` on the next call
+    has_more: bool  # more changes are ready; call again right away
+
+
+class ReviewRequest(BaseModel):
+    """Request model for grading a flashcard review"""
+    grade: int = Field(..., ge=0, le=5)  # SM-2 recall quality: 0-2 forgotten, 3-5 remembered
+
+
 class GenerateFlashcardRequest(BaseModel):
     """Request model for generating flashcard from text"""
     text: str
@@ -57,4 +129,62 @@ class GenerateFlashcardResponse(BaseModel):
     original_text: str
     translated_text: str
     image_description: str
+    tier: Optional[str] = None  # "dictionary", "lemma", "cache" or "gemini"
+
+
 
+class BatchGenerateRequest(BaseModel):
+    """Request model for generating many flashcards from a word list"""
+    texts: List[str] = Field(..., min_length=1, max_length=1000)
+    source_language: str = "en"  # Default to English
+    target_language: str = "th"  # Default to Thai
+    save: bool = False  # Also store the generated flashcards
+
+
+class BatchItemResult(BaseModel):
+    """Outcome of one word in a batch generation request"""
+    index: int
+    text: str
+    status: str  # "ok" or "error"
+    result: Optional[GenerateFlashcardResponse] = None
+    flashcard: Optional[Flashcard] = None
+    error: Optional[str] = None
+
+
+class BatchGenerateResponse(BaseModel):
+    """Response model for batch flashcard generation"""
+    items: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+
+class ImportResponse(BaseModel):
+    """Response model for a deck import"""
+    imported: int
+    failed: int
+    errors: List[str]  # first few per-record errors
+    seconds: float
+    cards_per_second: float
+
+
+class UploadSession(BaseModel):
+    """State of a resumable image upload"""
+    id: str
+    size: int  # declared total size in bytes
+    offset: int  # bytes received so far; the next chunk starts here
+    complete: bool
+    sha256: Optional[str] = None  # set once every byte has arrived
+    expires_at: float
+
+
+class Job(BaseModel):
+    """State of a background image-to-flashcard job"""
+    id: str
+    kind: str
+    status: str  # "queued", "running", "succeeded" or "failed"
+    created_at: float
+    updated_at: float
+    result: Optional[Flashcard] = None  # the created (or reused) flashcard once succeeded
+    duplicate_of: Optional[str] = None  # ID of the reused card for a near-duplicate image
+    error: Optional[str] = None
+    timings: Dict[str, float] = {}  # per-stage timings in ms
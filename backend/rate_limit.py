@@ -0,0 +1,376 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, FrozenSet, Optional, Tuple
+from dotenv import load_dotenv
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from database import DatabaseManager
+from metrics import GEMINI_TOKENS, RATE_LIMITED
+
+# Load environment variables
+load_dotenv()
+
+# Request rate limiting for the routes that call Gemini, per client
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))  # sustained requests per client
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))  # requests a client may make at once
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, or mongo to share limits across processes
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "X-API-Key")
+# Comma-separated API keys clients are limited by; any other key is ignored and its client limited by address
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "")
+
+# Daily Gemini token budgets (UTC days); 0 means unlimited
+GEMINI_DAILY_TOKEN_BUDGET = int(os.getenv("GEMINI_DAILY_TOKEN_BUDGET", "0"))
+GEMINI_CLIENT_DAILY_TOKEN_BUDGET = int(os.getenv("GEMINI_CLIENT_DAILY_TOKEN_BUDGET", "0"))
+
+# Routes that call Gemini
+LIMITED_PATHS = frozenset({"/generate-flashcard/", "/generate-flashcards/batch", "/generate-flashcard-from-image/"})
+GLOBAL_KEY = "*"
+MAX_LOCAL_BUCKETS = 10000  # in-process buckets kept before idle ones are dropped
+
+
+
+def key_digest(api_key: bytes) -> str:
+    return hashlib.sha256(api_key).hexdigest()
+
+
+# Digests of the accepted API keys, so raw keys are not compared or kept around
+API_KEY_DIGESTS = frozenset(key_digest(key.strip().encode("latin-1")) for key in RATE_LIMIT_API_KEYS.split(",") if key.strip())
+
+# Client a request is served for, so Gemini token usage can be charged to it
+current_client: ContextVar[Optional[str]] = ContextVar("current_client", default=None)
+
+
+def utc_day(now: Optional[float] = None) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+
+def seconds_until_tomorrow(now: Optional[float] = None) -> float:
+    now = time.time() if now is None else now
+    return 86400 - now % 86400
+
+
+class RateLimitBackend:
+    """
+    Where token buckets and daily token usage are kept
+
+    The in-process MemoryBackend is the default. Subclass this to share
+    limits between processes or hosts (MongoBackend, or e.g. Redis) and pass
+    it to RateLimiter. Backends with `blocking = True` are called off the
+    event loop.
+    """
+
+    blocking = False
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        """Take one token from key's bucket; returns 0 if it had one, otherwise seconds until it will"""
+        raise NotImplementedError
+
+    def add_usage(self, key: str, day: str, tokens: int):
+        """Add Gemini tokens used by key on day"""
+        raise NotImplementedError
+
+    def usage(self, key: str, day: str) -> int:
+        """Gemini tokens used by key on day"""
+        raise NotImplementedError
+
+
+def _refill(tokens: float, updated: float, rate: float, burst: int, now: float) -> Tuple[float, float]:
+    """Token bucket step: (tokens left, seconds to wait); a token is taken if the wait is 0"""
+    tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate if rate > 0 else float("inf")
+
+
+class MemoryBackend(RateLimitBackend):
+    """Buckets and usage in this process only; with several workers each enforces its own limits"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated)
+        self.usage_day = ""
+        self.usage_by_key: Dict[str, int] = {}
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (float(burst), now))
+            tokens, wait = _refill(tokens, updated, rate, burst, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > MAX_LOCAL_BUCKETS:
+                # Buckets that have refilled are the same as new ones; forget them
+                refill_time = burst / rate if rate > 0 else float("inf")
+                self.buckets = {
+                    bucket_key: bucket for bucket_key, bucket in self.buckets.items()
+                    if now - bucket[1] < refill_time
+                }
+            return wait
+
+    def add_usage(self, key: str, day: str, tokens: int):
+        with self.lock:
+            if day != self.usage_day:
+                self.usage_day = day
+                self.usage_by_key = {}
+            self.usage_by_key[key] = self.usage_by_key.get(key, 0) + tokens
+
+    def usage(self, key: str, day: str) -> int:
+        with self.lock:
+            return self.usage_by_key.get(key, 0) if day == self.usage_day else 0
+
+
+class MongoBackend(RateLimitBackend):
+    """
+    Buckets and usage in MongoDB, shared by every process using the database
+
+    Buckets are updated with a compare-and-set on their last update time.
+    Raises ConnectionFailure while MongoDB is unavailable, so the limiter can
+    fall back to its in-process backend.
+    """
+
+    blocking = True
+    CAS_ATTEMPTS = 5
+
+    def __init__(self, database: DatabaseManager):
+        self.database = database
+        self._indexed = False
+
+    def _collections(self):
+        if not self.database.use_mongodb or self.database.db is None:
+            raise ConnectionFailure("MongoDB is not primary")
+        buckets = self.database.db["rate_limits"]
+        usage = self.database.db["gemini_usage"]
+        if not self._indexed:
+            # Old days and idle buckets expire on their own
+            buckets.create_index("expires_at", expireAfterSeconds=0)
+            usage.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        return buckets, usage
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        buckets, _ = self._collections()
+        # A bucket left alone this long is full again
+        expires_at = now + (burst / rate if rate > 0 else 86400)
+        for _ in range(self.CAS_ATTEMPTS):
+            bucket = buckets.find_one({"_id": key})
+            if bucket is None:
+                tokens, wait = _refill(float(burst), now, rate, burst, now)
+                try:
+                    buckets.insert_one({"_id": key, "tokens": tokens, "updated": now, "expires_at": expires_at})
+                    return wait
+                except DuplicateKeyError:
+                    continue
+            tokens, wait = _refill(bucket["tokens"], bucket["updated"], rate, burst, now)
+            if wait:
+                return wait
+            result = buckets.update_one(
+                {"_id": key, "updated": bucket["updated"]},
+                {"$set": {"tokens": tokens, "updated": now, "expires_at": expires_at}}
+            )
+            if result.matched_count:
+                return 0.0
+        # Heavy contention on one key means it is bursting: make the request wait a token's time
+        return 1 / rate if rate > 0 else float("inf")
+
+    def add_usage(self, key: str, day: str, tokens: int):
+        _, usage = self._collections()
+        usage.update_one(
+            {"_id": f"{day}:{key}"},
+            {"$inc": {"tokens": tokens}, "$setOnInsert": {"expires_at": time.time() + 2 * 86400}},
+            upsert=True
+        )
+
+    def usage(self, key: str, day: str) -> int:
+        _, usage = self._collections()
+        document = usage.find_one({"_id": f"{day}:{key}"})
+        return document["tokens"] if document else 0
+
+
+class RateLimiter:
+    """
+    Token-bucket request limits and daily Gemini token budgets, per client
+
+    Each client gets a bucket of `burst` requests refilled at `per_minute`.
+    Gemini token usage reported by the API is added to the client's and the
+    global daily total; a client over its budget, or everyone once the global
+    budget is spent, is refused until the next UTC day. State lives in the
+    given backend, falling back to an in-process one while it is unavailable.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[RateLimitBackend] = None,
+        per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        daily_budget: int = GEMINI_DAILY_TOKEN_BUDGET,
+        client_daily_budget: int = GEMINI_CLIENT_DAILY_TOKEN_BUDGET
+    ):
+        self.local = MemoryBackend()
+        self.backend = backend or self.local
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.daily_budget = daily_budget
+        self.client_daily_budget = client_daily_budget
+
+    def _call(self, method: str, *args):
+        """Call the backend, or the in-process one if the backend is unavailable"""
+        if self.backend is not self.local:
+            try:
+                return getattr(self.backend, method)(*args)
+            except ConnectionFailure:
+                pass
+        return getattr(self.local, method)(*args)
+
+    async def _call_async(self, method: str, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(self._call, method, *args)
+        return self._call(method, *args)
+
+    def _check(self, client: str, now: float) -> Optional[Tuple[str, float]]:
+        day = utc_day(now)
+        if self.daily_budget and self._call("usage", GLOBAL_KEY, day) >= self.daily_budget:
+            return "global_budget", seconds_until_tomorrow(now)
+        if self.client_daily_budget and self._call("usage", client, day) >= self.client_daily_budget:
+            return "client_budget", seconds_until_tomorrow(now)
+        wait = self._call("take", client, self.rate, self.burst, now)
+        if wait:
+            return "rate", wait
+        return None
+
+    async def check(self, client: str) -> Optional[Tuple[str, float]]:
+        """
+        Admit a request from client, taking a token from its bucket
+
+        Returns:
+            None if the request may go ahead, otherwise (reason, seconds to wait)
+        """
+        if self.backend.blocking:
+            return await asyncio.to_thread(self._check, client, time.time())
+        return self._check(client, time.time())
+
+    def record_usage(self, client: Optional[str], tokens: int):
+        """Charge Gemini tokens to the client (if known) and the global budget"""
+        if not tokens:
+            return
+        day = utc_day()
+        self._call("add_usage", GLOBAL_KEY, day, tokens)
+        if client:
+            self._call("add_usage", client, day, tokens)
+
+    async def record_usage_async(self, client: Optional[str], tokens: int):
+        """Non-blocking version of record_usage"""
+        if tokens and self.backend.blocking:
+            await asyncio.to_thread(self.record_usage, client, tokens)
+        else:
+            self.record_usage(client, tokens)
+
+    def stats(self) -> dict:
+        """Today's global token usage against the budgets"""
+        return {
+            "backend": type(self.backend).__name__,
+            "per_minute": self.rate * 60,
+            "burst": self.burst,
+            "tokens_today": self._call("usage", GLOBAL_KEY, utc_day()),
+            "daily_budget": self.daily_budget,
+            "client_daily_budget": self.client_daily_budget
+        }
+
+
+def record_gemini_usage(operation: str, response) -> int:
+    """
+    Account for the tokens a Gemini response used, from its usage metadata
+
+    Returns:
+        Total tokens, to be charged with RateLimiter.record_usage
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    output = getattr(usage, "candidates_token_count", 0) or 0
+    GEMINI_TOKENS.labels(operation, "prompt").inc(prompt)
+    GEMINI_TOKENS.labels(operation, "output").inc(output)
+    return getattr(usage, "total_token_count", 0) or prompt + output
+
+
+def client_key(scope, header: str = RATE_LIMIT_KEY_HEADER, api_keys: FrozenSet[str] = API_KEY_DIGESTS) -> str:
+    """
+    Identify the client of an ASGI request: its API key, if it is one of
+    api_keys (SHA-256 digests), otherwise its address
+
+    Unknown keys are ignored, so sending a fresh key per request does not
+    get a fresh bucket and budget.
+    """
+    target = header.lower().encode("latin-1")
+    for name, value in scope.get("headers", []):
+        if name.lower() == target and value:
+            digest = key_digest(value)
+            if digest in api_keys:
+                return "key:" + digest[:16]
+            break
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:unknown"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware refusing requests over their client's limits with 429 and Retry-After
+
+    Only requests to the given paths are limited. Every request gets its
+    client key in `current_client`, so Gemini token usage is charged to it.
+    Without a limiter, the application's `state.rate_limiter` is used; it is
+    built when the application starts, after the middleware.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: Optional["RateLimiter"] = None,
+        paths: FrozenSet[str] = LIMITED_PATHS,
+        enabled: bool = RATE_LIMIT_ENABLED
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.paths = paths
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        token = current_client.set(client)
+        try:
+            if self.enabled and scope["method"] == "POST" and scope["path"] in self.paths:
+                limiter = self.limiter or scope["app"].state.rate_limiter
+                refused = await limiter.check(client)
+                if refused is not None:
+                    reason, wait = refused
+                    RATE_LIMITED.labels(reason).inc()
+                    await self._refuse(send, reason, wait)
+                    return
+            await self.app(scope, receive, send)
+        finally:
+            current_client.reset(token)
+
+    async def _refuse(self, send, reason: str, wait: float):
+        detail = {
+            "rate": "Too many requests",
+            "client_budget": "Daily Gemini token budget for this client is used up",
+            "global_budget": "Daily Gemini token budget is used up"
+        }[reason]
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(int(wait + 0.999), 1)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,400 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from metrics import CIRCUIT_OPEN, UPSTREAM_CALLS, UPSTREAM_HEDGES
+
+T = TypeVar("T")
+
+HEDGE_MIN_SAMPLES = 20  # latencies needed before the percentile is trusted
+LATENCY_WINDOW = 200  # recent successful attempts kept per operation
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a service that has been failing"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} is unavailable; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class InvalidReplyError(ValueError):
+    """Raised when a service answered, but not in the expected shape; retried without counting against the breaker"""
+
+
+class SaturatedError(RuntimeError):
+    """Raised when no call slot frees up before the deadline; says nothing about the service's health"""
+
+
+class ConcurrencyLimiter:
+    """
+    At most `limit` calls at once, shared by worker threads and event loop coroutines
+
+    Waiters get slots first come, first served: a thread blocks on an Event,
+    a coroutine awaits a Future that release() resolves on its own loop, so
+    sync and async callers draw from the same slots.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.active = 0
+        # threading.Event or asyncio.Future per waiter, oldest first
+        self.waiters: deque = deque()
+
+    def _try_acquire(self) -> bool:
+        """Take a free slot if nobody is queued for it; caller holds the lock"""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        return False
+
+    def acquire(self, timeout: float) -> bool:
+        """Block until a slot is free; False if none freed up within timeout seconds"""
+        with self.lock:
+            if self._try_acquire():
+                return True
+            event = threading.Event()
+            self.waiters.append(event)
+        event.wait(timeout)
+        with self.lock:
+            # release() hands the slot over under the lock, so this is final
+            if event.is_set():
+                return True
+            self.waiters.remove(event)
+            return False
+
+    async def acquire_async(self, timeout: float) -> bool:
+        """Non-blocking version of acquire()"""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self._try_acquire():
+                return True
+            future = loop.create_future()
+            self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except BaseException as e:
+            with self.lock:
+                handed_over = future not in self.waiters
+                if not handed_over:
+                    self.waiters.remove(future)
+            # A slot handed over just now is ours to give back; if the hand-over
+            # is still on its way, _wake() passes it on when it finds the future cancelled
+            if handed_over and future.done() and not future.cancelled():
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                return False
+            raise
+
+    def _wake(self, future: asyncio.Future):
+        """Give a handed-over slot to a waiting coroutine; runs on its loop"""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                waiter = self.waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                try:
+                    waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+                    return
+                except RuntimeError:
+                    continue  # Its loop is closed; try the next waiter
+            self.active -= 1
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a service after consecutive failures
+
+    After failure_threshold failures in a row the circuit opens and calls are
+    refused for reset_timeout seconds. Then a single probe call is let
+    through: its success closes the circuit, its failure opens it again.
+    Thread-safe, so sync callers on worker threads and async callers share it.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_timeout: float):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        CIRCUIT_OPEN.labels(service).set(0)
+
+    def allow(self):
+        """
+        Check that a call may go ahead
+
+        Raises:
+            CircuitOpenError: While the circuit is open or another caller is probing
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(self.service, max(remaining, 1.0))
+            # Half-open: this caller is the probe
+            self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            CIRCUIT_OPEN.labels(self.service).set(0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    print(f"⚠ {self.service} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.probing = False
+                CIRCUIT_OPEN.labels(self.service).set(1)
+
+    def release(self):
+        """Give up a probe that ended without an outcome (e.g. it was cancelled)"""
+        with self.lock:
+            self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.opened_at is not None
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.opened_at + self.reset_timeout - time.monotonic(), 1.0)
+
+
+class LatencyTracker:
+    """Recent successful attempt latencies of one operation, for the hedging threshold"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        """Latency at the given quantile, or None until there are enough samples"""
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)]
+
+
+class ResilientCaller:
+    """
+    Deadlines, retries, hedging and a circuit breaker around calls to a remote service
+
+    Each attempt gets at most `timeout` seconds and the whole call at most
+    `deadline` seconds. Errors for which `retryable` returns True are retried
+    up to `retries` times with jittered exponential backoff, as long as the
+    deadline leaves room. With `hedge` enabled, an async attempt still
+    running after the `hedge_quantile` latency of recent attempts (and at
+    least hedge_min_delay) gets a duplicate request; the first answer wins
+    and the other is cancelled. With a `limiter`, every attempt, hedged
+    duplicates included, holds one of its slots while it runs; an attempt
+    that gets no slot before the deadline fails with SaturatedError.
+    """
+
+    def __init__(
+        self,
+        service: str,
+        timeout: float,
+        deadline: float,
+        retries: int,
+        backoff: float,
+        max_backoff: float,
+        retryable: Callable[[BaseException], bool],
+        breaker: CircuitBreaker,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.0,
+        limiter: Optional[ConcurrencyLimiter] = None
+    ):
+        self.service = service
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retryable = retryable
+        self.breaker = breaker
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.limiter = limiter
+        self.latencies: Dict[str, LatencyTracker] = {}
+
+    def _tracker(self, operation: str) -> LatencyTracker:
+        return self.latencies.setdefault(operation, LatencyTracker())
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter for retry number `attempt` (from 0)"""
+        return min(self.backoff * (2 ** attempt), self.max_backoff) * random.uniform(0.5, 1.0)
+
+    def _hedge_delay(self, operation: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        threshold = self._tracker(operation).percentile(self.hedge_quantile)
+        return None if threshold is None else max(threshold, self.hedge_min_delay)
+
+    def _record(self, operation: str, error: Optional[BaseException]):
+        """Count an attempt's outcome and feed it to the breaker"""
+        if error is None:
+            outcome = "ok"
+            self.breaker.record_success()
+        elif isinstance(error, SaturatedError):
+            # Never reached the service
+            outcome = "saturated"
+            self.breaker.release()
+        elif isinstance(error, InvalidReplyError):
+            # The service is up; only this reply was unusable
+            outcome = "invalid"
+            self.breaker.record_success()
+        elif self.retryable(error):
+            outcome = "timeout" if isinstance(error, (asyncio.TimeoutError, TimeoutError)) else "error"
+            self.breaker.record_failure()
+        else:
+            # A rejected request says nothing about the service's health
+            outcome = "rejected"
+            self.breaker.release()
+        UPSTREAM_CALLS.labels(self.service, operation, outcome).inc()
+
+    def _next_delay(self, attempt: int, error: Exception, deadline: float) -> Optional[float]:
+        """Backoff before the next attempt, or None if the error should be raised"""
+        if attempt == self.retries or not self.retryable(error):
+            return None
+        delay = self._backoff_delay(attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def call(self, operation: str, attempt: Callable[[float], T]) -> T:
+        """
+        Run attempt(timeout) until it succeeds, with retries and the breaker; no hedging
+
+        The attempt must enforce the timeout it is given itself, since a
+        blocking call cannot be cancelled from outside.
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+            Exception: The last attempt's error once retries or the deadline run out
+        """
+        deadline = time.monotonic() + self.deadline
+        for number in range(self.retries + 1):
+            self.breaker.allow()
+            try:
+                result, started = self._attempt(attempt, deadline)
+            except Exception as e:
+                self._record(operation, e)
+                delay = self._next_delay(number, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._tracker(operation).record(time.monotonic() - started)
+            self._record(operation, None)
+            return result
+
+    def _attempt(self, attempt: Callable[[float], T], deadline: float) -> tuple:
+        """One blocking attempt in a limiter slot; returns (result, time the attempt started)"""
+        if self.limiter is not None and not self.limiter.acquire(max(deadline - time.monotonic(), 0.0)):
+            raise SaturatedError(f"No {self.service} call slot free before the deadline")
+        try:
+            started = time.monotonic()
+            return attempt(max(min(self.timeout, deadline - started), 0.001)), started
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    async def call_async(self, operation: str, attempt: Callable[[float], Awaitable[T]]) -> T:
+        """
+        Non-blocking version of call(), with hedging
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+            Exception: The last attempt's error once retries or the deadline run out
+        """
+        deadline = time.monotonic() + self.deadline
+        for number in range(self.retries + 1):
+            self.breaker.allow()
+            try:
+                result = await self._attempt_async(operation, attempt, deadline)
+            except Exception as e:
+                self._record(operation, e)
+                delay = self._next_delay(number, e, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._record(operation, None)
+            return result
+
+    async def _timed(self, operation: str, attempt: Callable[[float], Awaitable[T]], timeout: float, deadline: float) -> T:
+        """Run one request in a limiter slot, for at most timeout seconds once it has the slot"""
+        if self.limiter is not None and not await self.limiter.acquire_async(max(deadline - time.monotonic(), 0.0)):
+            raise SaturatedError(f"No {self.service} call slot free before the deadline")
+        try:
+            started = time.monotonic()
+            timeout = max(min(timeout, deadline - started), 0.001)
+            result = await asyncio.wait_for(attempt(timeout), timeout)
+            self._tracker(operation).record(time.monotonic() - started)
+            return result
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+
+    async def _attempt_async(self, operation: str, attempt: Callable[[float], Awaitable[T]], deadline: float) -> T:
+        """One attempt, plus a hedged duplicate if it runs past the hedging threshold"""
+        timeout = max(min(self.timeout, deadline - time.monotonic()), 0.001)
+        hedge_after = self._hedge_delay(operation)
+        if hedge_after is None or hedge_after >= timeout:
+            return await self._timed(operation, attempt, timeout, deadline)
+
+        pending = {asyncio.ensure_future(self._timed(operation, attempt, timeout, deadline))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return done.pop().result()
+
+            UPSTREAM_HEDGES.labels(self.service, operation).inc()
+            pending.add(asyncio.ensure_future(self._timed(operation, attempt, timeout - hedge_after, deadline)))
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
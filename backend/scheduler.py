@@ -0,0 +1,61 @@
+import time
+from typing import Optional
+
+# SM-2 parameters
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+PASSING_GRADE = 3  # grades 0-2 are lapses, 3-5 are successful recalls
+FIRST_INTERVAL = 1.0  # days
+SECOND_INTERVAL = 6.0  # days
+LAPSE_INTERVAL = 10 / (24 * 60)  # days (10 minutes): relearn within the session
+
+DAY = 24 * 60 * 60  # seconds
+
+# Fields holding a card's review state
+REVIEW_FIELDS = ("ease", "interval", "repetitions", "lapses", "due", "last_reviewed")
+
+
+def review(card: dict, grade: int, now: Optional[float] = None) -> dict:
+    """
+    Schedule the next review of a card with the SM-2 algorithm
+
+    Args:
+        card: Flashcard fields; missing review state counts as a new card
+        grade: Recall quality from 0 (blackout) to 5 (perfect)
+        now: Review time as a UNIX timestamp (defaults to the current time)
+
+    Returns:
+        Updated review state (REVIEW_FIELDS)
+    """
+    if not 0 <= grade <= 5:
+        raise ValueError("Grade must be between 0 and 5")
+    now = time.time() if now is None else now
+
+    ease = card.get("ease") or INITIAL_EASE
+    interval = card.get("interval") or 0.0
+    repetitions = card.get("repetitions") or 0
+    lapses = card.get("lapses") or 0
+
+    if grade < PASSING_GRADE:
+        repetitions = 0
+        lapses += 1
+        interval = LAPSE_INTERVAL
+    else:
+        if repetitions == 0:
+            interval = FIRST_INTERVAL
+        elif repetitions == 1:
+            interval = SECOND_INTERVAL
+        else:
+            interval = interval * ease
+        repetitions += 1
+
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+
+    return {
+        "ease": round(ease, 4),
+        "interval": interval,
+        "repetitions": repetitions,
+        "lapses": lapses,
+        "due": now + interval * DAY,
+        "last_reviewed": now
+    }
@@ -0,0 +1,221 @@
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Fields searched, and which of them also get typo-tolerant (fuzzy) terms
+SEARCH_FIELDS = ("original_text", "translated_text", "image_description")
+FUZZY_FIELDS = ("original_text", "translated_text")
+
+MIN_PREFIX_LENGTH = 1
+MAX_PREFIX_LENGTH = 20
+MIN_FUZZY_LENGTH = 4
+
+# Document field holding the index terms in MongoDB; never returned to clients
+TERMS_FIELD = "search_terms"
+
+# Thai is written without spaces between words, so Thai runs are indexed as
+# character bigrams; everything else is split into words
+TOKEN_PATTERN = re.compile(r"[\u0E00-\u0E7F]+|[^\W_]+")
+THAI_PATTERN = re.compile(r"^[\u0E00-\u0E7F]+$")
+
+# Term kinds, with the score a match of that kind contributes
+EXACT, PREFIX, FUZZY, GRAM = "e:", "p:", "f:", "g:"
+WEIGHTS = {EXACT: 3, PREFIX: 2, GRAM: 2, FUZZY: 1}
+
+
+def normalize(text: str) -> str:
+    """Fold case and compose characters so equivalent spellings match"""
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into Latin/other words and Thai runs"""
+    return TOKEN_PATTERN.findall(normalize(text or ""))
+
+
+def is_thai(token: str) -> bool:
+    return bool(THAI_PATTERN.match(token))
+
+
+def bigrams(token: str) -> List[str]:
+    """Character bigrams of a Thai run (the run itself if it is one character)"""
+    if len(token) < 2:
+        return [token]
+    return [token[i:i + 2] for i in range(len(token) - 1)]
+
+
+def deletions(token: str) -> Set[str]:
+    """The token plus every variant with one character removed"""
+    variants = {token}
+    if len(token) >= MIN_FUZZY_LENGTH:
+        variants.update(token[:i] + token[i + 1:] for i in range(len(token)))
+    return variants
+
+
+def search_terms(document: dict) -> List[str]:
+    """
+    Index terms for a flashcard document
+
+    Args:
+        document: Flashcard fields
+
+    Returns:
+        Sorted list of terms: exact words, word prefixes, one-deletion variants
+        (for typo tolerance) and Thai character bigrams
+    """
+    terms: Set[str] = set()
+    for field in SEARCH_FIELDS:
+        for token in tokenize(document.get(field) or ""):
+            if is_thai(token):
+                terms.update(GRAM + gram for gram in bigrams(token))
+                continue
+            terms.add(EXACT + token)
+            for length in range(MIN_PREFIX_LENGTH, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                terms.add(PREFIX + token[:length])
+            if field in FUZZY_FIELDS:
+                terms.update(FUZZY + variant for variant in deletions(token))
+    return sorted(terms)
+
+
+def query_groups(query: str, fuzzy: bool = True) -> List[Dict[str, int]]:
+    """
+    Turn a query into term groups
+
+    A document matches when it contains at least one term of every group; its
+    score is the sum of the best matching weight in each group.
+
+    Args:
+        query: Search text
+        fuzzy: Also match words within one edit
+
+    Returns:
+        List of {term: weight} groups
+    """
+    groups: List[Dict[str, int]] = []
+    for token in tokenize(query):
+        if is_thai(token):
+            groups.extend({GRAM + gram: WEIGHTS[GRAM]} for gram in bigrams(token))
+            continue
+        group = {
+            EXACT + token: WEIGHTS[EXACT],
+            PREFIX + token[:MAX_PREFIX_LENGTH]: WEIGHTS[PREFIX]
+        }
+        if fuzzy and len(token) >= MIN_FUZZY_LENGTH:
+            for variant in deletions(token):
+                group.setdefault(FUZZY + variant, WEIGHTS[FUZZY])
+        groups.append(group)
+    return groups
+
+
+def score(terms: Iterable[str], groups: List[Dict[str, int]]) -> int:
+    """Score a document's terms against query groups; 0 if any group is unmatched"""
+    terms = set(terms)
+    total = 0
+    for group in groups:
+        best = max((weight for term, weight in group.items() if term in terms), default=0)
+        if best == 0:
+            return 0
+        total += best
+    return total
+
+
+def with_search_terms(document: dict) -> dict:
+    """Copy of a flashcard document carrying its index terms, for MongoDB"""
+    return {**document, TERMS_FIELD: search_terms(document)}
+
+
+def search_filter(groups: List[Dict[str, int]]) -> dict:
+    """MongoDB filter for documents matching every query group"""
+    return {"$and": [{TERMS_FIELD: {"$in": list(group)}} for group in groups]}
+
+
+def rank(documents: Iterable[dict], groups: List[Dict[str, int]], limit: int) -> List[dict]:
+    """
+    Order candidate documents by score
+
+    Args:
+        documents: Candidates carrying their TERMS_FIELD
+        groups: Query groups from query_groups()
+        limit: Maximum number of results
+
+    Returns:
+        Best matching documents first, with TERMS_FIELD removed
+    """
+    scored = []
+    for document in documents:
+        terms = document.pop(TERMS_FIELD, None) or search_terms(document)
+        document_score = score(terms, groups)
+        if document_score:
+            scored.append((document_score, document))
+    scored.sort(key=lambda item: (-item[0], item[1]["id"]))
+    return [document for _, document in scored[:limit]]
+
+
+class InvertedIndex:
+    """Incrementally maintained term -> flashcard ID index"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Set[str]] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+
+    def add(self, document: dict):
+        """Index (or re-index) a flashcard document"""
+        terms = search_terms(document)
+        with self.lock:
+            self._remove(document["id"])
+            self.doc_terms[document["id"]] = terms
+            for term in terms:
+                self.postings.setdefault(term, set()).add(document["id"])
+
+    def remove(self, flashcard_id: str):
+        """Drop a flashcard from the index"""
+        with self.lock:
+            self._remove(flashcard_id)
+
+    def _remove(self, flashcard_id: str):
+        for term in self.doc_terms.pop(flashcard_id, ()):
+            ids = self.postings.get(term)
+            if ids is not None:
+                ids.discard(flashcard_id)
+                if not ids:
+                    del self.postings[term]
+
+    def search(self, query: str, limit: int = 20, fuzzy: bool = True) -> List[Tuple[str, int]]:
+        """
+        Find flashcards matching a query
+
+        Args:
+            query: Search text
+            limit: Maximum number of results
+            fuzzy: Also match words within one edit
+
+        Returns:
+            List of (flashcard ID, score), best first
+        """
+        groups = query_groups(query, fuzzy)
+        if not groups:
+            return []
+
+        with self.lock:
+            # Candidates must match every group; start from the most selective one
+            group_ids = []
+            for group in groups:
+                ids: Set[str] = set()
+                for term in group:
+                    ids |= self.postings.get(term, set())
+                if not ids:
+                    return []
+                group_ids.append(ids)
+            group_ids.sort(key=len)
+            candidates: Optional[Set[str]] = set(group_ids[0])
+            for ids in group_ids[1:]:
+                candidates &= ids
+                if not candidates:
+                    return []
+
+            results = [(flashcard_id, score(self.doc_terms[flashcard_id], groups)) for flashcard_id in candidates]
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
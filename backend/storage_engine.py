@@ -0,0 +1,696 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from search_index import InvertedIndex, SEARCH_FIELDS
+from image_similarity import BKTree
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+
+# Storage engine configuration
+MEMORY_STORE_DIR = os.getenv("MEMORY_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+MEMORY_STORE_PERSIST = os.getenv("MEMORY_STORE_PERSIST", "true").lower() == "true"
+MEMORY_STORE_FSYNC = os.getenv("MEMORY_STORE_FSYNC", "false").lower() == "true"
+MEMORY_STORE_COMPACT_OPS = int(os.getenv("MEMORY_STORE_COMPACT_OPS", "10000"))
+MEMORY_STORE_SNAPSHOT_INTERVAL = float(os.getenv("MEMORY_STORE_SNAPSHOT_INTERVAL", "300"))  # seconds
+# Share the store between worker processes through its log (needs persistence and fcntl)
+MEMORY_STORE_SHARED = os.getenv("MEMORY_STORE_SHARED", "true").lower() == "true"
+
+# Times a shared store re-reads everything after another process compacted the log under it
+RELOAD_ATTEMPTS = 5
+
+# Fields with a secondary index
+INDEXED_FIELDS = ("original_text", "translated_text")
+
+# Fields left out of list responses unless explicitly requested
+HEAVY_FIELDS = ("image",)
+
+
+class _LogGap(Exception):
+    """Raised when log records are missing because another process compacted them away"""
+
+
+class MemoryStore:
+    """
+    Embedded flashcard storage engine used when MongoDB is unavailable
+
+    Documents live in memory behind a lock, with IDs kept sorted for ordered
+    iteration, secondary indexes on INDEXED_FIELDS, a full-text index, a
+    due-time index for reviews and a perceptual-hash index for near-duplicate
+    images, all maintained on every write. When persistence is
+    enabled every write is appended to a log, and a background thread
+    periodically writes a compacted snapshot and drops the log segments it
+    covers, so the data survives restarts and loads quickly at startup.
+
+    In shared mode several worker processes use one data directory: writes
+    take an exclusive file lock, so sequence numbers stay global, and every
+    read first applies the log records other processes appended since, so
+    all workers see the same data. Reads stay in-process; keeping up costs a
+    couple of stat calls when nothing changed.
+
+    A versioned store stamps every write with the next collection version
+    (and updated_at), taken under the write lock so versions stay ordered
+    across processes, and keeps a tombstone for every deleted document. A
+    sorted (version, ID) index answers change feeds in O(log n + k).
+    """
+
+    def __init__(
+        self,
+        name: str = "flashcards",
+        data_dir: str = MEMORY_STORE_DIR,
+        persist: bool = MEMORY_STORE_PERSIST,
+        compact_ops: int = MEMORY_STORE_COMPACT_OPS,
+        snapshot_interval: float = MEMORY_STORE_SNAPSHOT_INTERVAL,
+        shared: bool = MEMORY_STORE_SHARED,
+        versioned: bool = False
+    ):
+        self.lock = threading.RLock()
+        self._reset()
+
+        self.versioned = versioned
+        # Versions handed out elsewhere (MongoDB) that local writes must stay above
+        self.min_version = 0
+
+        self.persist = persist
+        self.shared = persist and shared and fcntl is not None
+        self.compact_ops = compact_ops
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0  # sequence number of the last write
+        self.snapshot_seq = 0  # last write covered by the snapshot on disk
+        self.log_file = None
+        # Serializes compactions so an older snapshot never replaces a newer one
+        self.compact_lock = threading.Lock()
+        self._compact_requested = threading.Event()
+        self._closed = threading.Event()
+        self._compactor = None
+        # Shared mode: read handle on the log and the unterminated bytes at its end
+        self._tail = None
+        self._tail_partial = b""
+
+        if self.persist:
+            self.data_dir = data_dir
+            self.snapshot_path = os.path.join(data_dir, f"{name}.snapshot.json")
+            self.log_path = os.path.join(data_dir, f"{name}.log")
+            os.makedirs(data_dir, exist_ok=True)
+            if self.shared:
+                # Held around writes and log rotation, across processes
+                self.write_lock_file = open(os.path.join(data_dir, f"{name}.lock"), "a")
+                # Held while compacting, so two processes never snapshot at once
+                self.compact_lock_file = open(os.path.join(data_dir, f"{name}.compact.lock"), "a")
+            self._recover()
+            self.log_file = open(self.log_path, "a", encoding="utf-8")
+            self._compactor = threading.Thread(target=self._compact_loop, name=f"{name}-compactor", daemon=True)
+            self._compactor.start()
+
+    def _reset(self):
+        """Empty in-memory state"""
+        self.documents: Dict[str, dict] = {}
+        # Flashcard IDs kept sorted for keyset pagination
+        self.ids: List[str] = []
+        # field -> value -> IDs of documents with that value
+        self.indexes: Dict[str, Dict[str, Set[str]]] = {field: {} for field in INDEXED_FIELDS}
+        self.text_index = InvertedIndex()
+        # (due, ID) pairs kept sorted, so due cards are found in O(log n + k)
+        self.due_index: List[Tuple[float, str]] = []
+        self.image_index = BKTree()
+        # Versioned stores: (version, ID) of every document and tombstone, kept sorted for change feeds
+        self.version_index: List[Tuple[int, str]] = []
+        # ID -> {"id", "version", "deleted_at"} of deleted documents
+        self.tombstones: Dict[str, dict] = {}
+        self.version = 0  # highest version written
+        self.tombstone_floor = 0  # highest version of a pruned tombstone; older changes are gone
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self.documents)
+
+    # Index maintenance
+
+    def _index_add(self, document: dict):
+        for field, index in self.indexes.items():
+            value = document.get(field)
+            if value is not None:
+                index.setdefault(value, set()).add(document["id"])
+
+    def _index_remove(self, document: dict):
+        for field, index in self.indexes.items():
+            value = document.get(field)
+            ids = index.get(value)
+            if ids is not None:
+                ids.discard(document["id"])
+                if not ids:
+                    del index[value]
+
+    def _due_add(self, document: dict):
+        insort(self.due_index, (document.get("due") or 0.0, document["id"]))
+
+    def _due_remove(self, document: dict):
+        entry = (document.get("due") or 0.0, document["id"])
+        index = bisect_left(self.due_index, entry)
+        if index < len(self.due_index) and self.due_index[index] == entry:
+            del self.due_index[index]
+
+    def _image_add(self, document: dict):
+        if document.get("image_phash"):
+            self.image_index.add(document["id"], document["image_phash"])
+        else:
+            self.image_index.remove(document["id"])
+
+    def _version_add(self, version: int, flashcard_id: str):
+        insort(self.version_index, (version, flashcard_id))
+        self.version = max(self.version, version)
+
+    def _version_remove(self, version: int, flashcard_id: str):
+        entry = (version, flashcard_id)
+        index = bisect_left(self.version_index, entry)
+        if index < len(self.version_index) and self.version_index[index] == entry:
+            del self.version_index[index]
+
+    def _apply(self, op: str, flashcard_id: str, data: Optional[dict]):
+        """Apply a write to the in-memory state; caller holds the lock"""
+        if op == "prune":
+            self._prune(data["version"])
+            return
+
+        existing = self.documents.get(flashcard_id)
+        if existing is not None:
+            self._index_remove(existing)
+            self._due_remove(existing)
+            if self.versioned:
+                self._version_remove(existing.get("version") or 0, flashcard_id)
+
+        if op == "delete":
+            if existing is not None:
+                del self.documents[flashcard_id]
+                index = bisect_left(self.ids, flashcard_id)
+                if index < len(self.ids) and self.ids[index] == flashcard_id:
+                    del self.ids[index]
+                self.text_index.remove(flashcard_id)
+                self.image_index.remove(flashcard_id)
+            if self.versioned and data:
+                self._tombstone_add({"id": flashcard_id, **data})
+            return
+
+        if op == "update":
+            if existing is None:
+                return
+            # Copy on write, so documents handed out or snapshotted are never mutated
+            document = {**existing, **data}
+            # Reviews only touch scheduling fields; skip re-tokenizing for them
+            reindex_text = any(field in data for field in SEARCH_FIELDS)
+            reindex_image = "image_phash" in data
+        else:
+            document = dict(data)
+            if existing is None:
+                insort(self.ids, flashcard_id)
+            reindex_text = reindex_image = True
+        self.documents[flashcard_id] = document
+        self._index_add(document)
+        self._due_add(document)
+        if reindex_text:
+            self.text_index.add(document)
+        if reindex_image:
+            self._image_add(document)
+        if self.versioned:
+            # A re-created document supersedes its tombstone
+            tombstone = self.tombstones.pop(flashcard_id, None)
+            if tombstone is not None:
+                self._version_remove(tombstone["version"], flashcard_id)
+            self._version_add(document.get("version") or 0, flashcard_id)
+
+    def _tombstone_add(self, tombstone: dict):
+        previous = self.tombstones.get(tombstone["id"])
+        if previous is not None:
+            self._version_remove(previous["version"], tombstone["id"])
+        self.tombstones[tombstone["id"]] = tombstone
+        self._version_add(tombstone["version"], tombstone["id"])
+
+    def _prune(self, version: int):
+        """Drop tombstones up to a version; caller holds the lock"""
+        for flashcard_id, tombstone in list(self.tombstones.items()):
+            if tombstone["version"] <= version:
+                del self.tombstones[flashcard_id]
+                self._version_remove(tombstone["version"], flashcard_id)
+        self.tombstone_floor = max(self.tombstone_floor, version)
+
+    def _write(self, op: str, flashcard_id: str, data: Optional[dict] = None):
+        """Apply a write and append it to the log; caller holds the lock"""
+        if self.versioned and op != "prune":
+            # Stamped before logging, so every process replays the same version
+            version = max(self.version, self.min_version) + 1
+            if op == "delete":
+                data = {"version": version, "deleted_at": time.time()}
+            else:
+                data = {**data, "version": version, "updated_at": time.time()}
+        self._apply(op, flashcard_id, data)
+        self.seq += 1
+        if self.log_file is not None:
+            record = {"seq": self.seq, "op": op, "id": flashcard_id}
+            if data is not None:
+                record["data"] = data
+            self.log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.log_file.flush()
+            if MEMORY_STORE_FSYNC:
+                os.fsync(self.log_file.fileno())
+            if self.seq - self.snapshot_seq >= self.compact_ops:
+                self._compact_requested.set()
+
+    # Public interface
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the lock for a write; in shared mode also the file lock, with other processes' writes applied"""
+        with self.lock:
+            if not self.shared:
+                yield
+                return
+            fcntl.flock(self.write_lock_file, fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                if os.fstat(self.log_file.fileno()).st_ino != os.fstat(self._tail.fileno()).st_ino:
+                    # Another process rotated the log; append to the new one
+                    self.log_file.close()
+                    self.log_file = open(self.log_path, "a", encoding="utf-8")
+                if self._tail_partial:
+                    # Nobody else is writing, so this is a record torn by a crash; terminate it
+                    self.log_file.write("\n")
+                    self.log_file.flush()
+                    self._read_tail()
+                yield
+            finally:
+                fcntl.flock(self.write_lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Apply writes made by other processes (shared mode only)"""
+        if self.shared and self._tail is not None:
+            with self.lock:
+                self._catch_up()
+
+    def insert(self, document: dict) -> dict:
+        """Add or replace a flashcard document; returns the stored document"""
+        with self._exclusive():
+            self._write("insert", document["id"], document)
+            return self.documents[document["id"]]
+
+    def insert_many(self, documents: List[dict]) -> List[dict]:
+        """Add or replace several flashcard documents; returns the stored documents"""
+        with self._exclusive():
+            for document in documents:
+                self._write("insert", document["id"], document)
+            return [self.documents[document["id"]] for document in documents]
+
+    def stamp_versions(self) -> int:
+        """Give documents written before the store was versioned a version; returns how many"""
+        if not self.versioned:
+            return 0
+        self._refresh()
+        # Unversioned documents sort first
+        if not self.version_index or self.version_index[0][0] > 0:
+            return 0
+        with self._exclusive():
+            unversioned = [flashcard_id for flashcard_id, document in self.documents.items() if not document.get("version")]
+            for flashcard_id in unversioned:
+                self._write("update", flashcard_id, {})
+            return len(unversioned)
+
+    def get(self, flashcard_id: str) -> Optional[dict]:
+        """Get a flashcard document by ID"""
+        self._refresh()
+        return self.documents.get(flashcard_id)
+
+    def iter(
+        self,
+        after_id: Optional[str] = None,
+        include_image: bool = False,
+        limit: Optional[int] = None
+    ) -> Iterator[dict]:
+        """Yield flashcard documents in ID order"""
+        self._refresh()
+        with self.lock:
+            start = bisect_right(self.ids, after_id) if after_id else 0
+            stop = start + limit if limit else None
+            ids = self.ids[start:stop]
+        for flashcard_id in ids:
+            document = self.documents.get(flashcard_id)
+            if document is None:
+                continue
+            if not include_image:
+                document = {k: v for k, v in document.items() if k not in HEAVY_FIELDS}
+            yield document
+
+    def find_by(self, field: str, value: str) -> List[dict]:
+        """Get documents whose indexed field equals value"""
+        self._refresh()
+        with self.lock:
+            ids = sorted(self.indexes[field].get(value, ()))
+            return [self.documents[flashcard_id] for flashcard_id in ids]
+
+    def search(self, query: str, limit: int = 20, fuzzy: bool = True) -> List[dict]:
+        """Get the documents best matching a full-text query, without HEAVY_FIELDS"""
+        self._refresh()
+        results = []
+        for flashcard_id, _ in self.text_index.search(query, limit=limit, fuzzy=fuzzy):
+            document = self.documents.get(flashcard_id)
+            if document is not None:
+                results.append({k: v for k, v in document.items() if k not in HEAVY_FIELDS})
+        return results
+
+    def due(self, now: float, limit: int) -> List[dict]:
+        """Get up to `limit` documents due at `now`, most overdue first, without HEAVY_FIELDS"""
+        self._refresh()
+        with self.lock:
+            stop = min(bisect_right(self.due_index, (now, "\uffff")), limit)
+            documents = [self.documents[flashcard_id] for _, flashcard_id in self.due_index[:stop]]
+        return [{k: v for k, v in document.items() if k not in HEAVY_FIELDS} for document in documents]
+
+    def similar_images(self, phash: str, max_distance: int, limit: int = 1) -> List[Tuple[int, dict]]:
+        """Get documents whose image hash is within max_distance bits, closest first, without HEAVY_FIELDS"""
+        self._refresh()
+        results = []
+        for distance, flashcard_id in self.image_index.search(phash, max_distance):
+            document = self.documents.get(flashcard_id)
+            if document is not None:
+                results.append((distance, {k: v for k, v in document.items() if k not in HEAVY_FIELDS}))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def update(self, flashcard_id: str, update_data: dict) -> Optional[dict]:
+        """Update fields of a flashcard document"""
+        with self._exclusive():
+            if flashcard_id not in self.documents:
+                return None
+            self._write("update", flashcard_id, update_data)
+            return self.documents[flashcard_id]
+
+    def merge(self, flashcard_id: str, update_data: dict) -> dict:
+        """Update fields of a document, creating it with just those fields if it is missing"""
+        with self._exclusive():
+            if flashcard_id in self.documents:
+                self._write("update", flashcard_id, update_data)
+            else:
+                self._write("insert", flashcard_id, {"id": flashcard_id, **update_data})
+            return self.documents[flashcard_id]
+
+    def update_if(self, flashcard_id: str, expected: dict, update_data: dict) -> Optional[dict]:
+        """Update fields of a document only if it still has the expected field values (compare-and-set)"""
+        with self._exclusive():
+            document = self.documents.get(flashcard_id)
+            if document is None or any(document.get(field) != value for field, value in expected.items()):
+                return None
+            self._write("update", flashcard_id, update_data)
+            return self.documents[flashcard_id]
+
+    def delete(self, flashcard_id: str) -> bool:
+        """Delete a flashcard document"""
+        with self._exclusive():
+            if flashcard_id not in self.documents:
+                return False
+            self._write("delete", flashcard_id)
+            return True
+
+    def changes(self, since: int, limit: int, include_image: bool = False) -> List[dict]:
+        """
+        Get documents and tombstones written after a version, oldest first
+
+        Tombstones are {"id", "version", "deleted_at", "deleted": True};
+        documents come without HEAVY_FIELDS unless include_image is set.
+        """
+        self._refresh()
+        with self.lock:
+            start = bisect_right(self.version_index, (since, "\uffff"))
+            entries = self.version_index[start:start + limit]
+            results = []
+            for _, flashcard_id in entries:
+                document = self.documents.get(flashcard_id)
+                if document is None:
+                    results.append({**self.tombstones[flashcard_id], "deleted": True})
+                elif include_image:
+                    results.append(document)
+                else:
+                    results.append({k: v for k, v in document.items() if k not in HEAVY_FIELDS})
+            return results
+
+    def current_version(self) -> int:
+        """Highest version written, by any process"""
+        self._refresh()
+        return self.version
+
+    def prune_tombstones(self, deleted_before: float) -> int:
+        """
+        Drop tombstones of documents deleted before a timestamp
+
+        Change feeds from versions older than the newest dropped tombstone can
+        no longer be answered; see tombstone_floor.
+
+        Returns:
+            Number of tombstones dropped
+        """
+        with self._exclusive():
+            expired = [tombstone["version"] for tombstone in self.tombstones.values() if tombstone["deleted_at"] < deleted_before]
+            if not expired:
+                return 0
+            # Versions, not times, are replayed, so every process drops the same tombstones
+            version = max(expired)
+            count = sum(1 for tombstone in self.tombstones.values() if tombstone["version"] <= version)
+            self._write("prune", "", {"version": version})
+            return count
+
+    # Persistence
+
+    def _log_segments(self) -> List[str]:
+        """Rotated log segments, oldest first"""
+        segments = glob.glob(f"{self.log_path}.*")
+        return sorted(
+            (path for path in segments if path.rsplit(".", 1)[1].isdigit()),
+            key=lambda path: int(path.rsplit(".", 1)[1])
+        )
+
+    def _recover(self):
+        """Load the latest snapshot and replay newer log records"""
+        for attempt in range(RELOAD_ATTEMPTS):
+            try:
+                replayed = self._load()
+                break
+            except _LogGap:
+                # Another process compacted while we were reading; start over
+                if attempt == RELOAD_ATTEMPTS - 1:
+                    raise RuntimeError(f"Could not load {self.log_path}: the log keeps being compacted")
+                with self.lock:
+                    self._reset()
+                    self.seq = self.snapshot_seq = 0
+
+        if self.documents:
+            print(f"✓ Loaded {len(self.documents)} flashcards from local storage ({replayed} log records replayed)")
+
+    def _load(self) -> int:
+        """Body of _recover(); returns the number of log records replayed"""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.documents = snapshot["documents"]
+            self.ids = sorted(self.documents)
+            for document in self.documents.values():
+                self._index_add(document)
+                self.text_index.add(document)
+                self._image_add(document)
+            self.due_index = sorted((document.get("due") or 0.0, document["id"]) for document in self.documents.values())
+            if self.versioned:
+                self.tombstones = {tombstone["id"]: tombstone for tombstone in snapshot.get("tombstones", [])}
+                self.tombstone_floor = snapshot.get("tombstone_floor", 0)
+                self.version_index = sorted(
+                    [(document.get("version") or 0, document["id"]) for document in self.documents.values()]
+                    + [(tombstone["version"], tombstone["id"]) for tombstone in self.tombstones.values()]
+                )
+                self.version = max(snapshot.get("version", 0), self.version_index[-1][0] if self.version_index else 0)
+            self.seq = self.snapshot_seq = snapshot["seq"]
+
+        replayed = 0
+        log_files = self._log_segments() if self.shared else self._log_segments() + [self.log_path]
+        for path in log_files:
+            try:
+                log = open(path, "rb")
+            except FileNotFoundError:
+                if self.shared:
+                    raise _LogGap()
+                continue
+            with log:
+                intact = 0  # bytes of complete records
+                for line in log:
+                    if self._replay(line):
+                        replayed += 1
+                        intact += len(line)
+                    elif not self.shared:
+                        # Torn write from a crash; nothing after it was acknowledged
+                        if path == self.log_path:
+                            # Cut it off, or the next record would be appended to it and lost too
+                            log.close()
+                            os.truncate(path, intact)
+                        break
+
+        if self.shared:
+            # The live log is followed from here on; it may be appended to while we read it
+            if self._tail is not None:
+                self._tail.close()
+            open(self.log_path, "a").close()
+            self._tail = open(self.log_path, "rb")
+            self._tail_partial = b""
+            replayed += self._read_tail()
+        return replayed
+
+    def _replay(self, line) -> bool:
+        """Apply one log record if it is newer than the state; False for a torn record"""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return False
+        if record["seq"] <= self.seq:
+            return True
+        if self.shared and record["seq"] != self.seq + 1:
+            raise _LogGap()
+        self._apply(record["op"], record["id"], record.get("data"))
+        self.seq = record["seq"]
+        return True
+
+    def _read_tail(self) -> int:
+        """Apply the complete records appended to the followed log since the last read"""
+        data = self._tail.read()
+        if not data:
+            return 0
+        data = self._tail_partial + data
+        end = data.rfind(b"\n") + 1
+        self._tail_partial = data[end:]
+        replayed = 0
+        for line in data[:end].splitlines():
+            # A torn record is skipped; the writer that found it terminated it with a newline
+            if line and self._replay(line):
+                replayed += 1
+        return replayed
+
+    def _catch_up(self):
+        """Apply records other processes appended, following log rotations; caller holds the lock"""
+        try:
+            self._read_tail()
+            try:
+                rotated = os.stat(self.log_path).st_ino != os.fstat(self._tail.fileno()).st_ino
+            except FileNotFoundError:
+                # Mid-rotation in another process; pick it up next time
+                return
+            if rotated:
+                # Records written before the rotation are still in the old segment
+                self._read_tail()
+                self.snapshot_seq = self.seq
+                self._tail.close()
+                self._tail = open(self.log_path, "rb")
+                self._tail_partial = b""
+                self._read_tail()
+        except _LogGap:
+            # Missed a whole segment: the snapshot now covers it, so reload everything
+            self._reset()
+            self.seq = self.snapshot_seq = 0
+            self._recover()
+
+    def compact(self):
+        """Write a snapshot of the current state and drop the log it replaces"""
+        if not self.persist:
+            return
+        with self.compact_lock:
+            if not self.shared:
+                self._compact()
+                return
+            try:
+                fcntl.flock(self.compact_lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is compacting the same log
+                return
+            try:
+                self._compact()
+            finally:
+                fcntl.flock(self.compact_lock_file, fcntl.LOCK_UN)
+
+    def _compact(self):
+        """Body of compact(); caller holds compact_lock"""
+        with self._exclusive():
+            if self.seq == self.snapshot_seq or self.log_file is None:
+                return
+            # Documents are copy-on-write, so a shallow copy is a consistent view
+            documents = dict(self.documents)
+            snapshot = {"seq": self.seq, "documents": documents}
+            if self.versioned:
+                snapshot.update(
+                    tombstones=list(self.tombstones.values()),
+                    tombstone_floor=self.tombstone_floor,
+                    version=self.version
+                )
+            seq = self.seq
+            # Start a new log segment; records after `seq` land in the fresh file
+            self.log_file.close()
+            os.replace(self.log_path, f"{self.log_path}.{seq}")
+            self.log_file = open(self.log_path, "a", encoding="utf-8")
+            if self.shared:
+                # Caught up and holding the write lock, so the old segment has nothing left to read
+                self._tail.close()
+                self._tail = open(self.log_path, "rb")
+                self._tail_partial = b""
+
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.data_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+                json.dump(snapshot, temp_file, ensure_ascii=False)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.snapshot_path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            self.snapshot_seq = max(self.snapshot_seq, seq)
+        for path in self._log_segments():
+            if int(path.rsplit(".", 1)[1]) <= seq:
+                os.unlink(path)
+
+    def _compact_loop(self):
+        """Background thread: snapshot on a timer or when the log grows too long"""
+        while not self._closed.is_set():
+            self._compact_requested.wait(self.snapshot_interval)
+            self._compact_requested.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Local storage snapshot failed: {e}")
+
+    def close(self):
+        """Write a final snapshot and stop the background thread"""
+        if not self.persist or self._closed.is_set():
+            return
+        self._closed.set()
+        self._compact_requested.set()
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Local storage snapshot failed: {e}")
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            if self._tail is not None:
+                self._tail.close()
+                self._tail = None
@@ -0,0 +1,5 @@
+"""Keep tests off the data directories the app writes to by default"""
+import os
+
+# Read when storage_engine is imported, so set before any test module imports it
+os.environ.setdefault("MEMORY_STORE_PERSIST", "false")
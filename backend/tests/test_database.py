@@ -0,0 +1,172 @@
+"""Write-behind replay of writes made while MongoDB is down, and change feeds"""
+import time
+
+import mongomock
+import pytest
+from pymongo.errors import ConnectionFailure
+
+from database import (
+    VERSION_COUNTER,
+    ChangesExpiredError,
+    DatabaseManager,
+    WriteQueuedError,
+    collection_version,
+    merge_changes,
+    settled_version
+)
+from models import Flashcard
+from search_index import TERMS_FIELD
+
+
+@pytest.fixture
+def database():
+    """DatabaseManager on an in-process MongoDB, with MongoDB primary"""
+    manager = DatabaseManager()
+    client = mongomock.MongoClient()
+    manager.client = client
+    manager.db = client["flashcard_test"]
+    manager.collection = manager.db["flashcards"]
+    manager.translations = manager.db["translation_cache"]
+    manager.jobs = manager.db["jobs"]
+    manager.counters = manager.db["counters"]
+    manager.tombstones = manager.db["flashcard_tombstones"]
+    manager.use_mongodb = True
+    manager.mongo_reached = True
+    yield manager
+    manager.close()
+
+
+def outage(database: DatabaseManager):
+    database._fall_back("test", ConnectionFailure("connection refused"))
+
+
+def in_mongodb(database: DatabaseManager, flashcard_id: str) -> dict:
+    return database.collection.find_one({"id": flashcard_id}, {"_id": 0})
+
+
+def test_replay_sets_changed_fields_over_a_stale_local_copy(database):
+    outage(database)
+    card = database.create_flashcard(Flashcard(original_text="apple", translated_text="แอปเปิ้ล"))
+    database._replay_write_behind()
+    assert database.use_mongodb
+
+    # Changed in MongoDB only; the local copy from the first outage is now stale
+    database.update_flashcard(card.id, {"translated_text": "ผลแอปเปิ้ล"})
+    outage(database)
+    database.update_flashcard(card.id, {"image_description": "A red apple"})
+    database._replay_write_behind()
+
+    replayed = in_mongodb(database, card.id)
+    assert replayed["translated_text"] == "ผลแอปเปิ้ล"
+    assert replayed["image_description"] == "A red apple"
+    assert len(database.write_behind) == 0
+
+
+def test_replay_rebuilds_search_terms_of_updated_cards(database):
+    card = database.create_flashcard(Flashcard(original_text="apple", translated_text="แอปเปิ้ล"))
+    outage(database)
+    with pytest.raises(WriteQueuedError):
+        database.update_flashcard(card.id, {"original_text": "banana"})
+    database._replay_write_behind()
+
+    assert in_mongodb(database, card.id)["original_text"] == "banana"
+    assert [found.id for found in database.search_flashcards("banana", fuzzy=False)] == [card.id]
+    assert "apple" not in in_mongodb(database, card.id)[TERMS_FIELD]
+
+
+def test_writes_to_cards_only_mongodb_holds_are_queued(database):
+    kept = database.create_flashcard(Flashcard(original_text="cat", translated_text="แมว"))
+    removed = database.create_flashcard(Flashcard(original_text="dog", translated_text="หมา"))
+    outage(database)
+
+    with pytest.raises(WriteQueuedError):
+        database.update_flashcard(kept.id, {"translated_text": "แมวน้อย"})
+    assert database.delete_flashcard(removed.id)
+    # Deleted during the outage, so later writes find nothing
+    assert database.update_flashcard(removed.id, {"translated_text": "สุนัข"}) is None
+    assert not database.delete_flashcard(removed.id)
+
+    database._replay_write_behind()
+    assert in_mongodb(database, kept.id)["translated_text"] == "แมวน้อย"
+    assert in_mongodb(database, removed.id) is None
+    assert database.tombstones.find_one({"id": removed.id}) is not None
+
+
+def test_missing_cards_are_not_queued_before_mongodb_answered(database):
+    database.mongo_reached = False
+    outage(database)
+
+    assert database.update_flashcard("no-such-card", {"translated_text": "x"}) is None
+    assert not database.delete_flashcard("no-such-card")
+    assert len(database.write_behind) == 0
+
+
+def test_a_card_created_during_the_outage_is_replayed_whole(database):
+    outage(database)
+    card = database.create_flashcard(Flashcard(original_text="fish", translated_text="ปลา"))
+    database.update_flashcard(card.id, {"image_description": "A fish"})
+    database._replay_write_behind()
+
+    replayed = in_mongodb(database, card.id)
+    assert (replayed["original_text"], replayed["image_description"]) == ("fish", "A fish")
+
+
+def test_settled_version_stops_below_live_reservations():
+    now = time.time()
+    counter = {"version": 9, "pending": [
+        {"token": "a", "floor": 6, "expires_at": now + 60},
+        {"token": "b", "floor": 4, "expires_at": now - 1},  # Its writer died
+    ]}
+    assert settled_version(counter) == 6
+    assert collection_version(counter) is None
+    assert settled_version({"version": 9, "pending": []}) == collection_version({"version": 9}) == 9
+    assert settled_version(None) == collection_version(None) == 0
+
+
+def test_merge_changes_orders_cards_and_tombstones_by_version():
+    documents = [{"id": "a", "version": 1}, {"id": "c", "version": 4}]
+    tombstones = [{"id": "b", "version": 2, "deleted_at": 0.0}]
+    merged = merge_changes(documents, tombstones, limit=2)
+    assert [(entry["id"], entry.get("deleted", False)) for entry in merged] == [("a", False), ("b", True)]
+
+
+def test_change_feed_waits_for_a_write_still_landing(database):
+    first = database.create_flashcard(Flashcard(original_text="one", translated_text="หนึ่ง"))
+    with database._reserve_versions() as version:
+        # A later writer lands before this one
+        later = database.create_flashcard(Flashcard(original_text="two", translated_text="สอง"))
+        assert later.version > version
+        assert [entry["id"] for entry in database.flashcard_changes(0, 10)] == [first.id]
+        assert database.flashcards_version() is None
+    assert [entry["id"] for entry in database.flashcard_changes(first.version, 10)] == [later.id]
+    assert database.flashcards_version() == later.version
+    assert database.counters.find_one({"_id": VERSION_COUNTER})["pending"] == []
+
+
+def test_change_feed_reports_deletes(database):
+    card = database.create_flashcard(Flashcard(original_text="one", translated_text="หนึ่ง"))
+    assert database.delete_flashcard(card.id)
+    (change,) = database.flashcard_changes(card.version, 10)
+    assert (change["id"], change["deleted"]) == (card.id, True)
+    assert change["version"] == database.flashcards_version()
+
+
+def test_writes_to_missing_cards_leave_the_version_alone(database):
+    database.create_flashcard(Flashcard(original_text="one", translated_text="หนึ่ง"))
+    version = database.flashcards_version()
+    assert database.update_flashcard("no-such-card", {"translated_text": "x"}) is None
+    assert not database.delete_flashcard("no-such-card")
+    assert database.flashcards_version() == version
+
+
+def test_change_feed_from_before_pruned_tombstones_has_expired():
+    database = DatabaseManager()
+    card = database.create_flashcard(Flashcard(original_text="one", translated_text="หนึ่ง"))
+    database.delete_flashcard(card.id)
+    assert database.flashcard_changes(card.version, 10)[0]["deleted"]
+
+    database.in_memory_storage.prune_tombstones(time.time() + 1)
+    with pytest.raises(ChangesExpiredError):
+        database.flashcard_changes(card.version, 10)
+    assert database.flashcard_changes(0, 10) == []
+    database.close()
@@ -0,0 +1,64 @@
+"""Offline dictionary lookups: exact, case-folded and base-form matches"""
+import pytest
+
+from dictionary import DictionaryTier, LocalTranslator, english_lemmas
+
+WORDS = """# test list
+apple\tแอปเปิ้ล\tA red apple
+polish\tขัดเงา
+Polish\tโปแลนด์
+US\tสหรัฐอเมริกา
+thank you\tขอบคุณ
+child\tเด็ก
+"""
+
+
+@pytest.fixture
+def translator(tmp_path):
+    words = tmp_path / "lists"
+    words.mkdir()
+    (words / "en-th.tsv").write_text(WORDS, encoding="utf-8")
+    translator = LocalTranslator([DictionaryTier(directory=str(words), index_directory=str(tmp_path / "index"))])
+    yield translator
+    translator.close()
+
+
+def translated(answer):
+    return None if answer is None else (answer["tier"], answer["translated_text"])
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("apple", ("dictionary", "แอปเปิ้ล")),
+    ("Apple", ("dictionary", "แอปเปิ้ล")),
+    ("  THANK   you ", ("dictionary", "ขอบคุณ")),
+    ("us", ("dictionary", "สหรัฐอเมริกา")),
+    ("polish", ("dictionary", "ขัดเงา")),
+    ("Polish", ("dictionary", "โปแลนด์")),
+    # Differs from both "polish" and "Polish" only in case, so it is not certain
+    ("POLISH", None),
+    # Base forms are only suggestions
+    ("apples", None),
+    ("pear", None),
+])
+def test_lookup(translator, text, expected):
+    assert translated(translator.translate(text, "en", "th")) == expected
+
+
+def test_base_forms_and_ambiguous_case_are_suggested(translator):
+    assert translated(translator.fallback("apples", "en", "th")) == ("lemma", "แอปเปิ้ล")
+    assert translated(translator.fallback("children", "en", "th")) == ("lemma", "เด็ก")
+    assert translated(translator.fallback("POLISH", "en", "th")) == ("lemma", "ขัดเงา")
+    assert translator.fallback("pears", "en", "th") is None
+    assert translator.stats()["fallbacks"] == 3
+
+
+def test_pairs_without_a_word_list_answer_nothing(translator):
+    assert translator.translate("apple", "th", "en") is None
+    assert translator.stats()["misses"] == 1
+
+
+def test_english_lemmas():
+    assert "apple" in english_lemmas("apples")
+    assert "run" in english_lemmas("running")
+    assert english_lemmas("went") == ["go"]
+    assert english_lemmas("glass") == []
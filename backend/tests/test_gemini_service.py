@@ -0,0 +1,101 @@
+"""Validation of Gemini JSON replies and their retries, against a fake model"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import gemini_service
+from dictionary import LocalTranslator
+from gemini_service import GeminiError, GeminiService
+from rate_limit import RateLimiter, current_client, utc_day
+from resilience import InvalidReplyError
+from translation_cache import TranslationCache
+
+
+class FakeModel:
+    """Answers generate_content with the given reply texts in turn"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        text = self.replies.pop(0)
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=10, candidates_token_count=5, total_token_count=15
+        ))
+
+    def generate_content(self, contents, **kwargs):
+        return self._next()
+
+    async def generate_content_async(self, contents, **kwargs):
+        return self._next()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(gemini_service, "GEMINI_RETRY_BACKOFF", 0.001)
+    service = GeminiService(TranslationCache(), LocalTranslator([]), RateLimiter())
+    yield service
+    service.batch_executor.shutdown()
+
+
+@pytest.mark.parametrize("reply", [
+    "not json",
+    '{"description": "no translation"}',
+    '{"translation": "   "}',
+    '["แอปเปิ้ล"]',
+])
+def test_unusable_translation_replies_are_refused(service, reply):
+    with pytest.raises(InvalidReplyError):
+        service._parse_translation("apple", reply)
+
+
+def test_translation_reply_is_stripped_and_gets_a_default_description(service):
+    result = service._parse_translation("apple", '{"translation": " แอปเปิ้ล "}')
+    assert result == {
+        "original_text": "apple",
+        "translated_text": "แอปเปิ้ล",
+        "image_description": "Visual representation of apple"
+    }
+
+
+def test_batch_reply_keeps_only_valid_items(service):
+    reply = """{"items": [
+        {"index": 0, "translation": "หนึ่ง"},
+        {"index": 1, "translation": ""},
+        {"index": 7, "translation": "out of range"},
+        {"index": "2", "translation": "not an index"},
+        "not an item"
+    ]}"""
+    results = service._parse_batch(["one", "two", "three"], reply)
+    assert results[0]["translated_text"] == "หนึ่ง"
+    assert results[1:] == [None, None]
+
+    for reply in ("[]", '{"items": {}}', "{"):
+        with pytest.raises(InvalidReplyError):
+            service._parse_batch(["one"], reply)
+
+
+def test_invalid_reply_is_retried_and_every_attempt_is_charged(service):
+    service.text_model = FakeModel("{}", '{"translation": "แอปเปิ้ล", "description": "A red apple"}')
+    token = current_client.set("ip:a")
+    try:
+        result = service.generate_translation("apple")
+    finally:
+        current_client.reset(token)
+    assert (result["translated_text"], result["tier"]) == ("แอปเปิ้ล", "gemini")
+    assert service.text_model.calls == 2
+    assert service.rate_limiter.local.usage("ip:a", utc_day()) == 30
+    # Cached: not asked again
+    assert service.generate_translation("apple")["tier"] == "cache"
+    assert service.text_model.calls == 2
+
+
+def test_invalid_replies_are_never_cached(service):
+    service.text_model = FakeModel(*["not json"] * (gemini_service.GEMINI_RETRIES + 1))
+    with pytest.raises(GeminiError):
+        asyncio.run(service.generate_translation_async("apple"))
+    assert service.translation_cache.lookup(service.translation_cache.make_key("apple", "en", "th")) is None
+    assert not service.breaker.is_open
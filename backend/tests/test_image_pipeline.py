@@ -0,0 +1,53 @@
+"""Image preprocessing sizes, orientation and the worker process pool"""
+import asyncio
+import io
+
+from PIL import Image
+
+from image_pipeline import IMAGE_DISPLAY_MAX_EDGE, IMAGE_THUMBNAIL_MAX_EDGE, ImagePipeline, preprocess_image
+
+ORIENTATION = 0x0112
+ROTATED_90 = 6
+
+
+def camera_jpeg(width: int = 4032, height: int = 3024, orientation: int = 1) -> bytes:
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    exif = Image.Exif()
+    exif[ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def size_of(data: bytes) -> tuple:
+    return Image.open(io.BytesIO(data)).size
+
+
+def test_large_jpegs_are_decoded_reduced_but_keep_their_display_size():
+    result = preprocess_image(camera_jpeg())
+    assert (result["width"], result["height"]) == (4032, 3024)
+    assert size_of(result["display_image"]) == (IMAGE_DISPLAY_MAX_EDGE, IMAGE_DISPLAY_MAX_EDGE * 3 // 4)
+    assert max(size_of(result["thumbnail"])) == IMAGE_THUMBNAIL_MAX_EDGE
+
+
+def test_exif_rotation_is_applied_to_every_size():
+    result = preprocess_image(camera_jpeg(orientation=ROTATED_90))
+    assert (result["width"], result["height"]) == (3024, 4032)
+    width, height = size_of(result["display_image"])
+    assert height == IMAGE_DISPLAY_MAX_EDGE and width < height
+
+
+def test_small_images_are_not_upscaled():
+    result = preprocess_image(camera_jpeg(640, 480))
+    assert size_of(result["display_image"]) == (640, 480)
+
+
+def test_pipeline_runs_in_worker_processes(tmp_path):
+    path = tmp_path / "upload.jpg"
+    path.write_bytes(camera_jpeg(800, 600))
+    pipeline = ImagePipeline(max_workers=1)
+    try:
+        result = asyncio.run(pipeline.process(str(path)))
+    finally:
+        pipeline.close()
+    assert (result["width"], result["height"]) == (800, 600)
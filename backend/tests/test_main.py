@@ -0,0 +1,133 @@
+"""Route behavior: conditional requests and the change feed"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+import main
+from async_database import AsyncDatabaseManager
+from database import DatabaseManager
+from models import Flashcard
+from tts_cache import TTSCache
+
+IMAGE_HASH = "ab" * 32
+
+
+def request_with(if_none_match=None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"v1"', True),
+    ('"v0", "v1"', True),
+    ('W/"v1"', True),
+    ('"v0",W/"v1"', True),
+    ("*", True),
+    ('"v0"', False),
+    ('"v10"', False),
+    ("", False),
+    (None, False),
+])
+def test_etag_matches(header, matches):
+    assert main.etag_matches(request_with(header), '"v1"') is matches
+
+
+class FakeImageStore:
+    def __init__(self):
+        self.reads = 0
+
+    def get(self, image_hash):
+        self.reads += 1
+        return b"image", "image/webp"
+
+
+@pytest.fixture
+def app_state(tmp_path):
+    """Services the tested routes read from app.state, without running the lifespan"""
+    state = main.app.state
+    state.image_store = FakeImageStore()
+    state.tts_cache = TTSCache(cache_dir=str(tmp_path / "tts"))
+    state.tts_executor = None
+    yield state
+    del state.image_store, state.tts_cache, state.tts_executor
+
+
+def get(path: str, **kwargs) -> httpx.Response:
+    async def fetch():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, **kwargs)
+    return asyncio.run(fetch())
+
+
+def test_image_revalidation_accepts_weak_and_listed_etags(app_state):
+    for header in (f'W/"{IMAGE_HASH}"', f'"other", "{IMAGE_HASH}"', "*"):
+        response = get(f"/images/{IMAGE_HASH}", headers={"If-None-Match": header})
+        assert response.status_code == 304
+    assert app_state.image_store.reads == 0
+
+    response = get(f"/images/{IMAGE_HASH}", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200 and response.content == b"image"
+
+
+def test_speech_revalidation_accepts_weak_and_listed_etags(app_state):
+    key = TTSCache.make_key("hello", "en")
+    app_state.tts_cache.put_file(key, lambda path: open(path, "wb").write(b"mp3"))
+
+    response = get("/tts/", params={"text": "hello"}, headers={"If-None-Match": f'"x", W/"{key}"'})
+    assert response.status_code == 304
+
+    response = get("/tts/", params={"text": "hello"})
+    assert response.status_code == 200 and response.content == b"mp3"
+    assert response.headers["etag"] == f'"{key}"'
+
+
+@pytest.fixture
+def database():
+    """Local flashcard storage behind the routes"""
+    manager = DatabaseManager()
+    main.app.dependency_overrides[main.get_database] = lambda: AsyncDatabaseManager(manager)
+    yield manager
+    del main.app.dependency_overrides[main.get_database]
+    manager.close()
+
+
+def test_flashcard_list_revalidates_against_the_collection_version(database):
+    database.create_flashcard(Flashcard(original_text="one", translated_text="หนึ่ง"))
+    response = get("/flashcards/")
+    etag = response.headers["etag"]
+    assert response.status_code == 200 and len(response.json()) == 1
+
+    assert get("/flashcards/", headers={"If-None-Match": etag}).status_code == 304
+    database.create_flashcard(Flashcard(original_text="two", translated_text="สอง"))
+    response = get("/flashcards/", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+
+
+def test_change_feed_pages_through_writes_and_deletes(database):
+    cards = [database.create_flashcard(Flashcard(original_text=text, translated_text=text)) for text in ("a", "b", "c")]
+    database.delete_flashcard(cards[0].id)
+
+    page = get("/flashcards/changes", params={"limit": 1}).json()
+    assert [change["id"] for change in page["changes"]] == [cards[1].id]
+    assert page["has_more"]
+
+    page = get("/flashcards/changes", params={"since": page["version"]}).json()
+    assert [(change["id"], change["deleted"]) for change in page["changes"]] == [(cards[2].id, False), (cards[0].id, True)]
+    assert not page["has_more"]
+
+    page = get("/flashcards/changes", params={"since": page["version"]}).json()
+    assert page["changes"] == [] and page["version"] == database.flashcards_version()
+
+
+def test_change_feed_from_before_pruned_deletes_is_gone(database):
+    card = database.create_flashcard(Flashcard(original_text="a", translated_text="a"))
+    database.delete_flashcard(card.id)
+    database.in_memory_storage.prune_tombstones(time.time() + 1)
+
+    response = get("/flashcards/changes", params={"since": card.version})
+    assert response.status_code == 410
+    assert get("/flashcards/changes").status_code == 200
@@ -0,0 +1,146 @@
+"""Token buckets, daily Gemini token budgets and the 429 middleware"""
+import asyncio
+import json
+
+import mongomock
+import pytest
+
+from rate_limit import (
+    GLOBAL_KEY,
+    MemoryBackend,
+    MongoBackend,
+    RateLimiter,
+    RateLimitMiddleware,
+    client_key,
+    key_digest,
+    utc_day
+)
+
+NOW = 1_700_000_000.0
+PER_SECOND = 1.0  # per_minute=60
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    backend = MemoryBackend()
+    assert [backend.take("ip:a", PER_SECOND, 3, NOW) for _ in range(3)] == [0.0] * 3
+    assert backend.take("ip:a", PER_SECOND, 3, NOW) == pytest.approx(1.0)
+    # Other clients have their own buckets
+    assert backend.take("ip:b", PER_SECOND, 3, NOW) == 0.0
+
+    assert backend.take("ip:a", PER_SECOND, 3, NOW + 0.5) == pytest.approx(0.5)
+    assert backend.take("ip:a", PER_SECOND, 3, NOW + 1.0) == 0.0
+    # Never more than the burst, however long the bucket was idle
+    assert [backend.take("ip:a", PER_SECOND, 3, NOW + 3600) for _ in range(4)][-1] > 0
+
+
+def test_budgets_refuse_until_the_next_day():
+    limiter = RateLimiter(per_minute=60, burst=100, daily_budget=1000, client_daily_budget=300)
+    day = utc_day(NOW)
+    limiter.local.add_usage("ip:a", day, 300)
+    reason, wait = limiter._check("ip:a", NOW)
+    assert reason == "client_budget" and 0 < wait <= 86400
+    assert limiter._check("ip:b", NOW) is None
+
+    limiter.local.add_usage(GLOBAL_KEY, day, 1000)
+    assert limiter._check("ip:b", NOW)[0] == "global_budget"
+    assert limiter._check("ip:b", NOW + 86400) is None
+
+
+def test_record_usage_charges_the_client_and_the_global_total():
+    limiter = RateLimiter()
+    limiter.record_usage("ip:a", 120)
+    limiter.record_usage(None, 30)
+    assert limiter.local.usage("ip:a", utc_day()) == 120
+    assert limiter.stats()["tokens_today"] == 150
+
+
+class ContendedCollection:
+    """A bucket collection another process updates between every read and write"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def update_one(self, query, update, **kwargs):
+        self.collection.update_one({"_id": query["_id"]}, {"$inc": {"updated": 0.001}})
+        return self.collection.update_one(query, update, **kwargs)
+
+
+class FakeDatabase:
+    def __init__(self, contended: bool = False):
+        self.db = mongomock.MongoClient()["flashcard_test"]
+        self.use_mongodb = True
+        if contended:
+            self.db = {
+                "rate_limits": ContendedCollection(self.db["rate_limits"]),
+                "gemini_usage": self.db["gemini_usage"]
+            }
+
+
+def test_mongo_buckets_are_shared_by_limiters():
+    database = FakeDatabase()
+    first = RateLimiter(MongoBackend(database), per_minute=60, burst=2)
+    second = RateLimiter(MongoBackend(database), per_minute=60, burst=2)
+    assert first._check("ip:a", NOW) is None
+    assert second._check("ip:a", NOW) is None
+    assert first._check("ip:a", NOW)[0] == "rate"
+
+    first.record_usage("ip:a", 50)
+    assert second.backend.usage("ip:a", utc_day()) == 50
+
+
+def test_mongo_bucket_under_contention_refuses_rather_than_admits():
+    limiter = RateLimiter(MongoBackend(FakeDatabase(contended=True)), per_minute=60, burst=5)
+    assert limiter._check("ip:a", NOW) is None  # A new bucket is inserted, not updated
+    reason, wait = limiter._check("ip:a", NOW)
+    assert reason == "rate" and wait == pytest.approx(1.0)
+
+
+def test_limiter_falls_back_to_local_buckets_while_mongodb_is_down():
+    database = FakeDatabase()
+    database.use_mongodb = False
+    limiter = RateLimiter(MongoBackend(database), per_minute=60, burst=1)
+    assert limiter._check("ip:a", NOW) is None
+    assert limiter._check("ip:a", NOW)[0] == "rate"
+    assert "ip:a" in limiter.local.buckets
+
+
+def test_client_key_only_trusts_configured_api_keys():
+    known = frozenset({key_digest(b"secret")})
+    scope = {"client": ("10.0.0.1", 5000), "headers": [(b"x-api-key", b"secret")]}
+    assert client_key(scope, api_keys=known) == "key:" + key_digest(b"secret")[:16]
+    scope["headers"] = [(b"x-api-key", b"made-up")]
+    assert client_key(scope, api_keys=known) == "ip:10.0.0.1"
+
+
+def test_middleware_refuses_with_retry_after():
+    limiter = RateLimiter(per_minute=6, burst=1)
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = RateLimitMiddleware(app, limiter=limiter, enabled=True)
+
+    def post(path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": [], "client": ("10.0.0.1", 5000)}
+        asyncio.run(middleware(scope, None, send))
+        return sent
+
+    assert post("/generate-flashcard/")[0]["status"] == 200
+    refused = post("/generate-flashcard/")
+    headers = dict(refused[0]["headers"])
+    assert refused[0]["status"] == 429 and headers[b"retry-after"] == b"10"
+    assert json.loads(refused[1]["body"]) == {"detail": "Too many requests"}
+    # Routes that do not call Gemini are not limited
+    assert post("/flashcards/")[0]["status"] == 200
+    assert called == ["/generate-flashcard/", "/flashcards/"]
@@ -0,0 +1,177 @@
+"""Retries, deadlines, hedging, call slots and the circuit breaker"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ConcurrencyLimiter,
+    InvalidReplyError,
+    ResilientCaller,
+    SaturatedError
+)
+
+
+def retryable(error: BaseException) -> bool:
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError, InvalidReplyError))
+
+
+def make_caller(**options) -> ResilientCaller:
+    settings = dict(
+        timeout=1.0,
+        deadline=5.0,
+        retries=2,
+        backoff=0.001,
+        max_backoff=0.001,
+        retryable=retryable,
+        breaker=CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    )
+    settings.update(options)
+    return ResilientCaller("test", **settings)
+
+
+def failing(*errors):
+    """Attempt raising the given errors in turn, then answering "ok"; records the timeouts it was given"""
+    errors = list(errors)
+    timeouts = []
+
+    def attempt(timeout):
+        timeouts.append(timeout)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    attempt.timeouts = timeouts
+    return attempt
+
+
+def test_retryable_errors_are_retried():
+    caller = make_caller()
+    attempt = failing(ConnectionError(), InvalidReplyError())
+    assert caller.call("op", attempt) == "ok"
+    assert len(attempt.timeouts) == 3
+    assert caller.breaker.failures == 0
+
+
+def test_other_errors_are_raised_at_once_and_do_not_open_the_circuit():
+    caller = make_caller(breaker=CircuitBreaker("test", failure_threshold=1, reset_timeout=60))
+    attempt = failing(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        caller.call("op", attempt)
+    assert len(attempt.timeouts) == 1
+    assert not caller.breaker.is_open
+
+
+def test_last_error_is_raised_when_retries_run_out():
+    caller = make_caller(retries=1)
+    with pytest.raises(ConnectionError):
+        caller.call("op", failing(ConnectionError(), ConnectionError(), ConnectionError()))
+
+
+def test_no_retry_is_started_past_the_deadline():
+    caller = make_caller(deadline=0.5, backoff=1.0, max_backoff=1.0)
+    attempt = failing(ConnectionError())
+    with pytest.raises(ConnectionError):
+        caller.call("op", attempt)
+    assert len(attempt.timeouts) == 1
+    # An attempt never gets longer than what is left of the deadline
+    assert attempt.timeouts[0] <= 0.5
+
+
+def test_circuit_opens_after_consecutive_failures_and_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+    caller = make_caller(retries=0, breaker=breaker)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            caller.call("op", failing(ConnectionError()))
+    attempt = failing()
+    with pytest.raises(CircuitOpenError) as refused:
+        caller.call("op", attempt)
+    assert refused.value.retry_after >= 1.0
+    assert attempt.timeouts == []
+
+    time.sleep(0.06)
+    breaker.allow()  # The probe
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert caller.call("op", failing()) == "ok"
+
+
+def test_invalid_replies_do_not_open_the_circuit():
+    caller = make_caller(retries=0, breaker=CircuitBreaker("test", failure_threshold=1, reset_timeout=60))
+    with pytest.raises(InvalidReplyError):
+        caller.call("op", failing(InvalidReplyError()))
+    assert not caller.breaker.is_open
+
+
+def test_slow_async_attempts_time_out_and_are_retried():
+    caller = make_caller(timeout=0.05)
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+
+    assert asyncio.run(caller.call_async("op", attempt)) == "ok"
+    assert len(calls) == 2
+    assert caller.breaker.failures == 0
+
+
+def test_hedged_duplicate_answers_for_a_slow_attempt():
+    caller = make_caller(retries=0, hedge=True, hedge_quantile=0.5)
+    for _ in range(20):
+        caller._tracker("op").record(0.01)
+    started = []
+    cancelled = []
+
+    async def attempt(timeout):
+        started.append(timeout)
+        if len(started) == 1:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "slow"
+        return "hedged"
+
+    began = time.monotonic()
+    assert asyncio.run(caller.call_async("op", attempt)) == "hedged"
+    assert time.monotonic() - began < 0.5
+    assert cancelled == [True]
+
+
+def test_attempts_without_a_free_slot_fail_without_touching_the_circuit():
+    limiter = ConcurrencyLimiter(1)
+    assert limiter.acquire(0)
+    caller = make_caller(deadline=0.05, retries=0, limiter=limiter,
+                         breaker=CircuitBreaker("test", failure_threshold=1, reset_timeout=60))
+    attempt = failing()
+    with pytest.raises(SaturatedError):
+        caller.call("op", attempt)
+    assert attempt.timeouts == []
+    assert not caller.breaker.is_open
+
+
+def test_slots_are_shared_by_threads_and_coroutines():
+    limiter = ConcurrencyLimiter(1)
+    assert limiter.acquire(0)
+
+    async def main():
+        assert not await limiter.acquire_async(0.01)
+        waiter = asyncio.ensure_future(limiter.acquire_async(5))
+        await asyncio.sleep(0.01)
+        # Released from another thread: the slot goes to the waiting coroutine
+        threading.Thread(target=limiter.release).start()
+        assert await waiter
+        assert not limiter.acquire(0.01)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.active == 0
@@ -0,0 +1,139 @@
+"""Crash recovery, compaction and multi-process sharing of the local storage engine"""
+import os
+import threading
+
+import pytest
+
+from storage_engine import MemoryStore, fcntl
+
+needs_fcntl = pytest.mark.skipif(fcntl is None, reason="shared mode needs fcntl")
+
+
+def card(flashcard_id: str, text: str = "hello") -> dict:
+    return {"id": flashcard_id, "original_text": text, "translated_text": "สวัสดี", "due": 0.0}
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open stores on one data directory, like worker processes would; all are closed afterwards"""
+    stores = []
+
+    def opener(**options) -> MemoryStore:
+        options.setdefault("persist", True)
+        options.setdefault("snapshot_interval", 3600)
+        store = MemoryStore(data_dir=str(tmp_path), **options)
+        stores.append(store)
+        return store
+
+    yield opener
+    for store in stores:
+        store.close()
+
+
+def tear_last_record(store: MemoryStore, keep: int = 10):
+    """Cut the log inside its last record, as a crash in the middle of a write would"""
+    with open(store.log_path, "rb") as log:
+        records = log.read().splitlines(keepends=True)
+    os.truncate(store.log_path, sum(map(len, records[:-1])) + keep)
+
+
+def test_recovery_drops_a_torn_record_and_keeps_later_writes(open_store):
+    crashed = open_store(shared=False)
+    for flashcard_id in ("a", "b", "c"):
+        crashed.insert(card(flashcard_id))
+    tear_last_record(crashed)
+
+    recovered = open_store(shared=False)
+    assert sorted(recovered.documents) == ["a", "b"]
+
+    # Written after the torn record, so it must not be glued onto it
+    recovered.insert(card("d"))
+    assert sorted(open_store(shared=False).documents) == ["a", "b", "d"]
+
+
+@needs_fcntl
+def test_shared_recovery_terminates_a_torn_record(open_store):
+    crashed = open_store(shared=True)
+    for flashcard_id in ("a", "b", "c"):
+        crashed.insert(card(flashcard_id))
+    tear_last_record(crashed)
+
+    worker = open_store(shared=True)
+    assert sorted(worker.documents) == ["a", "b"]
+    worker.insert(card("d"))
+
+    assert sorted(open_store(shared=True).documents) == ["a", "b", "d"]
+
+
+def test_compaction_racing_a_writer_loses_nothing(open_store):
+    store = open_store(shared=False, compact_ops=1000)
+    written = [f"card-{number:04d}" for number in range(500)]
+    done = threading.Event()
+
+    def compact_until_done():
+        while not done.is_set():
+            store.compact()
+
+    compactor = threading.Thread(target=compact_until_done)
+    compactor.start()
+    try:
+        for flashcard_id in written:
+            store.insert(card(flashcard_id))
+            if flashcard_id.endswith("7"):
+                store.update(flashcard_id, {"translated_text": "updated"})
+    finally:
+        done.set()
+        compactor.join()
+
+    reopened = open_store(shared=False)
+    assert sorted(reopened.documents) == written
+    assert reopened.get("card-0007")["translated_text"] == "updated"
+
+
+@needs_fcntl
+def test_shared_compaction_racing_another_worker_loses_nothing(open_store):
+    writer = open_store(shared=True, versioned=True)
+    compactor = open_store(shared=True, versioned=True)
+    written = [f"card-{number:04d}" for number in range(300)]
+    done = threading.Event()
+
+    def compact_until_done():
+        while not done.is_set():
+            compactor.insert(card(f"compactor-{len(compactor)}"))
+            compactor.compact()
+
+    thread = threading.Thread(target=compact_until_done)
+    thread.start()
+    try:
+        for flashcard_id in written:
+            writer.insert(card(flashcard_id))
+    finally:
+        done.set()
+        thread.join()
+
+    expected = [document["id"] for document in compactor.iter()]
+    assert set(written) <= set(expected)
+    assert [document["id"] for document in writer.iter()] == expected
+    reopened = open_store(shared=True, versioned=True)
+    assert [document["id"] for document in reopened.iter()] == expected
+    # Every write got its own version, in log order, whoever compacted in between
+    versions = sorted(document["version"] for document in reopened.iter())
+    assert versions == list(range(1, len(expected) + 1))
+
+
+@needs_fcntl
+def test_shared_stores_read_each_others_writes(open_store):
+    first = open_store(shared=True, versioned=True)
+    second = open_store(shared=True, versioned=True)
+
+    created = first.insert(card("a"))
+    assert second.get("a")["version"] == created["version"]
+
+    second.update("a", {"translated_text": "updated"})
+    assert first.get("a")["translated_text"] == "updated"
+
+    assert first.delete("a")
+    assert second.get("a") is None
+    assert [change["id"] for change in second.changes(0, 10)] == ["a"]
+    assert second.changes(0, 10)[0]["deleted"]
+    assert first.current_version() == second.current_version() == 3
@@ -0,0 +1,104 @@
+"""Single-flight deduplication of concurrent identical translations"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from translation_cache import TranslationCache
+
+KEY = "en:th:apple"
+RESULT = {"translated_text": "แอปเปิ้ล"}
+
+
+class GeminiDown(Exception):
+    pass
+
+
+def run_concurrently(cache: TranslationCache, compute, callers: int = 3) -> list:
+    """Start identical lookups while the first one is still computing; returns results or raised errors"""
+    async def main():
+        tasks = [asyncio.create_task(cache.get_or_compute_async(KEY, compute)) for _ in range(callers)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_concurrent_lookups_share_one_gemini_call():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return RESULT
+
+    cache = TranslationCache(database=None)
+    assert run_concurrently(cache, compute) == [RESULT] * 3
+    assert len(calls) == 1
+    assert cache.stats()["deduplicated"] == 2
+
+
+def test_waiters_get_the_leaders_error_instead_of_a_failure():
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise GeminiDown("boom")
+
+    cache = TranslationCache(database=None)
+    results = run_concurrently(cache, compute)
+    assert all(isinstance(result, GeminiDown) for result in results)
+    # Nothing was cached, so the next lookup calls Gemini again
+    assert cache.stats()["entries"] == 0
+
+
+def test_a_cancelled_leader_hands_the_call_to_a_waiter():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return RESULT
+
+    async def main():
+        cache = TranslationCache(database=None)
+        leader = asyncio.create_task(cache.get_or_compute_async(KEY, compute))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(cache.get_or_compute_async(KEY, compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(main()) == [RESULT, RESULT]
+    # The leader's call, then one call by the waiter that took over
+    assert len(calls) == 2
+
+
+def test_threaded_waiters_get_the_leaders_error():
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise GeminiDown("boom")
+
+    cache = TranslationCache(database=None)
+    errors = []
+
+    def lookup():
+        try:
+            cache.get_or_compute(KEY, compute)
+        except GeminiDown as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookup)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=lookup))
+    threads[1].start()
+    while cache.stats()["deduplicated"] < 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 2
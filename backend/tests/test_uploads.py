@@ -0,0 +1,116 @@
+"""Upload spooling, multipart streaming, resumable sessions and the body size limit"""
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from uploads import (
+    UploadLimitMiddleware,
+    UploadOffsetError,
+    UploadSessions,
+    UploadTooLargeError,
+    iter_multipart_file,
+    spool_upload
+)
+
+IMAGE = bytes(range(256)) * 40
+
+
+async def chunked(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def multipart_body(fields: dict, boundary: str = "XyZ") -> bytes:
+    parts = []
+    for name, value in fields.items():
+        filename = '; filename="photo.jpg"' if isinstance(value, bytes) else ""
+        data = value if isinstance(value, bytes) else value.encode()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"{filename}\r\n\r\n'.encode() + data + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+
+def test_spool_upload_removes_an_oversized_upload(tmp_path):
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(spool_upload(chunked(IMAGE, 1000), max_bytes=len(IMAGE) - 1, directory=str(tmp_path)))
+    assert os.listdir(tmp_path) == []
+
+
+def test_multipart_file_is_streamed_to_the_spool(tmp_path):
+    body = multipart_body({"note": "ignored", "file": IMAGE, "other": b"not this one"})
+    chunks = iter_multipart_file(chunked(body), "multipart/form-data; boundary=XyZ", chunk_size=100)
+    with asyncio.run(spool_upload(chunks, directory=str(tmp_path))) as upload:
+        with open(upload.path, "rb") as spooled:
+            assert spooled.read() == IMAGE
+        assert (upload.size, upload.sha256) == (len(IMAGE), hashlib.sha256(IMAGE).hexdigest())
+    assert os.listdir(tmp_path) == []
+
+
+def test_multipart_without_the_file_field_is_refused(tmp_path):
+    body = multipart_body({"image": IMAGE})
+    chunks = iter_multipart_file(chunked(body), "multipart/form-data; boundary=XyZ")
+    with pytest.raises(ValueError, match="no 'file' field"):
+        asyncio.run(spool_upload(chunks, directory=str(tmp_path)))
+    assert os.listdir(tmp_path) == []
+
+
+def test_resumable_upload_resumes_from_the_stored_offset(tmp_path):
+    sessions = UploadSessions(directory=str(tmp_path))
+    session = sessions.create(len(IMAGE), sha256=hashlib.sha256(IMAGE).hexdigest())
+    half = len(IMAGE) // 2
+
+    async def main():
+        state = await sessions.append(session["id"], 0, chunked(IMAGE[:half], 1000))
+        assert (state["offset"], state["complete"]) == (half, False)
+        with pytest.raises(UploadOffsetError) as refused:
+            await sessions.append(session["id"], half + 1, chunked(IMAGE[half + 1:]))
+        assert refused.value.offset == half
+        return await sessions.append(session["id"], half, chunked(IMAGE[half:], 1000))
+
+    state = asyncio.run(main())
+    assert state["complete"] and state["sha256"] == hashlib.sha256(IMAGE).hexdigest()
+    with sessions.take(session["id"]) as upload:
+        assert upload.size == len(IMAGE)
+
+
+def test_chunk_past_the_declared_size_is_refused(tmp_path):
+    sessions = UploadSessions(directory=str(tmp_path))
+    session = sessions.create(10)
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(sessions.append(session["id"], 0, chunked(b"x" * 11, 4)))
+    # Whole chunks that fit are kept
+    assert sessions.get(session["id"])["offset"] == 8
+
+
+def test_limit_middleware_cuts_off_a_body_without_a_length():
+    seen = []
+    sent = []
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            seen.append(message["type"])
+            if message["type"] == "http.disconnect" or not message.get("more_body"):
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    messages = [{"type": "http.request", "body": b"x" * 40_000, "more_body": True} for _ in range(5)]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = UploadLimitMiddleware(app, ("/uploads",), max_bytes=100)
+    scope = {"type": "http", "path": "/uploads/abc", "headers": [(b"transfer-encoding", b"chunked")]}
+    asyncio.run(middleware(scope, receive, send))
+
+    assert seen[-1] == "http.disconnect"
+    assert [message.get("status") for message in sent if message["type"] == "http.response.start"] == [413]
+    # The body stopped being read at the limit
+    assert len(messages) == 3
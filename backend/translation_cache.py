@@ -0,0 +1,311 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+from database import DatabaseManager
+from tts_cache import normalize_text
+
+# Load environment variables
+load_dotenv()
+
+# Translation cache configuration
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "10000"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600)))  # 30 days
+TRANSLATION_CACHE_PERSIST = os.getenv("TRANSLATION_CACHE_PERSIST", "true").lower() == "true"
+
+
+class _Flight:
+    """A translation request in progress that identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[dict] = None
+        self.error: Optional[Exception] = None
+
+
+# Result an async flight resolves to when its leader was cancelled; waiters start a new flight
+_ABANDONED = object()
+
+
+class TranslationCache:
+    """In-process LRU/TTL cache of Gemini translations with single-flight deduplication"""
+
+    def __init__(
+        self,
+        max_entries: int = TRANSLATION_CACHE_SIZE,
+        ttl: int = TRANSLATION_CACHE_TTL,
+        database: Optional[DatabaseManager] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.database = database
+        self.lock = threading.Lock()
+        # key -> (expires_at, result), ordered from least to most recently used
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.in_flight: dict = {}
+        # key -> asyncio.Future shared by concurrent coroutines
+        self.async_in_flight: dict = {}
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.gemini_calls = 0
+        self.failures = 0
+
+    @staticmethod
+    def make_key(text: str, source_lang: str, target_lang: str) -> str:
+        """Build the cache key from normalized text and the language pair"""
+        # "v2": keys made before case was kept may hold the translation of another case; never hit them
+        return f"v2\x00{source_lang}\x00{target_lang}\x00{normalize_text(text)}"
+
+    def _get_local(self, key: str) -> Optional[dict]:
+        """Look up the in-process cache; caller holds the lock"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def _put_local(self, key: str, result: dict, expires_at: float):
+        """Add to the in-process cache; caller holds the lock"""
+        self.entries[key] = (expires_at, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _get_persistent(self, key: str) -> Optional[dict]:
+        """Look up the database-backed cache"""
+        if self.database is None or not self.database.use_mongodb:
+            return None
+        try:
+            cached = self.database.get_cached_translation(key, max_age=self.ttl)
+        except Exception as e:
+            print(f"Translation cache lookup failed: {e}")
+            return None
+        return cached
+
+    def _put_persistent(self, key: str, result: dict):
+        """Store in the database-backed cache"""
+        if self.database is None or not self.database.use_mongodb:
+            return
+        try:
+            self.database.set_cached_translation(key, result)
+        except Exception as e:
+            print(f"Translation cache store failed: {e}")
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        Return a cached translation without computing it
+
+        Args:
+            key: Cache key from make_key()
+
+        Returns:
+            Cached translation, or None on a miss
+        """
+        with self.lock:
+            result = self._get_local(key)
+            if result is not None:
+                self.hits += 1
+                return result
+
+        result = self._get_persistent(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.persistent_hits += 1
+                self._put_local(key, result, time.time() + self.ttl)
+        return result
+
+    def store(self, key: str, result: dict):
+        """
+        Cache a successful translation computed outside get_or_compute()
+
+        Args:
+            key: Cache key from make_key()
+            result: Translation result
+        """
+        with self.lock:
+            self._put_local(key, result, time.time() + self.ttl)
+        self._put_persistent(key, result)
+
+    def record_gemini_call(self, failed: bool = False):
+        """Count a Gemini request made outside get_or_compute()"""
+        with self.lock:
+            self.gemini_calls += 1
+            if failed:
+                self.failures += 1
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[dict]]) -> Optional[dict]:
+        """
+        Return a cached translation, or compute it exactly once for concurrent callers
+
+        Args:
+            key: Cache key from make_key()
+            compute: Calls Gemini; returns None when the request failed
+
+        Returns:
+            Translation result, or None if Gemini failed (failures are never cached)
+        """
+        with self.lock:
+            result = self._get_local(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            flight = self.in_flight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self.in_flight[key] = flight
+            else:
+                self.deduplicated += 1
+
+        if not is_leader:
+            # An identical request is already talking to Gemini; share its answer
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            result = self._get_persistent(key)
+            if result is not None:
+                with self.lock:
+                    self.persistent_hits += 1
+            else:
+                with self.lock:
+                    self.misses += 1
+                    self.gemini_calls += 1
+                result = compute()
+                if result is None:
+                    with self.lock:
+                        self.failures += 1
+                else:
+                    self._put_persistent(key, result)
+
+            if result is not None:
+                with self.lock:
+                    self._put_local(key, result, time.time() + self.ttl)
+            flight.result = result
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            flight.done.set()
+
+    async def lookup_async(self, key: str) -> Optional[dict]:
+        """Non-blocking version of lookup()"""
+        with self.lock:
+            result = self._get_local(key)
+            if result is not None:
+                self.hits += 1
+                return result
+
+        result = await asyncio.to_thread(self._get_persistent, key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.persistent_hits += 1
+                self._put_local(key, result, time.time() + self.ttl)
+        return result
+
+    async def get_or_compute_async(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Optional[dict]]]
+    ) -> Optional[dict]:
+        """
+        Non-blocking version of get_or_compute()
+
+        An error raised by the request that called Gemini is raised to the
+        identical requests waiting on it too. If that request is cancelled
+        (its client went away), one of the waiting requests calls Gemini instead.
+
+        Args:
+            key: Cache key from make_key()
+            compute: Returns a coroutine that calls Gemini; it resolves to None when the request failed
+
+        Returns:
+            Translation result, or None if Gemini failed (failures are never cached)
+        """
+        while True:
+            with self.lock:
+                result = self._get_local(key)
+                if result is not None:
+                    self.hits += 1
+                    return result
+                future = self.async_in_flight.get(key)
+                if future is None:
+                    future = asyncio.get_running_loop().create_future()
+                    self.async_in_flight[key] = future
+                    break
+
+            # An identical request is already talking to Gemini; share its answer
+            result = await asyncio.shield(future)
+            if result is not _ABANDONED:
+                with self.lock:
+                    self.deduplicated += 1
+                return result
+
+        try:
+            result = await asyncio.to_thread(self._get_persistent, key)
+            if result is not None:
+                with self.lock:
+                    self.persistent_hits += 1
+            else:
+                with self.lock:
+                    self.misses += 1
+                    self.gemini_calls += 1
+                result = await compute()
+                if result is None:
+                    with self.lock:
+                        self.failures += 1
+                else:
+                    await asyncio.to_thread(self._put_persistent, key, result)
+
+            if result is not None:
+                with self.lock:
+                    self._put_local(key, result, time.time() + self.ttl)
+        except asyncio.CancelledError:
+            future.set_result(_ABANDONED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieved here, so asyncio does not log it when nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self.async_in_flight.pop(key, None)
+        return result
+
+    def stats(self) -> dict:
+        """Return cache counters"""
+        with self.lock:
+            saved = self.hits + self.persistent_hits + self.deduplicated
+            lookups = saved + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+                "failures": self.failures,
+                "gemini_calls": self.gemini_calls,
+                "gemini_calls_saved": saved,
+                "hit_rate": saved / lookups if lookups else 0.0
+            }
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# TTS cache configuration
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so trivially different inputs share one cache entry
+
+    Only Unicode composition and whitespace are normalized. Case is kept:
+    "Polish" and "polish" or "US" and "us" are different words, translated
+    and pronounced differently.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split())
+
+
+def detect_language(text: str) -> str:
+    """Detect language (simple heuristic: if contains Thai characters, use Thai)"""
+    return 'th' if any('\u0E00' <= char <= '\u0E7F' for char in text) else 'en'
+
+
+class TTSCache:
+    """Content-addressed on-disk cache of synthesized MP3 audio with LRU eviction"""
+
+    def __init__(self, cache_dir: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> size in bytes, ordered from least to most recently used
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        """Index audio files left over from previous runs, oldest access first"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp3"):
+                # Leftover partial writes from a crash are never valid entries
+                if name.startswith(".tmp-"):
+                    try:
+                        os.unlink(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def make_key(text: str, lang: str, slow: bool = False) -> str:
+        """Build the cache key from normalized text, language and speed"""
+        speed = "slow" if slow else "normal"
+        # "v2": keys made before case was kept may hold audio of another case; never hit them
+        raw = f"v2\x00{lang}\x00{speed}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        """Return the on-disk path for a cache key"""
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the path of a cached entry and mark it as recently used"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            path = self.path_for(key)
+            if not os.path.exists(path):
+                # File removed behind our back; forget it
+                self.total_bytes -= self.entries.pop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        try:
+            # Persist recency so LRU order survives restarts
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def contains(self, key: str) -> bool:
+        """Whether an entry is cached, without counting a lookup or touching its recency"""
+        with self.lock:
+            return key in self.entries
+
+    def put_file(self, key: str, write_func) -> str:
+        """
+        Atomically add an entry to the cache
+
+        Args:
+            key: Cache key
+            write_func: Callable that writes the audio to the path it is given
+
+        Returns:
+            Path of the cached file
+        """
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".mp3", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            write_func(temp_path)
+            size = os.path.getsize(temp_path)
+            path = self.path_for(key)
+            os.replace(temp_path, path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self._add_entry(key, size)
+        return path
+
+    def open_entry(self, key: str) -> "PendingEntry":
+        """
+        Start writing an entry incrementally
+
+        Args:
+            key: Cache key
+
+        Returns:
+            PendingEntry to write chunks to, then commit() or abort()
+        """
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".mp3", dir=self.cache_dir)
+        return PendingEntry(self, key, os.fdopen(fd, "wb"), temp_path)
+
+    def _add_entry(self, key: str, size: int):
+        """Register a file just moved into place and enforce the size bound"""
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)
+            self.entries[key] = size
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits its size bound"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self.path_for(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Return cache counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class PendingEntry:
+    """A cache entry being written; invisible to readers until committed"""
+
+    def __init__(self, cache: TTSCache, key: str, file, temp_path: str):
+        self.cache = cache
+        self.key = key
+        self.file = file
+        self.temp_path = temp_path
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> str:
+        """Atomically publish the entry; returns its path"""
+        self.file.close()
+        path = self.cache.path_for(self.key)
+        os.replace(self.temp_path, path)
+        self.cache._add_entry(self.key, self.size)
+        return path
+
+    def abort(self):
+        """Discard the partial entry"""
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Set
+from dotenv import load_dotenv
+from gtts import gTTS
+from tts_cache import detect_language, TTSCache
+from metrics import TTS_PREFETCH, span
+
+# Load environment variables
+load_dotenv()
+
+# Prefetch configuration
+TTS_PREFETCH_ENABLED = os.getenv("TTS_PREFETCH_ENABLED", "true").lower() == "true"
+TTS_PREFETCH_WORKERS = int(os.getenv("TTS_PREFETCH_WORKERS", "2"))
+TTS_PREFETCH_MAX_PENDING = int(os.getenv("TTS_PREFETCH_MAX_PENDING", "200"))  # syntheses queued before new ones are dropped
+
+# Card fields read aloud, by the side name used in /flashcards/{id}/audio/{side}
+AUDIO_SIDES = {"original": "original_text", "translated": "translated_text"}
+
+
+def side_audio_key(text: str, slow: bool = False) -> str:
+    """TTS cache key for a card side; it changes with the text, so edited cards never play stale audio"""
+    return TTSCache.make_key(text, detect_language(text), slow)
+
+
+class TTSPrefetcher:
+    """
+    Synthesizes the audio of both card sides in the background
+
+    Runs in its own small thread pool so prefetching never competes with
+    interactive /tts/ requests. Audio lands in the shared TTS cache, which is
+    content-addressed, so a later request for the same text is a cache hit.
+    """
+
+    def __init__(
+        self,
+        cache: TTSCache,
+        workers: int = TTS_PREFETCH_WORKERS,
+        max_pending: int = TTS_PREFETCH_MAX_PENDING,
+        enabled: bool = TTS_PREFETCH_ENABLED
+    ):
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.pending: Set[str] = set()
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Start the worker threads on first use"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tts-prefetch")
+        return self.executor
+
+    def prefetch(self, flashcard, sides: Iterable[str] = AUDIO_SIDES):
+        """
+        Queue synthesis of a flashcard's sides that are not cached yet
+
+        Args:
+            flashcard: Flashcard (model or dict) whose text to synthesize
+            sides: Side names (keys of AUDIO_SIDES) to prefetch
+        """
+        if not self.enabled:
+            return
+        data = flashcard if isinstance(flashcard, dict) else flashcard.model_dump()
+        for side in sides:
+            text = (data.get(AUDIO_SIDES[side]) or "").strip()
+            if not text:
+                continue
+            key = side_audio_key(text)
+            with self.lock:
+                if key in self.pending:
+                    continue
+                if self.cache.contains(key):
+                    TTS_PREFETCH.labels("cached").inc()
+                    continue
+                if len(self.pending) >= self.max_pending:
+                    TTS_PREFETCH.labels("dropped").inc()
+                    continue
+                self.pending.add(key)
+            self._get_executor().submit(self._synthesize, key, text)
+
+    def _synthesize(self, key: str, text: str):
+        try:
+            if self.cache.contains(key):
+                # A /tts/ request got there first
+                TTS_PREFETCH.labels("cached").inc()
+                return
+            tts = gTTS(text=text, lang=detect_language(text))
+            with span("tts.prefetch"):
+                self.cache.put_file(key, tts.save)
+            TTS_PREFETCH.labels("synthesized").inc()
+        except Exception as e:
+            TTS_PREFETCH.labels("failed").inc()
+            print(f"TTS prefetch failed: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def close(self):
+        """Stop the worker threads, dropping queued syntheses"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
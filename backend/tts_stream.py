@@ -0,0 +1,146 @@
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Iterator, Optional, Tuple
+from dotenv import load_dotenv
+from tts_cache import TTSCache
+from metrics import record_payload, span
+
+# Load environment variables
+load_dotenv()
+
+# Size of the byte chunks sent to clients
+TTS_CHUNK_SIZE = int(os.getenv("TTS_CHUNK_SIZE", str(16 * 1024)))
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_DONE = object()
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range HTTP Range header
+
+    Args:
+        header: Range header value
+        size: Full length of the resource in bytes
+
+    Returns:
+        Inclusive (start, end) byte positions, or None to send the whole resource
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multiple or malformed ranges: ignoring the header is allowed
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, end
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = TTS_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield bytes start..end (inclusive) of a file in fixed-size chunks"""
+    with open(path, "rb") as audio_file:
+        audio_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = audio_file.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+async def stream_speech(
+    tts,
+    cache: TTSCache,
+    key: str,
+    executor: Executor,
+    chunk_size: int = TTS_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Synthesize speech straight into a response while filling the cache
+
+    gTTS splits long text into sentence-sized segments and stream() yields the
+    audio of each segment as soon as it is synthesized, so playback starts
+    before later segments are done. Synthesis runs in `executor`; every
+    segment is written to a pending cache entry and handed to the client in
+    `chunk_size` byte chunks. The entry is committed only once synthesis
+    completes, and discarded if it fails or the client disconnects.
+
+    The first segment is synthesized before this returns, so synthesis errors
+    surface before any response has started.
+
+    Args:
+        tts: gTTS instance
+        cache: Cache to tee the audio into
+        key: Cache key for the audio
+        executor: Executor to run synthesis in
+        chunk_size: Size of the yielded chunks
+
+    Returns:
+        Async iterator over the MP3 bytes
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        entry = cache.open_entry(key)
+        try:
+            with span("tts.synthesize"):
+                for segment in tts.stream():
+                    if cancelled.is_set():
+                        break
+                    entry.write(segment)
+                    loop.call_soon_threadsafe(queue.put_nowait, segment)
+            record_payload("tts.synthesize", entry.size)
+        except Exception as e:
+            entry.abort()
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+            return
+        if cancelled.is_set():
+            entry.abort()
+        else:
+            entry.commit()
+        loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    loop.run_in_executor(executor, produce)
+
+    first = await queue.get()
+    if isinstance(first, Exception):
+        raise first
+
+    async def iter_chunks():
+        buffer = bytearray()
+        item = first
+        try:
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    raise item
+                buffer += item
+                while len(buffer) >= chunk_size:
+                    yield bytes(buffer[:chunk_size])
+                    del buffer[:chunk_size]
+                item = await queue.get()
+            if buffer:
+                yield bytes(buffer)
+        finally:
+            # Stops synthesis after the current segment if the client went away
+            cancelled.set()
+
+    return iter_chunks()
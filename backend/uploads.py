@@ -0,0 +1,492 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from multipart.multipart import MultipartParser, parse_options_header
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+
+# Upload configuration
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))  # largest accepted image
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # bytes read from a multipart file at a time
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))  # seconds an unused session is kept
+MULTIPART_OVERHEAD = 64 * 1024  # boundaries and form fields around the file in a multipart body
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload grows past its size limit"""
+
+
+class UploadOffsetError(ValueError):
+    """Raised when a chunk does not start where the stored upload ends"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadIncompleteError(ValueError):
+    """Raised when an upload session is used before all its bytes arrived"""
+
+
+class SpooledUpload:
+    """An upload written to disk, with its size and SHA-256; use as a context manager to remove the file"""
+
+    def __init__(self, path: str, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def discard(self):
+        """Remove the file, if it still exists"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.discard()
+
+
+class _MultipartFileReader:
+    """Streaming multipart parser callbacks collecting the bytes of the first part named `field`"""
+
+    def __init__(self, field: str):
+        self.field = field.encode()
+        self.header_field = b""
+        self.header_value = b""
+        self.disposition = b""
+        self.in_field = False
+        self.found = False
+        self.data: List[bytes] = []
+        self.buffered = 0
+
+    def on_part_begin(self):
+        self.disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_field.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.disposition)
+        self.in_field = not self.found and options.get(b"name") == self.field
+        self.found = self.found or self.in_field
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.in_field:
+            self.data.append(data[start:end])
+            self.buffered += end - start
+
+    def on_part_end(self):
+        self.in_field = False
+
+    def take(self) -> bytes:
+        """The bytes collected since the last call"""
+        data = b"".join(self.data)
+        self.data.clear()
+        self.buffered = 0
+        return data
+
+    def callbacks(self) -> dict:
+        names = (
+            "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+            "on_headers_finished", "on_part_data", "on_part_end"
+        )
+        return {name: getattr(self, name) for name in names}
+
+
+async def iter_multipart_file(
+    body: AsyncIterator[bytes],
+    content_type: str,
+    field: str = "file",
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Yield the bytes of one file field of a multipart/form-data body while the body arrives
+
+    Other fields are skipped. Unlike form parsing, the file is not first
+    copied to a temporary file of its own, so it is written to disk once.
+
+    Args:
+        body: Raw request body chunks (Request.stream())
+        content_type: Content-Type header of the request, with its boundary
+        field: Name of the form field holding the file
+        chunk_size: Bytes gathered before a chunk is yielded
+
+    Raises:
+        ValueError: If the body has no boundary or no such field
+    """
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing boundary in multipart body")
+    reader = _MultipartFileReader(field)
+    parser = MultipartParser(boundary, reader.callbacks())
+    async for chunk in body:
+        parser.write(chunk)
+        if reader.buffered >= chunk_size:
+            yield reader.take()
+    parser.finalize()
+    if reader.buffered:
+        yield reader.take()
+    if not reader.found:
+        raise ValueError(f"Multipart body has no '{field}' field")
+
+
+async def spool_upload(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    directory: str = UPLOAD_DIR
+) -> SpooledUpload:
+    """
+    Stream an upload to a file in `directory`, hashing it on the way
+
+    Only one chunk is held in memory at a time, and the upload is abandoned
+    as soon as it exceeds max_bytes. Chunks are written and hashed in a
+    worker thread, so large uploads do not hold up the event loop.
+
+    Raises:
+        UploadTooLargeError: If the upload is larger than max_bytes
+    """
+    os.makedirs(directory, exist_ok=True)
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".upload")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(handle, "wb") as spool:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                await asyncio.to_thread(_write_chunk, spool, hasher, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SpooledUpload(path, size, hasher.hexdigest())
+
+
+class UploadSessions:
+    """
+    Resumable uploads: the client declares the size, then sends the bytes in
+    any number of chunks, each starting at the offset the server reports
+
+    A session is a `<id>.part` file with a `<id>.json` sidecar in UPLOAD_DIR,
+    so the offset survives restarts and is visible to every worker sharing
+    the directory. The SHA-256 is updated as chunks arrive; after a restart
+    it is rebuilt from the part file once. A completed upload is consumed by
+    the request that uses it, and unused sessions expire after
+    UPLOAD_SESSION_TTL.
+    """
+
+    def __init__(
+        self,
+        directory: str = UPLOAD_DIR,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+        ttl: float = UPLOAD_SESSION_TTL
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.locks: Dict[str, List] = {}  # upload ID -> [lock, appends holding or waiting for it]
+        self.hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}  # upload ID -> (hashed bytes, hasher)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, upload_id: str, extension: str) -> str:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            raise KeyError(upload_id)
+        return os.path.join(self.directory, f"{upload_id}.{extension}")
+
+    def _load(self, upload_id: str) -> dict:
+        try:
+            with open(self._path(upload_id, "json"), "r", encoding="utf-8") as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+
+    def _save(self, meta: dict):
+        path = self._path(meta["id"], "json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(f"{path}.tmp", path)
+
+    def _describe(self, meta: dict) -> dict:
+        offset = os.path.getsize(self._path(meta["id"], "part"))
+        return {
+            "id": meta["id"],
+            "size": meta["size"],
+            "offset": offset,
+            "complete": offset == meta["size"],
+            "sha256": meta.get("sha256"),
+            "expires_at": meta["created_at"] + self.ttl
+        }
+
+    def create(self, size: int, sha256: Optional[str] = None) -> dict:
+        """
+        Start an upload of `size` bytes
+
+        Args:
+            size: Total upload size in bytes
+            sha256: Expected SHA-256 (hex); the upload is rejected on completion if it differs
+
+        Raises:
+            UploadTooLargeError: If size is over the upload limit
+        """
+        if size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {self.max_bytes} bytes")
+        self.prune()
+        meta = {
+            "id": uuid.uuid4().hex,
+            "size": size,
+            "expected_sha256": sha256.lower() if sha256 else None,
+            "sha256": None,
+            "created_at": time.time()
+        }
+        open(self._path(meta["id"], "part"), "wb").close()
+        self._save(meta)
+        return self._describe(meta)
+
+    def get(self, upload_id: str) -> Optional[dict]:
+        """State of an upload session: declared size, bytes received and, once complete, its SHA-256"""
+        try:
+            return self._describe(self._load(upload_id))
+        except (KeyError, FileNotFoundError):
+            return None
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Append a chunk that starts at `offset`
+
+        Whatever arrives before the connection drops is kept, so the client
+        resumes from the offset reported by get(). Appends to one session are
+        serialized in this worker, and the part file is locked against other
+        workers: a chunk arriving while another worker is writing one is
+        refused with UploadOffsetError.
+
+        Raises:
+            KeyError: If there is no such session
+            UploadOffsetError: If offset is not where the stored bytes end
+            UploadTooLargeError: If the chunk runs past the declared size
+            ValueError: If the completed upload does not match the expected SHA-256
+        """
+        entry = self.locks.setdefault(upload_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._append(upload_id, offset, chunks)
+        finally:
+            entry[1] -= 1
+            if not entry[1] and self.locks.get(upload_id) is entry:
+                del self.locks[upload_id]
+
+    async def _append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """Body of append(); caller holds the session's lock"""
+        meta, part = await asyncio.to_thread(self._open_part, upload_id, offset)
+        try:
+            part_path = self._path(upload_id, "part")
+            hashed, hasher = self.hashers.get(upload_id, (-1, None))
+            if hashed != offset:
+                # First chunk after a restart, or one written by another worker
+                hasher = await asyncio.to_thread(_hash_file, part_path)
+            received = offset
+            try:
+                async for chunk in chunks:
+                    if received + len(chunk) > meta["size"]:
+                        raise UploadTooLargeError(f"Chunk runs past the declared size of {meta['size']} bytes")
+                    await asyncio.to_thread(_write_chunk, part, hasher, chunk)
+                    received += len(chunk)
+            finally:
+                self.hashers[upload_id] = (received, hasher)
+
+            if received == meta["size"]:
+                self.hashers.pop(upload_id, None)
+                meta["sha256"] = hasher.hexdigest()
+                if meta["expected_sha256"] and meta["sha256"] != meta["expected_sha256"]:
+                    await asyncio.to_thread(self.delete, upload_id)
+                    raise ValueError("Upload does not match the expected SHA-256; start a new upload")
+                await asyncio.to_thread(self._save, meta)
+            return await asyncio.to_thread(self._describe, meta)
+        finally:
+            # Closing the file releases its lock
+            part.close()
+
+    def _open_part(self, upload_id: str, offset: int):
+        """Open a session's part file for appending, locked, after checking that `offset` is where it ends"""
+        meta = self._load(upload_id)
+        try:
+            part = open(self._path(upload_id, "part"), "ab", buffering=0)
+        except FileNotFoundError:
+            raise KeyError(upload_id)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another worker is appending to this session
+                    raise UploadOffsetError(os.fstat(part.fileno()).st_size)
+            current = os.fstat(part.fileno()).st_size
+            if offset != current:
+                raise UploadOffsetError(current)
+        except BaseException:
+            part.close()
+            raise
+        return meta, part
+
+    def take(self, upload_id: str) -> SpooledUpload:
+        """
+        Claim a completed upload; the session ends and the caller owns the file
+
+        Raises:
+            KeyError: If there is no such session
+            UploadIncompleteError: If bytes are still missing
+        """
+        meta = self._load(upload_id)
+        part_path = self._path(upload_id, "part")
+        size = os.path.getsize(part_path)
+        if size != meta["size"] or not meta.get("sha256"):
+            raise UploadIncompleteError(f"Upload has {size} of {meta['size']} bytes")
+        handle, path = tempfile.mkstemp(dir=self.directory, suffix=".upload")
+        os.close(handle)
+        os.replace(part_path, path)
+        os.unlink(self._path(upload_id, "json"))
+        self.hashers.pop(upload_id, None)
+        return SpooledUpload(path, size, meta["sha256"])
+
+    def delete(self, upload_id: str) -> bool:
+        """Cancel an upload session; returns False if there was none"""
+        try:
+            meta_path = self._path(upload_id, "json")
+        except KeyError:
+            return False
+        if not os.path.exists(meta_path):
+            return False
+        for path in (self._path(upload_id, "part"), meta_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.hashers.pop(upload_id, None)
+        return True
+
+    def prune(self) -> int:
+        """Remove sessions (and stray spool files) older than the TTL; returns how many sessions were removed"""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            upload_id, extension = os.path.splitext(name)
+            if extension == ".upload":
+                # Spool file orphaned by a crash while it was being used
+                path = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if extension != ".json" or not UPLOAD_ID_PATTERN.match(upload_id):
+                continue
+            try:
+                if self._load(upload_id)["created_at"] < cutoff and self.delete(upload_id):
+                    removed += 1
+            except (KeyError, ValueError):
+                continue
+        return removed
+
+
+def _write_chunk(part, hasher: "hashlib._Hash", chunk: bytes):
+    part.write(chunk)
+    hasher.update(chunk)
+
+
+def _hash_file(path: str) -> "hashlib._Hash":
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware refusing oversized uploads with 413
+
+    Applies to requests under the given path prefixes. A body declaring a
+    Content-Length above max_bytes (plus room for multipart framing) is
+    refused before it is read. Other bodies are counted as they arrive; once
+    one passes the limit the client gets the 413 and the application sees
+    the client disconnect, so a multipart form is never spooled past it.
+    """
+
+    def __init__(self, app, prefixes: Tuple[str, ...], max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.prefixes = prefixes
+        self.limit = max_bytes + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope.get("headers", [])).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.limit:
+            await self._refuse(send)
+            return
+
+        received = 0
+        started = refused = False
+
+        async def counting_receive():
+            nonlocal received, refused
+            if refused:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    refused = True
+                    if not started:
+                        await self._refuse(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if refused and message["type"].startswith("http.response"):
+                return  # The 413 has been sent in its place
+            started = True
+            await send(message)
+
+        await self.app(scope, counting_receive, guarded_send)
+
+    async def _refuse(self, send):
+        body = json.dumps({"detail": f"Upload exceeds {self.limit - MULTIPART_OVERHEAD} bytes"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
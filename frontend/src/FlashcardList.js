@@ -64,14 +64,15 @@ const FlashcardList = ({ refreshTrigger }) => {
     <div className="flashcard-list">
       {flashcards.map((card) => (
         <div key={card.id} className="flashcard">
-          {card.image && (
+          {card.image_url && (
             <img
-              src={`data:image/jpeg;base64,${card.image}`}
+              src={card.thumbnail_url || card.image_url}
               alt={card.original_text}
               className="flashcard-image"
+              loading="lazy"
             />
           )}
-          {!card.image && (
+          {!card.image_url && (
             <div className="flashcard-image" style={{ 
               display: 'flex', 
               alignItems: 'center', 
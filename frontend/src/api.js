@@ -59,13 +59,23 @@ export const generateFlashcardFromImage = async (imageFile, targetLanguage = 'th
 };
 
 /**
- * Get all flashcards
+ * Get all flashcards, following the server's pagination cursor
  * @returns {Promise} Array of flashcards
  */
 export const getAllFlashcards = async () => {
   try {
-    const response = await api.get('/flashcards/');
-    return response.data;
+    const flashcards = [];
+    let afterId = null;
+    do {
+      const params = { limit: 1000 };
+      if (afterId) {
+        params.after_id = afterId;
+      }
+      const response = await api.get('/flashcards/', { params });
+      flashcards.push(...response.data);
+      afterId = response.headers['x-next-after-id'] || null;
+    } while (afterId);
+    return flashcards;
   } catch (error) {
     console.error('Error fetching flashcards:', error);
     throw error;